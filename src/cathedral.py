@@ -6,30 +6,93 @@ Generates a GitHub-style, runnable REE implementation repo from scratch.
 No placeholders. No external downloads. Deterministic.
 
 Usage:
-  python build_ree_cathedral.py /path/to/output/REE-Cathedral
+  python build_ree_cathedral.py /path/to/output/REE-Cathedral [--check] [--no-prune]
 Then:
   cd REE-Cathedral
   python -m venv .venv && source .venv/bin/activate
   pip install -e ".[dev]"
   python examples/run_toy.py
   pytest -q
+
+Regeneration is incremental: files whose rendered content is unchanged are not
+rewritten (mtimes stay put), and files listed in the previous manifest that are
+no longer generated are removed. `--check` writes nothing and exits 1 on drift.
 """
 from __future__ import annotations
 
+import argparse
+import hashlib
+import json
 import os
 import textwrap
 from pathlib import Path
 
+MANIFEST = ".cathedral-manifest.json"
+
+# rel path -> rendered text, filled by w() during main()
+_RENDERED: dict[str, str] = {}
+
 
 def w(root: Path, rel: str, content: str) -> None:
-    p = root / rel
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(textwrap.dedent(content).lstrip(), encoding="utf-8")
+    _RENDERED[rel] = textwrap.dedent(content).lstrip()
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _disk_sha(p: Path) -> str | None:
+    try:
+        return _sha(p.read_bytes())
+    except FileNotFoundError:
+        return None
+
 
+def sync(root: Path, rendered: dict[str, str], check: bool = False, prune: bool = True) -> dict[str, list[str]]:
+    """Bring `root` in line with `rendered`; with check=True only report what would change.
 
-def main(out_dir: str) -> None:
+    Returns {"written", "unchanged", "pruned", "kept"} lists of relative paths ("kept":
+    stale files left alone because they were edited after generation).
+    """
+    report: dict[str, list[str]] = {"written": [], "unchanged": [], "pruned": [], "kept": []}
+    hashes = {}
+    for rel, text in sorted(rendered.items()):
+        data = text.encode("utf-8")
+        hashes[rel] = _sha(data)
+        p = root / rel
+        if _disk_sha(p) == hashes[rel]:
+            report["unchanged"].append(rel)
+            continue
+        report["written"].append(rel)
+        if not check:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_bytes(data)
+
+    manifest = root / MANIFEST
+    try:
+        previous = json.loads(manifest.read_text(encoding="utf-8")).get("files", {})
+    except FileNotFoundError:
+        previous = {}
+    for rel, sha in sorted(previous.items()):
+        if rel in rendered or _disk_sha(root / rel) is None:
+            continue
+        if prune and _disk_sha(root / rel) == sha:
+            report["pruned"].append(rel)
+            if not check:
+                (root / rel).unlink()
+        else:
+            report["kept"].append(rel)
+
+    if not check:
+        text = json.dumps({"generator": "cathedral.py", "files": hashes}, indent=2, sort_keys=True) + "\n"
+        if _disk_sha(manifest) != _sha(text.encode("utf-8")):
+            manifest.write_text(text, encoding="utf-8")
+    return report
+
+
+def main(out_dir: str, check: bool = False, prune: bool = True) -> int:
     root = Path(out_dir).resolve()
-    root.mkdir(parents=True, exist_ok=True)
+    _RENDERED.clear()
 
     # --- Top-level docs ---
     w(root, "README.md", """
@@ -70,6 +133,8 @@ def main(out_dir: str) -> None:
 
     [project.optional-dependencies]
     dev = ["pytest>=8.0", "ruff>=0.6"]
+    # optional JIT kernels, selected with REE_BACKEND=numba (see ree_impl.backend)
+    fast = ["numba>=0.59"]
 
     [tool.ruff]
     line-length = 100
@@ -87,6 +152,142 @@ def main(out_dir: str) -> None:
     \"\"\"
     """)
 
+    # --- Kernel backends ---
+    w(root, "src/ree_impl/backend.py", """
+    \"\"\"Registry of hot numerical kernels with swappable implementations.
+
+    Call sites fetch kernels by name via `kernel(name)`. The "numpy" backend is the
+    reference and always available; accelerated backends live in modules that are
+    imported only when selected, so their import / JIT cost is not paid otherwise.
+    A backend may implement a subset of kernels; the rest fall back to the reference.
+
+    Selection: `set_backend(name)`, or the REE_BACKEND environment variable read on
+    first use ("numpy" by default, "numba", or "auto" = fastest installed).
+    \"\"\"
+    from __future__ import annotations
+    import importlib
+    import os
+    import warnings
+    from typing import Callable, Dict, Optional
+
+    # backend name -> module exposing KERNELS: dict[str, Callable]
+    BACKENDS: Dict[str, str] = {
+        "numpy": "ree_impl.residue.kernels",
+        "numba": "ree_impl.residue.kernels_numba",
+    }
+    _AUTO_ORDER = ("numba", "numpy")
+
+    _active: Optional[str] = None
+    _table: Dict[str, Callable] = {}
+
+    def register_backend(name: str, module: str) -> None:
+        \"\"\"Make `module` (which must define KERNELS) selectable as backend `name`.\"\"\"
+        BACKENDS[name] = module
+
+    def _load(name: str) -> Dict[str, Callable]:
+        if name not in BACKENDS:
+            raise ValueError(f"unknown kernel backend {name!r}; known: {sorted(BACKENDS)}")
+        return importlib.import_module(BACKENDS[name]).KERNELS
+
+    def set_backend(name: str) -> str:
+        \"\"\"Select the kernel backend; returns the name actually in use.
+
+        An explicitly named backend that cannot be imported raises ImportError;
+        "auto" picks the first importable one in order of preference.
+        \"\"\"
+        global _active, _table
+        if name == "auto":
+            for candidate in _AUTO_ORDER:
+                try:
+                    return set_backend(candidate)
+                except ImportError:
+                    continue
+        table = dict(_load("numpy"))
+        if name != "numpy":
+            table.update(_load(name))
+        _active, _table = name, table
+        return name
+
+    def active_backend() -> str:
+        if _active is None:
+            _init_from_env()
+        return _active
+
+    def _init_from_env() -> None:
+        name = os.environ.get("REE_BACKEND", "numpy")
+        try:
+            set_backend(name)
+        except (ImportError, ValueError) as exc:
+            warnings.warn(f"REE_BACKEND={name!r} unavailable ({exc}); using numpy kernels", RuntimeWarning)
+            set_backend("numpy")
+
+    def kernel(name: str) -> Callable:
+        if _active is None:
+            _init_from_env()
+        return _table[name]
+    """)
+
+    # --- Reduced-precision storage ---
+    w(root, "src/ree_impl/precision.py", """
+    \"\"\"Reduced-precision storage formats for dent centers and latent weights.
+
+    "float16" rounds each value to 11 significant bits: |x - stored| <= 2**-11 * |x|
+    (plus 2**-25 for values in float16's subnormal range). Latents and weights are of
+    order 1, far inside its range. "int8" splits each row into blocks of `block`
+    values sharing one float32 scale (symmetric: scale = max|x| / 127 over the block):
+    |x - stored| <= scale / 2 per value, plus float32 rounding of the rescale.
+    Arithmetic always runs in float32 or wider on values decoded from storage.
+    \"\"\"
+    from __future__ import annotations
+    import numpy as np
+
+    # bound on |x - stored| / |x| for values stored in each float format
+    UNIT_ROUNDOFF = {"float64": 0.0, "float32": 2.0 ** -24, "float16": 2.0 ** -11}
+    _F16_SUBNORMAL = 2.0 ** -25
+
+    def _blocks(dim: int, block: int) -> int:
+        return -(-int(dim) // max(int(block), 1))
+
+    def quantize_int8(X: np.ndarray, block: int) -> tuple[np.ndarray, np.ndarray]:
+        \"\"\"(n, dim) floats -> (n, dim) int8 codes and (n, n_blocks) float32 scales.\"\"\"
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        n, dim = X.shape
+        nb = _blocks(dim, block)
+        pad = np.zeros((n, nb * block), dtype=np.float32)
+        pad[:, :dim] = X
+        pad = pad.reshape(n, nb, block)
+        scales = np.abs(pad).max(axis=2) / np.float32(127.0)
+        safe = np.where(scales > 0, scales, np.float32(1.0))
+        q = np.clip(np.rint(pad / safe[:, :, None]), -127, 127).astype(np.int8)
+        return q.reshape(n, nb * block)[:, :dim], scales.astype(np.float32)
+
+    def dequantize_int8(q: np.ndarray, scales: np.ndarray, block: int) -> np.ndarray:
+        \"\"\"Inverse of quantize_int8 (up to rounding), as float32.\"\"\"
+        out = q.astype(np.float32)
+        for b in range(scales.shape[1]):
+            out[:, b * block:(b + 1) * block] *= scales[:, b:b + 1]
+        return out
+
+    def row_error_bound(stored: np.ndarray, precision: str, scales: np.ndarray | None = None, block: int = 0) -> np.ndarray:
+        \"\"\"Per-row bound on the L2 distance between the original rows and their stored form.
+
+        `stored` is the decoded (float32) rows; `scales` / `block` are needed for "int8".
+        \"\"\"
+        stored = np.atleast_2d(np.asarray(stored, dtype=np.float64))
+        if precision in ("float32", "float64"):
+            return np.zeros(stored.shape[0])
+        if precision == "float16":
+            u = UNIT_ROUNDOFF["float16"]
+            return u / (1.0 - u) * np.linalg.norm(stored, axis=1) + np.sqrt(stored.shape[1]) * _F16_SUBNORMAL
+        if precision == "int8":
+            dim = stored.shape[1]
+            widths = np.minimum(block, dim - np.arange(scales.shape[1]) * block)
+            # half a code step, plus the float32 error of dividing by / multiplying with the scale
+            half = 0.5 + 2.0 ** -15
+            return half * np.sqrt((widths * scales.astype(np.float64) ** 2).sum(axis=1))
+        raise ValueError(f"unknown precision: {precision!r}")
+    """)
+
     # --- Core loop ---
     w(root, "src/ree_impl/core/agent.py", """
     from __future__ import annotations
@@ -95,8 +296,10 @@ def main(out_dir: str) -> None:
 
     import numpy as np
 
+    from ..hippocampus.path_memory import PathMemory
     from ..lspace.stack import LSpace, LState
     from ..planning.mpc import MPCPlanner
+    from .instrument import Instrumentation
     from ..residue.field import ResidueField
     from ..sleep.sleep import SleepSubsystem
     from ..social.coupling import CouplingModel
@@ -108,6 +311,9 @@ def main(out_dir: str) -> None:
         reality_cost: float
         ethical_cost: float
         residue_cost: float
+        # anytime planning: False if the budget cut the search; seconds past the deadline
+        complete: bool = True
+        overrun: float = 0.0
 
     class REEAgent:
         \"\"\"Executes the canonical REE online loop.\"\"\"
@@ -119,42 +325,84 @@ def main(out_dir: str) -> None:
             residue: ResidueField,
             coupling: CouplingModel,
             sleep: Optional[SleepSubsystem] = None,
+            instrument: Optional[Instrumentation] = None,
+            path_memory: Optional[PathMemory] = None,
         ):
             self.lspace = lspace
             self.planner = planner
             self.residue = residue
             self.coupling = coupling
             self.sleep = sleep
+            # per-phase timers/counters; None disables instrumentation entirely
+            self.instrument = instrument
+            self.path_memory = path_memory
             self.state: Optional[LState] = None
             self.t = 0
 
         def reset(self) -> None:
             self.state = self.lspace.initial_state()
             self.t = 0
+            if self.path_memory is not None:
+                self.path_memory.new_episode()
 
         def step(self, env) -> Tuple[Dict[str, np.ndarray], float, float, bool, StepInfo]:
-            assert self.state is not None, "Call reset() first."
-            self.t += 1
-
+            t0 = self._begin()
             obs = env.observe()
             x = env.encode(obs)
-            self.state = self.lspace.update(x, self.state)
+            t0 = self._lap("observe", t0)
+            self.state = self.lspace.update_fast(x, self.state)
+            t0 = self._lap("latent", t0)
 
             action, score_parts = self.planner.choose_action(
                 env=env,
                 lstate=self.state,
                 residue=self.residue,
                 coupling=self.coupling,
+                lspace=self.lspace,
             )
+            t0 = self._lap("plan", t0)
+
+            obs2, reality_cost, ethical_parts, done = env.step(action)
+            t0 = self._lap("act", t0)
+            ethical_cost, info = self._commit(action, score_parts, reality_cost, ethical_parts, t0)
+            return obs2, float(reality_cost), ethical_cost, bool(done), info
+
+        # --- step phases shared with AsyncREEAgent ---
+        def _begin(self) -> Optional[float]:
+            assert self.state is not None, "Call reset() first."
+            self.t += 1
+            if self.instrument is None:
+                return None
+            self._marks = (self.planner.rollouts, self.residue.scanned)
+            return self.instrument.begin(self.t)
+
+        def _lap(self, phase: str, t0: Optional[float]) -> Optional[float]:
+            return t0 if self.instrument is None else self.instrument.lap(phase, t0)
 
-            obs2, reality_cost, ethical_cost, done = env.step(action)
+        def _commit(self, action: int, score_parts: dict, reality_cost: float, ethical_parts: dict, t0: Optional[float]) -> Tuple[float, StepInfo]:
+            \"\"\"Everything after acting: path memory, residue update, sleep, instrumentation.\"\"\"
+            inst = self.instrument
+            ethical_cost = float(ethical_parts["self"] + self.coupling.kappa_other * ethical_parts["other"])
+            if self.path_memory is not None:
+                self.path_memory.record(self.state, action, reality_cost, ethical_cost, score_parts["residue"])
 
             # Residue update at selected coordinate (beta slice by default)
             if ethical_cost > 0.0:
                 self.residue.add_dent(center=self.state.beta.copy(), magnitude=float(ethical_cost), sigma=1.0)
+                if inst is not None:
+                    inst.count("dents_added", 1)
+            t0 = self._lap("residue", t0)
 
-            if self.sleep and self.sleep.should_sleep(self.t):
-                self.sleep.run_offline(self.residue, self.lspace)
+            if self.sleep:
+                n_before = self.residue.count()
+                if self.sleep.tick(self.t, self.residue, self.lspace) and inst is not None:
+                    inst.count("dents_merged", n_before - self.residue.count())
+            if inst is not None:
+                inst.lap("sleep", t0)
+                rollouts0, scanned0 = self._marks
+                inst.count("rollouts", self.planner.rollouts - rollouts0)
+                inst.count("dents_scanned", self.residue.scanned - scanned0)
+                inst.end()
 
             info = StepInfo(
                 action=action,
@@ -162,8 +410,245 @@ def main(out_dir: str) -> None:
                 reality_cost=float(score_parts["reality"]),
                 ethical_cost=float(score_parts["ethical"]),
                 residue_cost=float(score_parts["residue"]),
+                complete=bool(score_parts.get("complete", True)),
+                overrun=float(score_parts.get("overrun", 0.0)),
+            )
+            return ethical_cost, info
+    """)
+
+    w(root, "src/ree_impl/core/instrument.py", """
+    from __future__ import annotations
+    import atexit
+    import json
+    import os
+    import time
+    from collections import deque
+    from typing import Any, Callable, Dict, List, Optional
+
+    PHASES = ("observe", "latent", "plan", "act", "residue", "sleep")
+    COUNTERS = ("rollouts", "dents_scanned", "dents_added", "dents_merged")
+
+    class Instrumentation:
+        \"\"\"Per-phase timers and counters for REEAgent.step.
+
+        Attach to an agent (agent.instrument = Instrumentation()); with no instrument
+        attached the step loop pays a single None check per phase. Each step produces a
+        record {t, <phase>_s..., <counter>...} passed to every registered hook; the last
+        max_events phase spans are kept for a Chrome trace (chrome://tracing, Perfetto).
+        \"\"\"
+
+        def __init__(self, max_events: int = 100_000, clock: Callable[[], float] = time.perf_counter):
+            self.clock = clock
+            self.hooks: List[Callable[[Dict[str, Any]], None]] = []
+            self.totals: Dict[str, float] = {p: 0.0 for p in PHASES}
+            self.counts: Dict[str, int] = {c: 0 for c in COUNTERS}
+            self.steps = 0
+            self.events: deque = deque(maxlen=max_events)
+            self._origin = clock()
+            self._record: Dict[str, Any] = {}
+
+        @classmethod
+        def from_env(cls, var: str = "REE_PROFILE") -> Optional["Instrumentation"]:
+            \"\"\"Enable from the environment: REE_PROFILE=path.json (or path.trace.json).
+
+            Returns None when the variable is unset; otherwise the collected data is
+            written to the path at interpreter exit.
+            \"\"\"
+            path = os.environ.get(var)
+            if not path:
+                return None
+            inst = cls()
+            if path.endswith(".trace.json"):
+                atexit.register(inst.export_chrome_trace, path)
+            else:
+                atexit.register(inst.export_json, path)
+            return inst
+
+        def add_hook(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+            self.hooks.append(fn)
+
+        def begin(self, t: int) -> float:
+            self._record = {"t": int(t)}
+            return self.clock()
+
+        def lap(self, phase: str, t0: float) -> float:
+            \"\"\"Close `phase` started at t0; returns the start time for the next phase.\"\"\"
+            t1 = self.clock()
+            dt = t1 - t0
+            self.totals[phase] += dt
+            self._record[phase + "_s"] = dt
+            self.events.append((phase, t0 - self._origin, dt))
+            return t1
+
+        def count(self, name: str, n: int) -> None:
+            self.counts[name] += int(n)
+            self._record[name] = self._record.get(name, 0) + int(n)
+
+        def end(self) -> Dict[str, Any]:
+            self.steps += 1
+            record = self._record
+            for fn in self.hooks:
+                fn(record)
+            return record
+
+        def summary(self) -> Dict[str, Any]:
+            steps = max(self.steps, 1)
+            total = sum(self.totals.values())
+            return {
+                "steps": self.steps,
+                "total_s": total,
+                "phases": {
+                    p: {"total_s": s, "mean_s": s / steps, "share": s / total if total > 0 else 0.0}
+                    for p, s in self.totals.items()
+                },
+                "counters": dict(self.counts),
+            }
+
+        def export_json(self, path: str) -> None:
+            with open(path, "w") as f:
+                json.dump(self.summary(), f, indent=2)
+
+        def export_chrome_trace(self, path: str) -> None:
+            events = [
+                {"name": p, "ph": "X", "ts": start * 1e6, "dur": dt * 1e6, "pid": os.getpid(), "tid": 0}
+                for p, start, dt in self.events
+            ]
+            with open(path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    """)
+
+    w(root, "src/ree_impl/core/vector_agent.py", """
+    from __future__ import annotations
+    from types import SimpleNamespace
+    from typing import Optional
+
+    import numpy as np
+
+    from ..lspace.stack import DEPTHS, LSpace, LState
+    from ..planning.mpc import MPCPlanner
+    from ..residue.field import ResidueField
+    from ..sleep.sleep import SleepSubsystem
+    from ..social.coupling import CouplingModel
+    from .agent import StepInfo
+
+    class VectorREEAgent:
+        \"\"\"Runs N independent REE agents in lock-step over N environments.
+
+        Agents share LSpace weights, planner and coupling; each keeps its own latent
+        state, residue field and precision (alphas). The latent update, residue scoring
+        and (horizon-1) action selection are single batched passes over all agents.
+        Rollout latents for horizon > 1 use the shared `lspace.alphas`.
+        \"\"\"
+
+        def __init__(
+            self,
+            lspace: LSpace,
+            planner: MPCPlanner,
+            coupling: CouplingModel,
+            n_agents: int,
+            residues: Optional[list[ResidueField]] = None,
+            sleep: Optional[SleepSubsystem] = None,
+        ):
+            self.lspace = lspace
+            self.planner = planner
+            self.coupling = coupling
+            self.n = int(n_agents)
+            self.residues = residues if residues is not None else [ResidueField() for _ in range(self.n)]
+            self.sleep = sleep
+            self.alphas = [dict(lspace.alphas) for _ in range(self.n)]
+            self.state: Optional[LState] = None
+            self.t = 0
+
+        def reset(self) -> None:
+            s = self.lspace.initial_state()
+            self.state = LState(**{k: np.tile(getattr(s, k), (self.n, 1)) for k in DEPTHS})
+            self.t = 0
+
+        def agent_state(self, i: int) -> LState:
+            return LState(**{k: getattr(self.state, k)[i].copy() for k in DEPTHS})
+
+        def step(self, envs: list):
+            \"\"\"One step for every agent. Returns (obs list, reality (N,), ethical (N,), done (N,), infos).\"\"\"
+            assert self.state is not None, "Call reset() first."
+            assert len(envs) == self.n
+            self.t += 1
+
+            X = np.stack([env.encode(env.observe()) for env in envs])
+            alphas = {d: np.array([a.get(d, 1.0) for a in self.alphas]) for d in DEPTHS}
+            self.state = self.lspace.update_batch(X, self.state, alphas=alphas)
+
+            actions, parts = self.planner.choose_actions(envs, self.state, self.residues, self.coupling, lspace=self.lspace)
+
+            obs, reality, ethical, done, infos = [], np.zeros(self.n), np.zeros(self.n), np.zeros(self.n, dtype=bool), []
+            for i, env in enumerate(envs):
+                o, rc, ethical_parts, d = env.step(int(actions[i]))
+                ec = float(ethical_parts["self"] + self.coupling.kappa_other * ethical_parts["other"])
+                if ec > 0.0:
+                    self.residues[i].add_dent(center=self.state.beta[i].copy(), magnitude=ec, sigma=1.0)
+                if self.sleep:
+                    # per-agent precision: recalibration acts on this agent's alphas only
+                    self.sleep.tick(self.t, self.residues[i], SimpleNamespace(alphas=self.alphas[i]))
+                obs.append(o)
+                reality[i], ethical[i], done[i] = float(rc), ec, bool(d)
+                infos.append(StepInfo(
+                    action=int(actions[i]),
+                    score=float(parts[i]["total"]),
+                    reality_cost=float(parts[i]["reality"]),
+                    ethical_cost=float(parts[i]["ethical"]),
+                    residue_cost=float(parts[i]["residue"]),
+                    complete=bool(parts[i].get("complete", True)),
+                    overrun=float(parts[i].get("overrun", 0.0)),
+                ))
+            return obs, reality, ethical, done, infos
+    """)
+
+    w(root, "src/ree_impl/core/async_agent.py", """
+    from __future__ import annotations
+    from typing import Dict, Optional, Tuple
+
+    import numpy as np
+
+    from .agent import REEAgent, StepInfo
+
+    class AsyncREEAgent(REEAgent):
+        \"\"\"REEAgent driving an AsyncEnv (envs/async_env.py).
+
+        The planner must provide `achoose_action` (AsyncMPCPlanner), so each decision's
+        candidate rollouts overlap instead of waiting on the simulator one at a time.
+        Latent update, residue, sleep and instrumentation are exactly REEAgent's.
+        \"\"\"
+
+        async def astep(self, env) -> Tuple[Dict[str, np.ndarray], float, float, bool, StepInfo]:
+            t0 = self._begin()
+            obs = await env.observe()
+            x = env.encode(obs)
+            t0 = self._lap("observe", t0)
+            self.state = self.lspace.update_fast(x, self.state)
+            t0 = self._lap("latent", t0)
+
+            action, score_parts = await self.planner.achoose_action(
+                env=env,
+                lstate=self.state,
+                residue=self.residue,
+                coupling=self.coupling,
+                lspace=self.lspace,
             )
-            return obs2, float(reality_cost), float(ethical_cost), bool(done), info
+            t0 = self._lap("plan", t0)
+
+            obs2, reality_cost, ethical_parts, done = await env.step(action)
+            t0 = self._lap("act", t0)
+            ethical_cost, info = self._commit(action, score_parts, reality_cost, ethical_parts, t0)
+            return obs2, float(reality_cost), ethical_cost, bool(done), info
+
+        async def arun_episode(self, env, max_steps: Optional[int] = None) -> list[StepInfo]:
+            \"\"\"Step until the env reports done (or `max_steps`); returns the per-step infos.\"\"\"
+            infos = []
+            while max_steps is None or len(infos) < max_steps:
+                _obs, _rc, _ec, done, info = await self.astep(env)
+                infos.append(info)
+                if done:
+                    break
+            return infos
     """)
 
     # --- L-space ---
@@ -172,6 +657,9 @@ def main(out_dir: str) -> None:
     from dataclasses import dataclass
     import numpy as np
 
+    from ..backend import kernel
+    from ..precision import UNIT_ROUNDOFF
+
     DEPTHS = ("gamma", "beta", "theta", "delta")
 
     @dataclass
@@ -187,12 +675,21 @@ def main(out_dir: str) -> None:
         - bottom-up: x -> gamma -> beta -> theta -> delta
         - top-down: previous higher state conditions lower updates
         - precision: alpha_k gates update magnitude per depth
+
+        `weight_dtype` sets how W is stored: float64 (reference), float32 or float16.
+        Weights are drawn in float64 and rounded once, so every storage dtype sees the
+        same network; `update_error_bound` bounds the resulting drift of one update.
         \"\"\"
 
-        def __init__(self, sensor_dim: int, dims: dict, alphas: dict | None = None, seed: int = 0):
+        def __init__(self, sensor_dim: int, dims: dict, alphas: dict | None = None, seed: int = 0, dtype=np.float32, weight_dtype=np.float64):
             self.sensor_dim = sensor_dim
             self.dims = dims
             self.alphas = alphas or {"gamma": 1.0, "beta": 1.0, "theta": 1.0, "delta": 1.0}
+            # compute dtype of the fast path (update_fast); W itself keeps its reference values
+            self.dtype = np.dtype(dtype)
+            self.weight_dtype = np.dtype(weight_dtype)
+            self._split: dict = {}
+            self._scratch = {k: (np.empty(dims[k], dtype=self.dtype), np.empty(dims[k], dtype=self.dtype)) for k in DEPTHS}
             rng = np.random.default_rng(seed)
 
             # Simple linear encoders per depth: tanh(W [bottom_up ; top_down])
@@ -207,14 +704,18 @@ def main(out_dir: str) -> None:
             self.W["beta"]  = rng.standard_normal((dims["beta"],  in_beta)) * 0.1
             self.W["theta"] = rng.standard_normal((dims["theta"], in_theta)) * 0.1
             self.W["delta"] = rng.standard_normal((dims["delta"], in_delta)) * 0.1
+            for depth in DEPTHS:
+                self.W[depth] = self.W[depth].astype(self.weight_dtype, copy=False)
 
         def initial_state(self) -> LState:
-            z = {k: np.zeros(self.dims[k], dtype=np.float32) for k in DEPTHS}
+            z = {k: np.zeros(self.dims[k], dtype=self.dtype) for k in DEPTHS}
             return LState(**z)
 
         def _upd(self, depth: str, inp: np.ndarray, prev: np.ndarray) -> np.ndarray:
             alpha = float(self.alphas.get(depth, 1.0))
-            h = np.tanh(self.W[depth] @ inp)
+            W = self.W[depth]
+            # half-precision storage is widened for the product (kernels run in >= float32)
+            h = kernel("tanh_matvec")(W if W.dtype.itemsize >= 4 else W.astype(np.float32), inp)
             # precision-gated leaky update
             return (1.0 - 0.5 * alpha) * prev + (0.5 * alpha) * h
 
@@ -238,6 +739,108 @@ def main(out_dir: str) -> None:
             delta = self._upd("delta", delta_in, s.delta)
 
             return LState(gamma=gamma, beta=beta, theta=theta, delta=delta)
+
+        def update_error_bound(self, x: np.ndarray, s: LState) -> dict:
+            \"\"\"Per-depth max-norm bound on how far one update of `s` by `x` can move when W
+            is stored in `weight_dtype` instead of at full precision.
+
+            With u the storage rounding (ree_impl.precision.UNIT_ROUNDOFF), depth k's
+            pre-activation moves by at most u * max_i (|W_k| |in_k|)_i plus
+            ||W_k,bottom-up||_inf times the error arriving from the depth below; tanh is
+            1-Lipschitz and the leaky update scales by 0.5 * alpha_k. Float32 arithmetic
+            rounding (~1e-7 relative) comes on top.
+            \"\"\"
+            r = UNIT_ROUNDOFF.get(self.weight_dtype.name, 0.0)
+            u = r / (1.0 - r)  # relative to the stored weights
+            new = self.update(x, s)
+            tops = (s.beta, s.theta, s.delta, None)
+            bottom, below = np.asarray(x, dtype=np.float64), 0.0
+            bounds = {}
+            for i, depth in enumerate(DEPTHS):
+                W = np.abs(self.W[depth].astype(np.float64))
+                # the full-precision input may differ from ours by `below` on the bottom-up part
+                inp = np.abs(bottom) + below
+                if tops[i] is not None:
+                    inp = np.concatenate([inp, np.abs(tops[i])])
+                n_bu = bottom.shape[0]
+                pre = u * float((W @ inp).max()) + float(W[:, :n_bu].sum(axis=1).max()) * below
+                below = 0.5 * float(self.alphas.get(depth, 1.0)) * pre
+                bounds[depth] = below
+                bottom = getattr(new, depth).astype(np.float64)
+            return bounds
+
+        # --- fast path ---
+        def _blocks(self, depth: str) -> tuple[np.ndarray, np.ndarray]:
+            \"\"\"W[depth] split into (bottom-up, top-down) column blocks in `self.dtype`.
+
+            Rebuilt whenever W[depth] is replaced (identity check), so callers that
+            assign new weight matrices need no extra bookkeeping.
+            \"\"\"
+            W = self.W[depth]
+            cached = self._split.get(depth)
+            if cached is None or cached[0] is not W:
+                n_bu = self.sensor_dim if depth == "gamma" else self.dims[DEPTHS[DEPTHS.index(depth) - 1]]
+                Wb = np.ascontiguousarray(W[:, :n_bu], dtype=self.dtype)
+                Wt = np.ascontiguousarray(W[:, n_bu:], dtype=self.dtype)
+                cached = (W, Wb, Wt)
+                self._split[depth] = cached
+            return cached[1], cached[2]
+
+        def update_fast(self, x: np.ndarray, s: LState, out: LState | None = None) -> LState:
+            \"\"\"Same update as `update`, without concatenation or dtype round-trips.
+
+            Computes tanh(W_bu @ bottom_up + W_td @ top_down) per depth in `self.dtype`
+            using preallocated scratch buffers. With `out=None` a new LState is returned;
+            otherwise results are written into `out`, which may be `s` itself (depths are
+            updated bottom-up, so every read still sees the right old/new value).
+            \"\"\"
+            if out is None:
+                out = LState(**{k: np.empty(self.dims[k], dtype=self.dtype) for k in DEPTHS})
+            x = np.asarray(x, dtype=self.dtype)
+            tops = (s.beta, s.theta, s.delta, None)
+            bottom = x
+            for i, depth in enumerate(DEPTHS):
+                Wb, Wt = self._blocks(depth)
+                h, tmp = self._scratch[depth]
+                Wb.dot(bottom, out=h)
+                top = tops[i]
+                if top is not None:
+                    Wt.dot(top.astype(self.dtype, copy=False), out=tmp)
+                    h += tmp
+                np.tanh(h, out=h)
+                # precision-gated leaky update: prev + 0.5*alpha*(h - prev)
+                prev = getattr(s, depth)
+                dst = getattr(out, depth)
+                h -= prev
+                h *= self.dtype.type(0.5 * float(self.alphas.get(depth, 1.0)))
+                np.add(prev, h, out=dst)
+                bottom = dst
+            return out
+
+        def update_batch(self, X: np.ndarray, S: LState, alphas: dict | None = None) -> LState:
+            \"\"\"`update_fast` for N stacked agents: X is (N, sensor_dim), S holds (N, dim) arrays.
+
+            Each depth is one matrix-matrix product over all agents. `alphas` optionally
+            maps depth -> scalar or (N,) array (per-agent precision) instead of `self.alphas`.
+            \"\"\"
+            bottom = np.asarray(X, dtype=self.dtype)
+            tops = (S.beta, S.theta, S.delta, None)
+            out = {}
+            for i, depth in enumerate(DEPTHS):
+                Wb, Wt = self._blocks(depth)
+                h = bottom @ Wb.T
+                if tops[i] is not None:
+                    h += tops[i].astype(self.dtype, copy=False) @ Wt.T
+                np.tanh(h, out=h)
+                a = self.alphas.get(depth, 1.0) if alphas is None else alphas[depth]
+                c = (0.5 * np.asarray(a, dtype=self.dtype)).reshape(-1, 1)
+                prev = getattr(S, depth)
+                h -= prev
+                h *= c
+                h += prev
+                out[depth] = h
+                bottom = h
+            return LState(**out)
     """)
 
     # --- Social coupling ---
@@ -254,291 +857,4423 @@ def main(out_dir: str) -> None:
     # --- Residue field ---
     w(root, "src/ree_impl/residue/field.py", """
     from __future__ import annotations
-    from dataclasses import dataclass, field
+    from collections import OrderedDict
+    from dataclasses import dataclass
+    from typing import Iterable
+    import os
     import numpy as np
 
+    from .compaction import compact as _compact
+    from ..backend import kernel
+    from .index import DentBallTree
+    from ..precision import dequantize_int8, quantize_int8, row_error_bound
+
+    def _new_epoch() -> int:
+        return int.from_bytes(os.urandom(8), "little") >> 1
+
     @dataclass
     class Dent:
         center: np.ndarray
         magnitude: float
         sigma: float
 
-    @dataclass
     class ResidueField:
-        \"\"\"A simple RBF dent field: R(z) = sum_i mag_i * exp(-||z-c_i||^2/(2*sigma_i^2)).\"\"\"
-        dents: list[Dent] = field(default_factory=list)
+        \"\"\"A simple RBF dent field: R(z) = sum_i mag_i * exp(-||z-c_i||^2/(2*sigma_i^2)).
 
-        def add_dent(self, center: np.ndarray, magnitude: float, sigma: float = 1.0) -> None:
-            self.dents.append(Dent(center=center.astype(np.float32), magnitude=float(magnitude), sigma=float(sigma)))
+        Dents are stored as contiguous, growable arrays (centers / magnitudes / sigmas)
+        so the potential is evaluated in one vectorized pass instead of a Python loop.
+        `dents` remains available as a list of `Dent` snapshots for existing callers.
+        \"\"\"
 
-        def potential(self, z: np.ndarray) -> float:
-            if not self.dents:
-                return 0.0
-            acc = 0.0
-            for d in self.dents:
-                dist2 = float(np.sum((z - d.center) ** 2))
-                acc += d.magnitude * float(np.exp(-dist2 / (2.0 * (d.sigma ** 2))))
-            return float(acc)
+        # upper bound on elements materialised per (points x dents x dim) block
+        block_elems: int = 1 << 20
 
-        def count(self) -> int:
-            return len(self.dents)
-    """)
+        def __init__(self, dents: Iterable[Dent] | None = None, capacity: int = 16):
+            self._capacity = max(int(capacity), 1)
+            self._n = 0
+            self._centers: np.ndarray | None = None
+            # storage format of centers (see set_precision); int8 adds per-block scales
+            self.precision = "float32"
+            self.precision_block = 32
+            self._scales: np.ndarray | None = None
+            self._mags = np.zeros(self._capacity, dtype=np.float64)
+            self._sigmas = np.zeros(self._capacity, dtype=np.float64)
+            self.index_cutoff: float | None = None
+            self._index = None
+            self._indexed_n = 0
+            # running count of (point, dent) kernel evaluations, for instrumentation
+            self.scanned = 0
+            # identifies the stored dents up to appends: redrawn whenever existing
+            # dents are rewritten, unchanged by add_dent
+            self.epoch = _new_epoch()
+            # bumped on every mutation; cached lookups are only valid for one version
+            self.version = 0
+            self._cache: tuple[OrderedDict, OrderedDict] | None = None
+            self._cache_version = 0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.max_dents: int | None = None
+            self.compaction_policy = "merge_nearest"
+            self.compact_to = 0.75
+            self.grid_cell = 0.5
+            self.compaction_stats = {"runs": 0, "dents_removed": 0, "mass_moved": 0.0, "max_shift": 0.0}
+            if dents is not None:
+                self.dents = list(dents)
 
-    # --- Sleep/offline integration ---
-    w(root, "src/ree_impl/sleep/sleep.py", """
-    from __future__ import annotations
-    from dataclasses import dataclass
-    import numpy as np
+        # --- storage ---
+        def _alloc(self, cap: int, dim: int) -> tuple[np.ndarray, np.ndarray | None]:
+            if self.precision == "int8":
+                n_blocks = -(-dim // self.precision_block)
+                return np.zeros((cap, dim), dtype=np.int8), np.zeros((cap, n_blocks), dtype=np.float32)
+            return np.zeros((cap, dim), dtype=self.precision), None
 
-    from ..residue.field import ResidueField, Dent
+        def _store(self, lo: int, C: np.ndarray) -> None:
+            \"\"\"Write float32 rows C at row `lo`, encoding them in the storage format.\"\"\"
+            hi = lo + C.shape[0]
+            if self.precision == "int8":
+                self._centers[lo:hi], self._scales[lo:hi] = quantize_int8(C, self.precision_block)
+            else:
+                self._centers[lo:hi] = C
 
-    @dataclass
-    class SleepSubsystem:
-        every_n_steps: int = 25
-        merge_radius: float = 1.0
+        def _rows(self, lo: int, hi: int) -> np.ndarray:
+            \"\"\"Centers lo:hi as float32 (a view at full precision, decoded otherwise).\"\"\"
+            if self.precision == "int8":
+                return dequantize_int8(self._centers[lo:hi], self._scales[lo:hi], self.precision_block)
+            return self._centers[lo:hi].astype(np.float32, copy=False)
 
-        def should_sleep(self, t: int) -> bool:
-            return t % self.every_n_steps == 0
+        def _slabs(self, lo: int, hi: int):
+            \"\"\"Row ranges covering lo:hi, sized so one decoded slab stays under `block_elems`.\"\"\"
+            step = hi - lo if self.precision == "float32" else max(1, self.block_elems // max(self._centers.shape[1], 1))
+            for a in range(lo, hi, max(step, 1)):
+                yield a, min(a + step, hi)
 
-        def run_offline(self, residue: ResidueField, lspace) -> None:
-            \"\"\"Offline consolidation.
+        def _reserve(self, n: int, dim: int) -> None:
+            if self._centers is None:
+                self._centers, self._scales = self._alloc(self._capacity, dim)
+            elif self._centers.shape[1] != dim:
+                raise ValueError(f"dent center has dim {dim}, field has dim {self._centers.shape[1]}")
+            if n <= self._capacity and self._mags.flags.writeable:
+                return
+            # growing, or leaving read-only (wrapped) storage: copy into fresh arrays
+            cap = max(self._capacity, 1)
+            while cap < n:
+                cap *= 2
+            centers, scales = self._alloc(cap, dim)
+            centers[: self._n] = self._centers[: self._n]
+            if scales is not None:
+                scales[: self._n] = self._scales[: self._n]
+            mags = np.zeros(cap, dtype=np.float64)
+            mags[: self._n] = self._mags[: self._n]
+            sigmas = np.zeros(cap, dtype=np.float64)
+            sigmas[: self._n] = self._sigmas[: self._n]
+            self._centers, self._scales, self._mags, self._sigmas, self._capacity = centers, scales, mags, sigmas, cap
 
-            v0 behaviour:
-            - merge nearby dents (compress residue representation)
-            - mild precision recalibration (reduce overcommitment if residue is large)
-            \"\"\"
-            self._merge_dents(residue)
-            self._recalibrate_precision(residue, lspace)
+        def set_arrays(self, centers: np.ndarray, magnitudes: np.ndarray, sigmas: np.ndarray) -> None:
+            \"\"\"Replace all dents with the given arrays (used by offline consolidation).\"\"\"
+            centers = np.asarray(centers, dtype=np.float32)
+            n = int(centers.shape[0])
+            self._n = 0
+            self._invalidate_index()
+            self.epoch = _new_epoch()
+            self.version += 1
+            if n == 0:
+                return
+            self._reserve(n, int(centers.shape[1]))
+            self._store(0, centers)
+            self._mags[:n] = np.asarray(magnitudes, dtype=np.float64)
+            self._sigmas[:n] = np.asarray(sigmas, dtype=np.float64)
+            self._n = n
 
-        def _merge_dents(self, residue: ResidueField) -> None:
-            if residue.count() < 2:
+        def wrap_arrays(self, centers: np.ndarray, magnitudes: np.ndarray, sigmas: np.ndarray) -> None:
+            \"\"\"Adopt the given arrays as storage without copying (e.g. read-only memory maps).
+
+            The field is read-only until its first mutation, which copies into private arrays.
+            At reduced precision the arrays are encoded into private storage instead.
+            \"\"\"
+            if self.precision != "float32":
+                self.set_arrays(centers, magnitudes, sigmas)
                 return
-            kept: list[Dent] = []
-            used = [False] * residue.count()
-            for i, di in enumerate(residue.dents):
-                if used[i]:
-                    continue
-                group = [di]
-                used[i] = True
-                for j, dj in enumerate(residue.dents):
-                    if used[j]:
-                        continue
-                    if float(np.linalg.norm(di.center - dj.center)) <= self.merge_radius:
-                        group.append(dj)
-                        used[j] = True
-                if len(group) == 1:
-                    kept.append(di)
-                else:
-                    mags = np.array([g.magnitude for g in group], dtype=np.float32)
-                    centers = np.stack([g.center for g in group], axis=0)
-                    c = (centers * mags[:, None]).sum(axis=0) / max(float(mags.sum()), 1e-6)
-                    kept.append(Dent(center=c, magnitude=float(mags.sum()), sigma=float(np.mean([g.sigma for g in group]))))
-            residue.dents = kept
+            centers = np.asarray(centers)
+            if centers.dtype != np.float32 or np.asarray(magnitudes).dtype != np.float64:
+                raise ValueError("wrap_arrays needs float32 centers and float64 magnitudes / sigmas")
+            self._invalidate_index()
+            self.epoch = _new_epoch()
+            self.version += 1
+            self._centers = centers
+            self._mags = np.asarray(magnitudes)
+            self._sigmas = np.asarray(sigmas, dtype=np.float64)
+            self._n = self._capacity = int(centers.shape[0])
 
-        def _recalibrate_precision(self, residue: ResidueField, lspace) -> None:
-            # simple rule: if residue is large, reduce beta alpha slightly (more cautious updates)
-            if residue.count() >= 8:
-                lspace.alphas["beta"] = max(0.5, float(lspace.alphas.get("beta", 1.0)) * 0.95)
-    """)
+        @property
+        def centers(self) -> np.ndarray:
+            if self._centers is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            return self._rows(0, self._n)
 
-    # --- Planner (MPC) ---
-    w(root, "src/ree_impl/planning/mpc.py", """
-    from __future__ import annotations
-    from dataclasses import dataclass
-    import numpy as np
+        @property
+        def magnitudes(self) -> np.ndarray:
+            return self._mags[: self._n]
 
-    from ..residue.field import ResidueField
-    from ..social.coupling import CouplingModel
+        @property
+        def sigmas(self) -> np.ndarray:
+            return self._sigmas[: self._n]
 
-    @dataclass
-    class MPCPlanner:
-        horizon: int = 1
-        lambda_ethics: float = 1.5
-        rho_residue: float = 2.0
+        @property
+        def dents(self) -> list[Dent]:
+            \"\"\"Snapshot of the stored dents (mutating the list does not change the field).\"\"\"
+            C = self.centers
+            return [
+                Dent(center=C[i].copy(), magnitude=float(self._mags[i]), sigma=float(self._sigmas[i]))
+                for i in range(self._n)
+            ]
 
-        def choose_action(self, env, lstate, residue: ResidueField, coupling: CouplingModel):
-            actions = env.action_space()
-            best = None
-            best_parts = None
+        @dents.setter
+        def dents(self, dents: list[Dent]) -> None:
+            if not dents:
+                self._n = 0
+                self._invalidate_index()
+                self.epoch = _new_epoch()
+                self.version += 1
+                return
+            self.set_arrays(
+                np.stack([np.asarray(d.center, dtype=np.float32) for d in dents], axis=0),
+                np.array([d.magnitude for d in dents], dtype=np.float64),
+                np.array([d.sigma for d in dents], dtype=np.float64),
+            )
 
-            for a in actions:
-                # rollout in a copy (pure transition)
-                sim = env.clone()
-                obs2, reality_cost, ethical_parts, _done = sim.step(a)
+        def add_dent(self, center: np.ndarray, magnitude: float, sigma: float = 1.0) -> None:
+            center = np.asarray(center, dtype=np.float32).reshape(-1)
+            self._reserve(self._n + 1, int(center.shape[0]))
+            i = self._n
+            self._store(i, center[None, :])
+            self._mags[i] = float(magnitude)
+            self._sigmas[i] = float(sigma)
+            self._n = i + 1
+            self.version += 1
+            if self.max_dents is not None and self._n > self.max_dents:
+                self.compact(int(self.max_dents * self.compact_to))
 
-                ethical_cost = float(ethical_parts["self"] + coupling.kappa_other * ethical_parts["other"])
-                residue_cost = float(residue.potential(lstate.beta))
+        # --- precision ---
+        def set_precision(self, precision: str = "float32", block: int = 32) -> None:
+            \"\"\"Store dent centers as "float32" (default), "float16" or "int8" (per-block scales).
 
-                total = float(reality_cost + self.lambda_ethics * ethical_cost + self.rho_residue * residue_cost)
+            Existing dents are re-encoded. Magnitudes / sigmas stay float64 and all
+            arithmetic runs in float64 on decoded centers, decoded a bounded slab at a time.
+            `centers` returns a decoded copy at reduced precision. Checkpoints store
+            decoded float32 centers; `load_agent` re-encodes them at the agent's precision,
+            while a bare `load_residue` returns a float32 field. The potential error against the float32 centers is at
+            most `precision_error_bound()` (see ree_impl.precision for the per-format
+            rounding bounds).
+            \"\"\"
+            if precision not in ("float32", "float16", "int8"):
+                raise ValueError(f"unknown dent precision: {precision!r}")
+            C, mags, sigmas = self.centers.copy(), self.magnitudes.copy(), self.sigmas.copy()
+            self.precision = precision
+            self.precision_block = max(int(block), 1)
+            self._centers = self._scales = None
+            self._mags = np.zeros(self._capacity, dtype=np.float64)
+            self._sigmas = np.zeros(self._capacity, dtype=np.float64)
+            if self._n:
+                self.set_arrays(C, mags, sigmas)
 
-                if best is None or total < best:
-                    best = total
-                    best_a = a
-                    best_parts = {"total": total, "reality": float(reality_cost), "ethical": ethical_cost, "residue": residue_cost}
+        def precision_error_bound(self) -> float:
+            \"\"\"Bound on |potential(z) - potential with float32 centers| that holds for every z.
 
-            return int(best_a), best_parts
-    """)
+            Each dent's kernel is Lipschitz in its center with constant mag / (sigma * sqrt(e)),
+            so the bound is sum_i mag_i * ||c_i - stored c_i|| / (sigma_i * sqrt(e)).
+            \"\"\"
+            if self._n == 0 or self.precision == "float32":
+                return 0.0
+            scales = self._scales[: self._n] if self._scales is not None else None
+            err = row_error_bound(self.centers, self.precision, scales, self.precision_block)
+            return float(np.sum(self.magnitudes * err / (self.sigmas * np.sqrt(np.e))))
 
-    # --- Toy environment with clone + pure state ---
-    w(root, "src/ree_impl/envs/toy_gridworld.py", """
-    from __future__ import annotations
-    from dataclasses import dataclass
-    import numpy as np
+        @property
+        def nbytes(self) -> int:
+            \"\"\"Bytes held by dent storage (allocated capacity, not only live dents).\"\"\"
+            arrays = (self._centers, self._scales, self._mags, self._sigmas)
+            return int(sum(a.nbytes for a in arrays if a is not None))
 
-    @dataclass
-    class State:
-        agent: np.ndarray
-        other: np.ndarray
-        battery: float
-        t: int
+        # --- capacity ---
+        def set_capacity(
+            self,
+            max_dents: int | None,
+            policy: str = "merge_nearest",
+            compact_to: float = 0.75,
+            grid_cell: float = 0.5,
+        ) -> None:
+            \"\"\"Cap the number of stored dents (None removes the cap).
 
-    class ToyGridWorld:
-        def __init__(self, size: int = 10, max_steps: int = 80, seed: int = 0):
-            self.size = size
-            self.max_steps = max_steps
-            self.rng = np.random.default_rng(seed)
-            self.hazards = [np.array([2,2]), np.array([2,3]), np.array([3,2])]
-            self.food = np.array([size-1, size-1])
-            self.state = State(agent=np.array([0,0]), other=np.array([size//2, size//2]), battery=1.0, t=0)
+            Residue cannot be erased, so overflowing the cap never drops a dent: the field
+            is compacted to `compact_to * max_dents` dents with total mass preserved, either
+            by merging closest pairs ("merge_nearest") or by pooling dents per grid cell of
+            side `grid_cell`, coarsened until the target is met ("grid"). Compacting below
+            the cap amortises the work over the following additions.
+            \"\"\"
+            if policy not in ("merge_nearest", "grid"):
+                raise ValueError(f"unknown compaction policy: {policy!r}")
+            if max_dents is not None and max_dents < 1:
+                raise ValueError("max_dents must be >= 1")
+            self.max_dents = None if max_dents is None else int(max_dents)
+            self.compaction_policy = policy
+            self.compact_to = float(compact_to)
+            self.grid_cell = float(grid_cell)
+            if self.max_dents is not None and self._n > self.max_dents:
+                self.compact(int(self.max_dents * self.compact_to))
 
-        def clone(self):
-            c = ToyGridWorld(self.size, self.max_steps, seed=0)
-            c.rng = self.rng  # deterministic enough for toy; rollouts share RNG stream
-            c.hazards = [h.copy() for h in self.hazards]
-            c.food = self.food.copy()
-            c.state = State(agent=self.state.agent.copy(), other=self.state.other.copy(), battery=float(self.state.battery), t=int(self.state.t))
-            return c
+        def compact(self, target: int) -> int:
+            \"\"\"Merge dents down to at most `target` (mass-preserving); returns dents removed.\"\"\"
+            n = self._n
+            if n <= max(int(target), 1):
+                return 0
+            C = self.centers.astype(np.float64)
+            labels, centers, mass, sigma = _compact(
+                C, self.magnitudes, self.sigmas, max(int(target), 1),
+                self.compaction_policy, self.grid_cell,
+            )
+            moved = np.bincount(labels, minlength=centers.shape[0])[labels] > 1
+            stats = self.compaction_stats
+            stats["runs"] += 1
+            stats["dents_removed"] += n - centers.shape[0]
+            stats["mass_moved"] += float(self.magnitudes[moved].sum())
+            shift = np.linalg.norm(C - centers[labels], axis=1)
+            stats["max_shift"] = max(stats["max_shift"], float(shift.max()))
+            self.set_arrays(centers, mass, sigma)
+            return n - centers.shape[0]
 
-        def reset(self):
-            self.state = State(agent=np.array([0,0]), other=np.array([self.size//2, self.size//2]), battery=1.0, t=0)
-            return self.observe()
+        # --- cache ---
+        def enable_cache(self, maxsize: int = 4096, quantum: float | None = None) -> None:
+            \"\"\"Memoise `potential` / `potential_batch` / `gradient` lookups (LRU, `maxsize` each).
 
-        def action_space(self):
-            return [0,1,2,3,4]  # up, down, left, right, stay
+            Exact hits are keyed on the bytes of z. With `quantum` set, misses fall back to a
+            second cache keyed on round(z / quantum), answering near-repeats with the value
+            of an earlier point in the same cell: the error is at most
+            max|grad R| * quantum * sqrt(dim). Every mutation bumps `version`, which empties
+            both caches on the next lookup.
+            \"\"\"
+            self.cache_maxsize = int(maxsize)
+            self.cache_quantum = None if quantum is None else float(quantum)
+            self._cache = (OrderedDict(), OrderedDict())
+            self._cache_version = self.version
 
-        def _move(self, pos, action):
-            m = {
-                0: np.array([0,1]), 1: np.array([0,-1]),
-                2: np.array([-1,0]), 3: np.array([1,0]),
-                4: np.array([0,0])
-            }[action]
-            return np.clip(pos + m, 0, self.size-1)
+        def disable_cache(self) -> None:
+            self._cache = None
 
-        def observe(self):
-            # vision: agent, other, food (coords normalised)
-            vision = np.concatenate([self.state.agent, self.state.other, self.food]).astype(np.float32) / float(self.size)
-            body = np.array([self.state.battery], dtype=np.float32)
-            return {"vision": vision, "body": body}
+        def _cache_keys(self, kind: str, z: np.ndarray) -> tuple:
+            z = np.ascontiguousarray(z, dtype=np.float64)
+            exact = (kind, z.tobytes())
+            if self.cache_quantum is None:
+                return exact, None
+            return exact, (kind, np.floor(z / self.cache_quantum + 0.5).astype(np.int64).tobytes())
 
-        def encode(self, obs):
-            # simple: concatenate
-            return np.concatenate([obs["vision"], obs["body"]]).astype(np.float32)
+        def _cache_get(self, keys: tuple):
+            if self._cache_version != self.version:
+                for c in self._cache:
+                    c.clear()
+                self._cache_version = self.version
+            for c, key in zip(self._cache, keys):
+                if key is not None and key in c:
+                    c.move_to_end(key)
+                    self.cache_hits += 1
+                    return c[key]
+            self.cache_misses += 1
+            return None
 
-        def step(self, action: int):
-            s = self.state
-            s.t += 1
-            s.battery -= 0.01
+        def _cache_put(self, keys: tuple, value) -> None:
+            for c, key in zip(self._cache, keys):
+                if key is not None:
+                    c[key] = value
+                    if len(c) > self.cache_maxsize:
+                        c.popitem(last=False)
 
-            s.agent = self._move(s.agent, action)
-            other_a = int(self.rng.choice(self.action_space()))
-            s.other = self._move(s.other, other_a)
-
-            self_pain = 0.0
-            other_pain = 0.0
-            for h in self.hazards:
-                if np.array_equal(s.agent, h):
-                    self_pain = 1.0
-                    s.battery -= 0.2
-                if np.array_equal(s.other, h):
-                    other_pain = 1.0
+        # --- evaluation ---
+        def enable_index(self, cutoff_sigmas: float = 4.0, leaf_size: int = 32, min_dents: int = 256) -> None:
+            \"\"\"Use a ball-tree over dent centers for truncated-kernel potential queries.
 
-            # reality cost: small step penalty + battery pressure
-            reality_cost = float(0.05 + (1.0 - max(s.battery, 0.0)) * 0.05)
+            Dents whose lower-bound distance exceeds `cutoff_sigmas * sigma` are skipped;
+            the mass they would have contributed is bounded and reported by
+            `potential_with_bound`.
+            \"\"\"
+            self.index_cutoff = float(cutoff_sigmas)
+            self.index_leaf_size = int(leaf_size)
+            self.index_min_dents = int(min_dents)
+            self._index = None
+            self._indexed_n = 0
 
-            ethical_parts = {"self": float(self_pain), "other": float(other_pain)}
+        def disable_index(self) -> None:
+            self.index_cutoff = None
+            self._index = None
+            self._indexed_n = 0
 
-            done = bool(s.t >= self.max_steps or s.battery <= 0.0)
-            return self.observe(), reality_cost, ethical_parts, done
-    """)
+        def _invalidate_index(self) -> None:
+            self._index = None
+            self._indexed_n = 0
 
-    # --- Example runner ---
-    w(root, "examples/run_toy.py", """
-    import numpy as np
+        def _ensure_index(self):
+            if self.index_cutoff is None or self._n < self.index_min_dents:
+                return None
+            tail = self._n - self._indexed_n
+            if self._index is None or tail > max(self.index_leaf_size, self._indexed_n // 4):
+                self._index = DentBallTree(self.centers, self.magnitudes, self.sigmas, leaf_size=self.index_leaf_size)
+                self._indexed_n = self._n
+            return self._index
 
-    from ree_impl.core.agent import REEAgent
-    from ree_impl.envs.toy_gridworld import ToyGridWorld
-    from ree_impl.lspace.stack import LSpace
+        def potential_with_bound(self, z: np.ndarray) -> tuple[float, float]:
+            \"\"\"Potential at z plus an upper bound on |exact - returned| (0.0 when exact).\"\"\"
+            if self._n == 0:
+                return 0.0, 0.0
+            index = self._ensure_index()
+            if index is None:
+                return float(self._exact(np.asarray(z)[None, :], 0, self._n)[0]), 0.0
+            value, bound, scanned = index.query(np.asarray(z, dtype=np.float64), self.index_cutoff)
+            self.scanned += scanned
+            if self._indexed_n < self._n:
+                value += float(self._exact(np.asarray(z)[None, :], self._indexed_n, self._n)[0])
+            return float(value), float(bound)
+
+        def potential(self, z: np.ndarray) -> float:
+            if self._n == 0:
+                return 0.0
+            if self._cache is not None:
+                keys = self._cache_keys("p", z)
+                value = self._cache_get(keys)
+                if value is None:
+                    value = self._potential(z)
+                    self._cache_put(keys, value)
+                return value
+            return self._potential(z)
+
+        def _potential(self, z: np.ndarray) -> float:
+            if self.index_cutoff is not None:
+                return self.potential_with_bound(z)[0]
+            return float(self._exact(np.asarray(z)[None, :], 0, self._n)[0])
+
+        def potential_batch(self, Z: np.ndarray) -> np.ndarray:
+            \"\"\"Score many latent points at once. Z: (m, dim) -> (m,) potentials.\"\"\"
+            Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+            if self._n == 0:
+                return np.zeros(Z.shape[0], dtype=np.float64)
+            if self._cache is None:
+                return self._potential_batch(Z)
+            out = np.empty(Z.shape[0], dtype=np.float64)
+            keys = [self._cache_keys("p", z) for z in Z]
+            miss = []
+            for r, k in enumerate(keys):
+                value = self._cache_get(k)
+                if value is None:
+                    miss.append(r)
+                else:
+                    out[r] = value
+            if miss:
+                out[miss] = self._potential_batch(Z[miss])
+                for r in miss:
+                    self._cache_put(keys[r], float(out[r]))
+            return out
+
+        def _potential_batch(self, Z: np.ndarray) -> np.ndarray:
+            index = self._ensure_index()
+            if index is None:
+                return self._exact(Z, 0, self._n)
+            value, _bound, scanned = index.query_batch(Z, self.index_cutoff)
+            self.scanned += scanned
+            if self._indexed_n < self._n:
+                value += self._exact(Z, self._indexed_n, self._n)
+            return value
+
+        def potential_and_gradient_batch(self, Z: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            \"\"\"(m,) potentials and (m, dim) gradients dR/dz, exact over all dents, in one pass.\"\"\"
+            Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+            if self._n == 0:
+                return np.zeros(Z.shape[0], dtype=np.float64), np.zeros_like(Z)
+            self.scanned += Z.shape[0] * self._n
+            rbf_grad = kernel("rbf_sum_grad")
+            value = np.zeros(Z.shape[0], dtype=np.float64)
+            grad = np.zeros_like(Z)
+            for a, b in self._slabs(0, self._n):
+                v, g = rbf_grad(Z, self._rows(a, b), self._mags[a:b], self._sigmas[a:b], block_elems=self.block_elems)
+                value += v
+                grad += g
+            return value, grad
+
+        def potential_and_gradient(self, z: np.ndarray) -> tuple[float, np.ndarray]:
+            \"\"\"Potential and its analytic gradient at z (cached when `enable_cache` is on).\"\"\"
+            if self._cache is None:
+                value, grad = self.potential_and_gradient_batch(np.asarray(z)[None, :])
+                return float(value[0]), grad[0]
+            keys = self._cache_keys("g", z)
+            hit = self._cache_get(keys)
+            if hit is None:
+                value, grad = self.potential_and_gradient_batch(np.asarray(z)[None, :])
+                hit = (float(value[0]), grad[0])
+                self._cache_put(keys, hit)
+            return hit[0], hit[1].copy()
+
+        def gradient(self, z: np.ndarray) -> np.ndarray:
+            return self.potential_and_gradient(z)[1]
+
+        def _exact(self, Z: np.ndarray, lo: int, hi: int) -> np.ndarray:
+            self.scanned += Z.shape[0] * (hi - lo)
+            Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+            rbf = kernel("rbf_sum")
+            out = np.zeros(Z.shape[0], dtype=np.float64)
+            for a, b in self._slabs(lo, hi):
+                out += rbf(Z, self._rows(a, b), self._mags[a:b], self._sigmas[a:b], block_elems=self.block_elems)
+            return out
+
+        def count(self) -> int:
+            return self._n
+
+    def potential_many(fields: list[ResidueField], Z: np.ndarray) -> np.ndarray:
+        \"\"\"Exact R_i(Z_i) for N independent fields in one pass over all of their dents.\"\"\"
+        Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+        out = np.zeros(len(fields), dtype=np.float64)
+        counts = np.array([f.count() for f in fields], dtype=np.int64)
+        if counts.sum() == 0:
+            return out
+        live = [f for f in fields if f.count()]
+        for f in live:
+            f.scanned += f.count()
+        owner = np.repeat(np.arange(len(fields)), counts)
+        C = np.concatenate([f.centers for f in live])
+        mags = np.concatenate([f.magnitudes for f in live])
+        sigmas = np.concatenate([f.sigmas for f in live])
+        dist2 = np.sum((Z[owner] - C) ** 2, axis=1)
+        contrib = mags * np.exp(-dist2 / (2.0 * sigmas ** 2))
+        return np.bincount(owner, weights=contrib, minlength=len(fields))
+    """)
+
+    w(root, "src/ree_impl/residue/compaction.py", """
+    from __future__ import annotations
+    import numpy as np
+
+    from ..backend import kernel
+
+    def _aggregate(labels: np.ndarray, k: int, C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray):
+        \"\"\"Mass-weighted group centers / sigmas and summed magnitudes for k groups.\"\"\"
+        mass = np.bincount(labels, weights=mags, minlength=k)
+        w = np.maximum(mass, 1e-12)
+        centers = np.zeros((k, C.shape[1]), dtype=np.float64)
+        np.add.at(centers, labels, C * mags[:, None])
+        centers /= w[:, None]
+        sigma = np.bincount(labels, weights=sigmas * mags, minlength=k) / w
+        # singletons are kept exactly
+        sizes = np.bincount(labels, minlength=k)
+        first = np.full(k, C.shape[0], dtype=np.int64)
+        np.minimum.at(first, labels, np.arange(C.shape[0]))
+        single = sizes == 1
+        centers[single] = C[first[single]]
+        sigma[single] = sigmas[first[single]]
+        return centers, mass, sigma
+
+    def _nearest(C: np.ndarray, block: int = 512) -> tuple[np.ndarray, np.ndarray]:
+        \"\"\"Nearest other dent for every dent, in row blocks (O(block * n) memory).\"\"\"
+        n = C.shape[0]
+        sq_dists = kernel("pairwise_sq_dists")
+        nn = np.empty(n, dtype=np.int64)
+        d2 = np.empty(n, dtype=np.float64)
+        for lo in range(0, n, block):
+            hi = min(lo + block, n)
+            D = sq_dists(C[lo:hi], C)
+            D[np.arange(hi - lo), np.arange(lo, hi)] = np.inf
+            nn[lo:hi] = np.argmin(D, axis=1)
+            d2[lo:hi] = D[np.arange(hi - lo), nn[lo:hi]]
+        return nn, d2
+
+    def merge_nearest(C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray, target: int) -> np.ndarray:
+        \"\"\"Group labels merging closest pairs until at most `target` groups remain.
+
+        Each round merges disjoint (dent, nearest dent) pairs in order of distance, so
+        the dents displaced are always the ones whose merge moves mass the least.
+        \"\"\"
+        n = C.shape[0]
+        labels = np.arange(n)
+        cur_C, cur_m, cur_s = C, mags, sigmas
+        while cur_C.shape[0] > max(int(target), 1):
+            k = cur_C.shape[0]
+            nn, d2 = _nearest(cur_C)
+            excess = k - max(int(target), 1)
+            used = np.zeros(k, dtype=bool)
+            group = np.arange(k)
+            merged = 0
+            for i in np.argsort(d2, kind="stable"):
+                j = nn[i]
+                if used[i] or used[j]:
+                    continue
+                used[i] = used[j] = True
+                group[max(i, j)] = min(i, j)
+                merged += 1
+                if merged == excess:
+                    break
+            _, group = np.unique(group, return_inverse=True)
+            k2 = int(group.max()) + 1
+            cur_C, cur_m, cur_s = _aggregate(group, k2, cur_C, cur_m, cur_s)
+            labels = group[labels]
+        return labels
+
+    def grid_compact(C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray, target: int, cell: float) -> np.ndarray:
+        \"\"\"Group labels pooling dents per grid cell; the cell doubles until <= `target` groups.\"\"\"
+        origin = C.min(axis=0)
+        cell = float(cell)
+        while True:
+            # anchored at the data minimum, so a cell wider than the data holds everything
+            keys = np.floor((C - origin) / cell).astype(np.int64)
+            _, group = np.unique(keys, axis=0, return_inverse=True)
+            group = group.reshape(-1)
+            if int(group.max()) + 1 <= max(int(target), 1):
+                return group
+            cell *= 2.0
+
+    def compact(C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray, target: int, policy: str, cell: float = 1.0):
+        \"\"\"Reduce to <= target dents. Returns (labels, centers, mass, sigma); total mass is unchanged.\"\"\"
+        C = np.asarray(C, dtype=np.float64)
+        mags = np.asarray(mags, dtype=np.float64)
+        sigmas = np.asarray(sigmas, dtype=np.float64)
+        if policy == "merge_nearest":
+            labels = merge_nearest(C, mags, sigmas, target)
+        elif policy == "grid":
+            labels = grid_compact(C, mags, sigmas, target, cell)
+        else:
+            raise ValueError(f"unknown compaction policy: {policy!r}")
+        # relabel in order of each group's first dent, so surviving dents keep their order
+        _, first = np.unique(labels, return_index=True)
+        order = np.argsort(first)
+        remap = np.empty(int(labels.max()) + 1, dtype=np.int64)
+        remap[labels[first[order]]] = np.arange(order.shape[0])
+        labels = remap[labels]
+        return (labels,) + _aggregate(labels, order.shape[0], C, mags, sigmas)
+    """)
+
+    w(root, "src/ree_impl/residue/kernels.py", """
+    from __future__ import annotations
+    import numpy as np
+
+    def rbf_sum(Z: np.ndarray, C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray, block_elems: int = 1 << 20) -> np.ndarray:
+        \"\"\"sum_i mags_i * exp(-||Z - C_i||^2 / (2 sigma_i^2)) for every row of Z.
+
+        Dents are processed in blocks so at most `block_elems` (points x dents x dim)
+        differences are materialised at once.
+        \"\"\"
+        out = np.zeros(Z.shape[0], dtype=np.float64)
+        n = C.shape[0]
+        if n == 0:
+            return out
+        inv2s2 = 1.0 / (2.0 * sigmas ** 2)
+        step = max(1, block_elems // max(Z.shape[0] * Z.shape[1], 1))
+        for lo in range(0, n, step):
+            hi = min(lo + step, n)
+            diff = Z[:, None, :] - C[None, lo:hi, :]
+            dist2 = np.einsum("mnd,mnd->mn", diff, diff)
+            out += np.exp(-dist2 * inv2s2[None, lo:hi]) @ mags[lo:hi]
+        return out
+
+    def rbf_sum_grad(
+        Z: np.ndarray, C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray, block_elems: int = 1 << 20
+    ) -> tuple[np.ndarray, np.ndarray]:
+        \"\"\"`rbf_sum` and its gradient w.r.t. each row of Z, from the same blocked pass.
+
+        d/dz mags_i * exp(-||z - c_i||^2 / (2 sigma_i^2)) = -k_i(z) * (z - c_i) / sigma_i^2,
+        where k_i(z) is dent i's weighted kernel value.
+        \"\"\"
+        m, d = Z.shape
+        out = np.zeros(m, dtype=np.float64)
+        grad = np.zeros((m, d), dtype=np.float64)
+        n = C.shape[0]
+        if n == 0:
+            return out, grad
+        inv2s2 = 1.0 / (2.0 * sigmas ** 2)
+        step = max(1, block_elems // max(m * d, 1))
+        for lo in range(0, n, step):
+            hi = min(lo + step, n)
+            diff = Z[:, None, :] - C[None, lo:hi, :]
+            dist2 = np.einsum("mnd,mnd->mn", diff, diff)
+            k = np.exp(-dist2 * inv2s2[None, lo:hi]) * mags[None, lo:hi]
+            out += k.sum(axis=1)
+            k *= 2.0 * inv2s2[None, lo:hi]
+            grad -= np.einsum("mn,mnd->md", k, diff)
+        return out, grad
+
+    def pairwise_sq_dists(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+        \"\"\"(len(A), len(B)) matrix of squared Euclidean distances (Gram-matrix form).\"\"\"
+        sa = np.sum(A * A, axis=1)
+        sb = np.sum(B * B, axis=1)
+        return sa[:, None] + sb[None, :] - 2.0 * (A @ B.T)
+
+    def tanh_matvec(W: np.ndarray, x: np.ndarray) -> np.ndarray:
+        return np.tanh(W @ x)
+
+    # reference implementations for ree_impl.backend
+    KERNELS = {
+        "rbf_sum": rbf_sum,
+        "rbf_sum_grad": rbf_sum_grad,
+        "pairwise_sq_dists": pairwise_sq_dists,
+        "tanh_matvec": tanh_matvec,
+    }
+    """)
+
+    w(root, "src/ree_impl/residue/kernels_numba.py", """
+    \"\"\"Numba implementations of the hot kernels (selected via ree_impl.backend).
+
+    Importing this module imports numba; it is only loaded when the "numba" backend is
+    selected. Results match the NumPy reference up to floating-point summation order.
+    \"\"\"
+    from __future__ import annotations
+    import math
+
+    import numba
+    import numpy as np
+
+    @numba.njit(cache=True)
+    def _rbf_sum(Z, C, mags, sigmas, out, grad, want_grad):
+        m, d = Z.shape
+        for j in range(C.shape[0]):
+            inv = 1.0 / (2.0 * sigmas[j] * sigmas[j])
+            for i in range(m):
+                acc = 0.0
+                for k in range(d):
+                    t = Z[i, k] - C[j, k]
+                    acc += t * t
+                v = mags[j] * math.exp(-acc * inv)
+                out[i] += v
+                if want_grad:
+                    g = 2.0 * inv * v
+                    for k in range(d):
+                        grad[i, k] -= g * (Z[i, k] - C[j, k])
+
+    def _args(Z, C, mags, sigmas):
+        return (
+            np.ascontiguousarray(Z, dtype=np.float64),
+            np.ascontiguousarray(C),
+            np.ascontiguousarray(mags, dtype=np.float64),
+            np.ascontiguousarray(sigmas, dtype=np.float64),
+        )
+
+    def rbf_sum(Z, C, mags, sigmas, block_elems: int = 1 << 20) -> np.ndarray:
+        Z, C, mags, sigmas = _args(Z, C, mags, sigmas)
+        out = np.zeros(Z.shape[0], dtype=np.float64)
+        _rbf_sum(Z, C, mags, sigmas, out, np.zeros((1, 1)), False)
+        return out
+
+    def rbf_sum_grad(Z, C, mags, sigmas, block_elems: int = 1 << 20) -> tuple[np.ndarray, np.ndarray]:
+        Z, C, mags, sigmas = _args(Z, C, mags, sigmas)
+        out = np.zeros(Z.shape[0], dtype=np.float64)
+        grad = np.zeros(Z.shape, dtype=np.float64)
+        _rbf_sum(Z, C, mags, sigmas, out, grad, True)
+        return out, grad
+
+    @numba.njit(cache=True)
+    def _pairwise_sq_dists(A, B, out):
+        for i in range(A.shape[0]):
+            for j in range(B.shape[0]):
+                acc = 0.0
+                for k in range(A.shape[1]):
+                    t = A[i, k] - B[j, k]
+                    acc += t * t
+                out[i, j] = acc
+
+    def pairwise_sq_dists(A, B) -> np.ndarray:
+        A = np.ascontiguousarray(A, dtype=np.float64)
+        B = np.ascontiguousarray(B, dtype=np.float64)
+        out = np.empty((A.shape[0], B.shape[0]), dtype=np.float64)
+        _pairwise_sq_dists(A, B, out)
+        return out
+
+    @numba.njit(cache=True)
+    def _tanh_matvec(W, x, out):
+        for i in range(W.shape[0]):
+            acc = 0.0
+            for k in range(W.shape[1]):
+                acc += W[i, k] * x[k]
+            out[i] = math.tanh(acc)
+
+    def tanh_matvec(W, x) -> np.ndarray:
+        W = np.ascontiguousarray(W)
+        x = np.ascontiguousarray(x, dtype=W.dtype)
+        out = np.empty(W.shape[0], dtype=np.result_type(W.dtype, x.dtype))
+        _tanh_matvec(W, x, out)
+        return out
+
+    KERNELS = {
+        "rbf_sum": rbf_sum,
+        "rbf_sum_grad": rbf_sum_grad,
+        "pairwise_sq_dists": pairwise_sq_dists,
+        "tanh_matvec": tanh_matvec,
+    }
+    """)
+
+    w(root, "src/ree_impl/residue/index.py", """
+    from __future__ import annotations
+    import numpy as np
+
+    class DentBallTree:
+        \"\"\"Static ball-tree over dent centers for truncated RBF queries.
+
+        Each node stores its centroid, covering radius, total |magnitude| and the
+        largest sigma of its dents. A node whose lower-bound distance to the query
+        exceeds `cutoff_sigmas * sigma_max` is skipped; its contribution is at most
+        mass * exp(-lb^2 / (2 sigma_max^2)), which is accumulated into the error bound.
+        \"\"\"
+
+        def __init__(self, centers: np.ndarray, magnitudes: np.ndarray, sigmas: np.ndarray, leaf_size: int = 32):
+            centers = np.asarray(centers, dtype=np.float64)
+            n = centers.shape[0]
+            self.leaf_size = max(int(leaf_size), 1)
+            perm = np.arange(n)
+
+            lo_l, hi_l, left_l, right_l = [], [], [], []
+            stack = [(0, n, -1, 0)]  # (lo, hi, parent, side)
+            while stack:
+                lo, hi, parent, side = stack.pop()
+                node = len(lo_l)
+                lo_l.append(lo)
+                hi_l.append(hi)
+                left_l.append(-1)
+                right_l.append(-1)
+                if parent >= 0:
+                    (left_l if side == 0 else right_l)[parent] = node
+                if hi - lo <= self.leaf_size:
+                    continue
+                idx = perm[lo:hi]
+                pts = centers[idx]
+                dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+                mid = (hi - lo) // 2
+                order = np.argpartition(pts[:, dim], mid)
+                perm[lo:hi] = idx[order]
+                stack.append((lo + mid, hi, node, 1))
+                stack.append((lo, lo + mid, node, 0))
+
+            self.lo = np.array(lo_l, dtype=np.int64)
+            self.hi = np.array(hi_l, dtype=np.int64)
+            self.left = np.array(left_l, dtype=np.int64)
+            self.right = np.array(right_l, dtype=np.int64)
+
+            # dents reordered so every node covers a contiguous block
+            self.centers = centers[perm]
+            self.magnitudes = np.asarray(magnitudes, dtype=np.float64)[perm]
+            self.sigmas = np.asarray(sigmas, dtype=np.float64)[perm]
+            self.perm = perm
+
+            m = len(lo_l)
+            self.centroid = np.zeros((m, centers.shape[1]), dtype=np.float64)
+            self.radius = np.zeros(m, dtype=np.float64)
+            self.mass = np.zeros(m, dtype=np.float64)
+            self.sigma_max = np.zeros(m, dtype=np.float64)
+            abs_mag = np.abs(self.magnitudes)
+            for k in range(m):
+                block = self.centers[self.lo[k]:self.hi[k]]
+                c = block.mean(axis=0)
+                self.centroid[k] = c
+                self.radius[k] = float(np.sqrt(np.max(np.sum((block - c) ** 2, axis=1))))
+                self.mass[k] = float(abs_mag[self.lo[k]:self.hi[k]].sum())
+                self.sigma_max[k] = float(self.sigmas[self.lo[k]:self.hi[k]].max())
+
+        def __len__(self) -> int:
+            return int(self.centers.shape[0])
+
+        def _expand(self, q: np.ndarray, k: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            \"\"\"Replace (query, leaf) pairs by (query, dent position) pairs.\"\"\"
+            lens = self.hi[k] - self.lo[k]
+            total = int(lens.sum())
+            starts = np.repeat(self.lo[k] - np.cumsum(lens) + lens, lens)
+            return np.repeat(q, lens), starts + np.arange(total)
+
+        def _descend(self, Z: np.ndarray, keep_fn):
+            \"\"\"Breadth-first traversal of all (query, node) pairs at once.
+
+            `keep_fn(q, k, dc)` receives query ids, node ids and centroid distances
+            and returns a mask of pairs to keep descending. Yields the surviving
+            (query, leaf) pairs level by level.
+            \"\"\"
+            q = np.arange(Z.shape[0])
+            k = np.zeros(Z.shape[0], dtype=np.int64)
+            while q.shape[0]:
+                dc = np.sqrt(np.sum((Z[q] - self.centroid[k]) ** 2, axis=1))
+                mask = keep_fn(q, k, dc)
+                q, k = q[mask], k[mask]
+                leaf = self.left[k] < 0
+                yield q[leaf], k[leaf]
+                q, k = q[~leaf], k[~leaf]
+                q = np.concatenate([q, q])
+                k = np.concatenate([self.left[k], self.right[k]])
+
+        def query_batch(self, Z: np.ndarray, cutoff_sigmas: float) -> tuple[np.ndarray, np.ndarray, int]:
+            \"\"\"Return (approx potentials, error bounds, dents scanned) for every row of Z.\"\"\"
+            Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+            value = np.zeros(Z.shape[0], dtype=np.float64)
+            bound = np.zeros(Z.shape[0], dtype=np.float64)
+
+            def keep(q, k, dc):
+                lb = dc - self.radius[k]
+                s = self.sigma_max[k]
+                pruned = lb > cutoff_sigmas * s
+                np.add.at(bound, q[pruned], self.mass[k[pruned]] * np.exp(-(lb[pruned] ** 2) / (2.0 * s[pruned] ** 2)))
+                return ~pruned
+
+            scanned = 0
+            for q, k in self._descend(Z, keep):
+                if not q.shape[0]:
+                    continue
+                qi, pos = self._expand(q, k)
+                d2 = np.sum((Z[qi] - self.centers[pos]) ** 2, axis=1)
+                contrib = self.magnitudes[pos] * np.exp(-d2 / (2.0 * self.sigmas[pos] ** 2))
+                value += np.bincount(qi, weights=contrib, minlength=Z.shape[0])
+                scanned += int(pos.shape[0])
+            return value, bound, scanned
+
+        def query(self, z: np.ndarray, cutoff_sigmas: float) -> tuple[float, float, int]:
+            \"\"\"Return (approx potential, error bound, dents scanned) at z.\"\"\"
+            value, bound, scanned = self.query_batch(np.asarray(z)[None, :], cutoff_sigmas)
+            return float(value[0]), float(bound[0]), scanned
+
+        def radius_pairs(self, Z: np.ndarray, r: float) -> tuple[np.ndarray, np.ndarray]:
+            \"\"\"All (row of Z, original dent index) pairs with ||Z_q - c|| <= r, sorted by row then index.\"\"\"
+            Z = np.atleast_2d(np.asarray(Z, dtype=np.float64))
+            out_q, out_i = [], []
+            for q, k in self._descend(Z, lambda q, k, dc: dc - self.radius[k] <= r):
+                if not q.shape[0]:
+                    continue
+                qi, pos = self._expand(q, k)
+                hit = np.sum((Z[qi] - self.centers[pos]) ** 2, axis=1) <= r * r
+                out_q.append(qi[hit])
+                out_i.append(self.perm[pos[hit]])
+            if not out_q:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            qs, idx = np.concatenate(out_q), np.concatenate(out_i)
+            order = np.lexsort((idx, qs))
+            return qs[order], idx[order]
+
+        def query_radius(self, z: np.ndarray, r: float) -> np.ndarray:
+            \"\"\"Original (pre-permutation) indices of all dents with ||z - c|| <= r, sorted.\"\"\"
+            return self.radius_pairs(np.asarray(z)[None, :], r)[1]
+    """)
+
+    # --- Sleep/offline integration ---
+    w(root, "src/ree_impl/sleep/sleep.py", """
+    from __future__ import annotations
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from dataclasses import dataclass, field
+    from typing import Any, Optional
+    import weakref
+    import numpy as np
+
+    from ..backend import kernel
+    from ..residue.field import ResidueField
+    from ..residue.index import DentBallTree
+
+    def _drain(work):
+        \"\"\"Run a work generator to completion and return its result.\"\"\"
+        try:
+            while True:
+                next(work)
+        except StopIteration as stop:
+            return stop.value
+
+    @dataclass
+    class _Job:
+        \"\"\"One deferred consolidation of the first `n0` dents of a residue field.\"\"\"
+        lspace: Any
+        n0: int
+        epoch: int
+        work: Any  # merge generator (incremental) or Future (background)
+        result: Optional[tuple] = None
+
+    @dataclass
+    class SleepSubsystem:
+        every_n_steps: int = 25
+        merge_radius: float = 1.0
+        # "greedy": seed-ordered grouping (reproduces the v0 merge exactly)
+        # "components": union-find over all within-radius pairs (single linkage)
+        merge_strategy: str = "greedy"
+        # up to this many dents, neighbours come from a dense pairwise-distance matrix;
+        # above it, from a ball-tree radius query
+        dense_merge_max: int = 1024
+        # "sync": consolidate inside the step that triggers sleep (v0 behaviour)
+        # "incremental": merge a snapshot, at most ~work_per_step dents of work per tick
+        # "background": merge a snapshot in a worker thread
+        # deferred merges are swapped in whole, with dents added meanwhile appended unmerged
+        mode: str = "sync"
+        work_per_step: int = 256
+        # hippocampal replay after each consolidation: up to replay_segments recent
+        # stored paths are re-traversed over the (fixed) residue field
+        path_memory: Optional[Any] = None
+        replay_segments: int = 8
+        replay_stats: dict = field(default_factory=lambda: {"segments": 0, "steps": 0, "potential": 0.0})
+        # in-flight jobs by field; weakly keyed, so a field that is dropped takes its job with it
+        _jobs: weakref.WeakKeyDictionary = field(default_factory=weakref.WeakKeyDictionary, init=False, repr=False, compare=False)
+        _pool: Optional[ThreadPoolExecutor] = field(default=None, init=False, repr=False, compare=False)
+
+        def should_sleep(self, t: int) -> bool:
+            return t % self.every_n_steps == 0
+
+        def run_offline(self, residue: ResidueField, lspace) -> None:
+            \"\"\"Offline consolidation.
+
+            v0 behaviour:
+            - merge nearby dents (compress residue representation)
+            - mild precision recalibration (reduce overcommitment if residue is large)
+            - replay of recent stored paths, if a path memory is attached
+            \"\"\"
+            self._merge_dents(residue)
+            self._recalibrate_precision(residue, lspace)
+            self._replay(residue)
+
+        def tick(self, t: int, residue: ResidueField, lspace) -> bool:
+            \"\"\"Per-step entry point for the agents. Returns True if a consolidation was applied.
+
+            In "sync" mode this is `run_offline` whenever `should_sleep(t)`. In the deferred
+            modes a trigger snapshots the residue (skipped while a job for it is still running),
+            and later ticks advance or poll the job until its result is swapped in.
+            \"\"\"
+            if self.mode == "sync":
+                if not self.should_sleep(t):
+                    return False
+                self.run_offline(residue, lspace)
+                return True
+            if self.mode not in ("incremental", "background"):
+                raise ValueError(f"unknown sleep mode: {self.mode!r}")
+            applied = False
+            job = self._jobs.get(residue)
+            if job is not None and self._advance(job):
+                del self._jobs[residue]
+                applied = self._apply(residue, job)
+            if self.should_sleep(t) and residue not in self._jobs:
+                self._start(residue, lspace)
+            return applied
+
+        @property
+        def pending(self) -> int:
+            return len(self._jobs)
+
+        def flush(self) -> None:
+            \"\"\"Finish every in-flight consolidation now and swap the results in.\"\"\"
+            for residue, job in list(self._jobs.items()):
+                job.result = job.work.result() if isinstance(job.work, Future) else _drain(job.work)
+                self._apply(residue, job)
+            self._jobs.clear()
+
+        def cancel(self, residue: ResidueField) -> None:
+            \"\"\"Drop the in-flight consolidation of `residue`, if any (e.g. when the field is replaced).\"\"\"
+            job = self._jobs.pop(residue, None)
+            if job is not None and isinstance(job.work, Future):
+                job.work.cancel()  # a merge already running finishes in the worker and is discarded
+
+        def close(self) -> None:
+            self.flush()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+        def _start(self, residue: ResidueField, lspace) -> None:
+            n = residue.count()
+            # astype copies, so the job owns its snapshot
+            work = self._merge(
+                residue.centers.astype(np.float64),
+                residue.magnitudes.astype(np.float64),
+                residue.sigmas.astype(np.float64),
+            )
+            if self.mode == "background":
+                # the grouping loop holds the GIL between numpy calls, so the online loop
+                # still shares the interpreter with it; "incremental" bounds that cost exactly
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ree-sleep")
+                work = self._pool.submit(_drain, work)
+            self._jobs[residue] = _Job(lspace, n, residue.epoch, work)
+
+        def _advance(self, job: _Job) -> bool:
+            if isinstance(job.work, Future):
+                if not job.work.done():
+                    return False
+                job.result = job.work.result()
+                return True
+            done = 0
+            try:
+                while done < self.work_per_step:
+                    done += next(job.work)
+            except StopIteration as stop:
+                job.result = stop.value
+                return True
+            return False
+
+        def _apply(self, residue: ResidueField, job: _Job) -> bool:
+            n = residue.count()
+            if residue.epoch != job.epoch:
+                # the field was rewritten while the job ran; its snapshot is stale
+                return False
+            if job.result is not None:
+                centers, mass, sigma = job.result
+                residue.set_arrays(
+                    np.concatenate([centers, residue.centers[job.n0:n]]),
+                    np.concatenate([mass, residue.magnitudes[job.n0:n]]),
+                    np.concatenate([sigma, residue.sigmas[job.n0:n]]),
+                )
+            self._recalibrate_precision(residue, job.lspace)
+            self._replay(residue)
+            return True
+
+        def _neighbours(self, C: np.ndarray):
+            \"\"\"Yields work done; returns f(i) -> indices j (including i) with ||C_i - C_j|| <= merge_radius.\"\"\"
+            r = float(self.merge_radius)
+            if C.shape[0] <= self.dense_merge_max:
+                close = kernel("pairwise_sq_dists")(C, C) <= r * r
+                yield C.shape[0]
+                return lambda i: np.flatnonzero(close[i])
+            n = C.shape[0]
+            tree = DentBallTree(C, np.ones(n), np.ones(n))
+            yield n
+            qs, idx = [], []
+            for lo in range(0, n, 1024):
+                q, i = tree.radius_pairs(C[lo:lo + 1024], r)
+                qs.append(q + lo)
+                idx.append(i)
+                yield min(1024, n - lo)
+            q, idx = np.concatenate(qs), np.concatenate(idx)
+            ptr = np.searchsorted(q, np.arange(n + 1))
+            return lambda i: idx[ptr[i]:ptr[i + 1]]
+
+        def _group_labels(self, C: np.ndarray):
+            \"\"\"Yields work done (one unit per dent visited); returns the group label of each dent.\"\"\"
+            n = C.shape[0]
+            neighbours = yield from self._neighbours(C)
+            labels = np.full(n, -1, dtype=np.int64)
+            if self.merge_strategy == "greedy":
+                g = 0
+                for i in range(n):
+                    yield 1
+                    if labels[i] >= 0:
+                        continue
+                    nb = neighbours(i)
+                    nb = nb[labels[nb] < 0]
+                    labels[nb] = g
+                    labels[i] = g
+                    g += 1
+                return labels
+            if self.merge_strategy == "components":
+                parent = np.arange(n)
+
+                def find(x: int) -> int:
+                    while parent[x] != x:
+                        parent[x] = parent[parent[x]]
+                        x = parent[x]
+                    return x
+
+                for i in range(n):
+                    yield 1
+                    ri = find(i)
+                    for j in neighbours(i):
+                        if j > i:
+                            rj = find(int(j))
+                            if rj != ri:
+                                parent[max(ri, rj)] = min(ri, rj)
+                                ri = min(ri, rj)
+                roots = np.array([find(i) for i in range(n)], dtype=np.int64)
+                # relabel in order of each group's first dent
+                _, first = np.unique(roots, return_index=True)
+                order = np.argsort(first)
+                remap = np.empty(n, dtype=np.int64)
+                remap[roots[first[order]]] = np.arange(order.shape[0])
+                return remap[roots]
+            raise ValueError(f"unknown merge_strategy: {self.merge_strategy!r}")
+
+        def _merge(self, C: np.ndarray, mags: np.ndarray, sigmas: np.ndarray):
+            \"\"\"Merge generator: yields work done; returns merged (centers, mass, sigma), or None if nothing merges.\"\"\"
+            n = C.shape[0]
+            if n < 2:
+                return None
+            labels = yield from self._group_labels(C)
+            k = int(labels.max()) + 1
+            if k == n:
+                return None
+
+            sizes = np.bincount(labels, minlength=k)
+            mass = np.bincount(labels, weights=mags, minlength=k)
+            weighted = np.zeros((k, C.shape[1]), dtype=np.float64)
+            np.add.at(weighted, labels, C * mags[:, None])
+            centers = weighted / np.maximum(mass, 1e-6)[:, None]
+            sigma = np.bincount(labels, weights=sigmas, minlength=k) / sizes
+
+            # singletons are kept untouched
+            first = np.full(k, n, dtype=np.int64)
+            np.minimum.at(first, labels, np.arange(n))
+            single = sizes == 1
+            centers[single] = C[first[single]]
+            return centers, mass, sigma
+
+        def _merge_dents(self, residue: ResidueField) -> None:
+            if residue.count() < 2:
+                return
+            merged = _drain(self._merge(
+                residue.centers.astype(np.float64),
+                residue.magnitudes.astype(np.float64),
+                residue.sigmas.astype(np.float64),
+            ))
+            if merged is not None:
+                residue.set_arrays(*merged)
+
+        def _replay(self, residue: ResidueField) -> None:
+            \"\"\"Re-traverse recent paths over the residue field. Read-only: replay explores
+            paths, it neither changes the field nor the policy.\"\"\"
+            memory = self.path_memory
+            if memory is None or "beta" not in memory.layout or residue.count() == 0:
+                return
+            stats = self.replay_stats
+            for seg in memory.replay(order="recent", limit=self.replay_segments):
+                phi = residue.potential_batch(seg.depth("beta"))
+                stats["segments"] += 1
+                stats["steps"] += int(phi.shape[0])
+                stats["potential"] += float(phi.sum())
+
+        def _recalibrate_precision(self, residue: ResidueField, lspace) -> None:
+            # simple rule: if residue is large, reduce beta alpha slightly (more cautious updates)
+            if residue.count() >= 8:
+                lspace.alphas["beta"] = max(0.5, float(lspace.alphas.get("beta", 1.0)) * 0.95)
+    """)
+
+    # --- Persistence ---
+    w(root, "src/ree_impl/persist/checkpoint.py", """
+    from __future__ import annotations
+    import json
+    import os
+    from pathlib import Path
+
+    import numpy as np
+    from numpy.lib.format import open_memmap
+
+    from ..lspace.stack import DEPTHS, LSpace, LState
+    from ..residue.field import ResidueField
+
+    FORMAT = "ree-checkpoint"
+    VERSION = 1
+
+    _RESIDUE_ARRAYS = (("centers", np.float32), ("magnitudes", np.float64), ("sigmas", np.float64))
+
+    def _write_json(path: Path, obj: dict) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(obj, indent=2, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _read_json(path: Path, kind: str) -> dict:
+        header = json.loads(path.read_text(encoding="utf-8"))
+        if header.get("format") != FORMAT or header.get("kind") != kind:
+            raise ValueError(f"{path} is not a {FORMAT} {kind} header")
+        if header.get("version", 0) > VERSION:
+            raise ValueError(f"{path} has version {header['version']}; this build reads up to {VERSION}")
+        return header
+
+    def _save_npy(path: Path, arr: np.ndarray) -> None:
+        # write-then-rename, so readers that mapped the old file keep a consistent view
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+
+    class ResidueStore:
+        \"\"\"A residue field on disk: residue.json plus centers/magnitudes/sigmas .npy files.
+
+        The .npy files are preallocated with spare rows. `save` appends only the dents added
+        since the last save when the field has merely grown (same `epoch`); after a rewrite
+        (e.g. sleep consolidation) the arrays are written afresh. The header is replaced
+        last and carries the row count, so a reader never sees a half-written dent.
+        \"\"\"
+
+        def __init__(self, path: str | os.PathLike):
+            self.path = Path(path)
+
+        def _file(self, name: str) -> Path:
+            return self.path / f"residue_{name}.npy"
+
+        def header(self) -> dict | None:
+            p = self.path / "residue.json"
+            return _read_json(p, "residue") if p.exists() else None
+
+        def save(self, residue: ResidueField) -> int:
+            \"\"\"Persist `residue`; returns the number of dent rows written.\"\"\"
+            self.path.mkdir(parents=True, exist_ok=True)
+            n = residue.count()
+            dim = int(residue.centers.shape[1]) if n else 0
+            head = self.header()
+            arrays = dict(centers=residue.centers, magnitudes=residue.magnitudes, sigmas=residue.sigmas)
+            append = (
+                head is not None
+                and head["epoch"] == residue.epoch
+                and head["dim"] == dim
+                and head["n"] <= n <= head["capacity"]
+            )
+            if append:
+                lo = head["n"]
+                for name, _ in _RESIDUE_ARRAYS:
+                    mm = np.load(self._file(name), mmap_mode="r+")
+                    mm[lo:n] = arrays[name][lo:n]
+                    mm.flush()
+                    del mm
+                capacity, written = head["capacity"], n - lo
+            else:
+                capacity = 16
+                while capacity < n:
+                    capacity *= 2
+                for name, dtype in _RESIDUE_ARRAYS:
+                    shape = (capacity, dim) if name == "centers" else (capacity,)
+                    tmp = self._file(name).with_suffix(".npy.tmp")
+                    mm = open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+                    mm[:n] = arrays[name]
+                    mm.flush()
+                    del mm
+                    os.replace(tmp, self._file(name))
+                written = n
+            _write_json(self.path / "residue.json", {
+                "format": FORMAT, "version": VERSION, "kind": "residue",
+                "n": n, "dim": dim, "capacity": capacity, "epoch": residue.epoch,
+            })
+            return written
+
+        def load(self, mmap: bool = True) -> ResidueField:
+            \"\"\"Load the stored field. With `mmap=True` the arrays are read-only memory maps
+            shared with every other process mapping the same files; the field copies them
+            into private storage on its first mutation.\"\"\"
+            head = self.header()
+            if head is None:
+                raise FileNotFoundError(self.path / "residue.json")
+            field = ResidueField()
+            n = head["n"]
+            if n == 0:
+                return field
+            arrs = [np.load(self._file(name), mmap_mode="r" if mmap else None)[:n] for name, _ in _RESIDUE_ARRAYS]
+            if mmap:
+                field.wrap_arrays(*arrs)
+            else:
+                field.set_arrays(*arrs)
+            field.epoch = head["epoch"]
+            return field
+
+    def save_residue(residue: ResidueField, path: str | os.PathLike) -> int:
+        return ResidueStore(path).save(residue)
+
+    def load_residue(path: str | os.PathLike, mmap: bool = True) -> ResidueField:
+        return ResidueStore(path).load(mmap=mmap)
+
+    def save_lspace(lspace: LSpace, state: LState | None, path: str | os.PathLike, t: int = 0) -> None:
+        \"\"\"Persist LSpace weights / precisions and (optionally) the current latent state.\"\"\"
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for depth in DEPTHS:
+            _save_npy(path / f"lspace_W_{depth}.npy", np.asarray(lspace.W[depth]))
+        if state is not None:
+            for depth in DEPTHS:
+                _save_npy(path / f"lstate_{depth}.npy", np.asarray(getattr(state, depth)))
+        _write_json(path / "lspace.json", {
+            "format": FORMAT, "version": VERSION, "kind": "lspace",
+            "sensor_dim": int(lspace.sensor_dim),
+            "dims": {k: int(v) for k, v in lspace.dims.items()},
+            "alphas": {k: float(v) for k, v in lspace.alphas.items()},
+            "dtype": lspace.dtype.name,
+            "has_state": state is not None,
+            "t": int(t),
+        })
+
+    def load_lspace(path: str | os.PathLike, mmap: bool = False) -> tuple[LSpace, LState | None, int]:
+        \"\"\"Returns (lspace, state or None, t). Weights may be memory-mapped read-only.\"\"\"
+        path = Path(path)
+        head = _read_json(path / "lspace.json", "lspace")
+        lspace = LSpace(head["sensor_dim"], dict(head["dims"]), alphas=dict(head["alphas"]), dtype=head["dtype"])
+        mode = "r" if mmap else None
+        lspace.W = {d: np.load(path / f"lspace_W_{d}.npy", mmap_mode=mode) for d in DEPTHS}
+        lspace.weight_dtype = lspace.W["gamma"].dtype
+        state = None
+        if head["has_state"]:
+            # the latent state is updated in place by update_fast, so it is always a private copy
+            state = LState(**{d: np.load(path / f"lstate_{d}.npy") for d in DEPTHS})
+        return lspace, state, head["t"]
+
+    def save_agent(agent, path: str | os.PathLike) -> int:
+        \"\"\"Checkpoint an REEAgent's learned state (residue, LSpace, LState, t) into `path`.
+
+        Saving repeatedly into the same directory is incremental for the residue.
+        Returns the number of dent rows written.
+        \"\"\"
+        save_lspace(agent.lspace, agent.state, path, t=agent.t)
+        return ResidueStore(path).save(agent.residue)
+
+    def load_agent(agent, path: str | os.PathLike, mmap: bool = False) -> None:
+        \"\"\"Restore a checkpoint written by `save_agent` into an already-constructed agent.
+
+        Planner / coupling / sleep settings, the LSpace weight dtype and the residue's
+        capacity bound and storage precision are configuration, not state, and are kept
+        (loaded weights are cast to `weight_dtype`; reduced-precision centers are
+        re-encoded from the checkpoint's float32 copy).
+        \"\"\"
+        lspace, state, t = load_lspace(path, mmap=mmap)
+        if lspace.sensor_dim != agent.lspace.sensor_dim or lspace.dims != agent.lspace.dims:
+            raise ValueError("checkpoint LSpace shape does not match the agent's")
+        agent.lspace.alphas.clear()
+        agent.lspace.alphas.update(lspace.alphas)
+        wd = agent.lspace.weight_dtype
+        agent.lspace.W = {d: W.astype(wd, copy=False) for d, W in lspace.W.items()}
+        agent.state = state
+        agent.t = t
+        old = agent.residue
+        residue = ResidueStore(path).load(mmap=mmap)
+        # the memory bound and storage precision are configuration too: keep the agent's
+        residue.set_capacity(old.max_dents, policy=old.compaction_policy, compact_to=old.compact_to, grid_cell=old.grid_cell)
+        if old.precision != residue.precision:
+            residue.set_precision(old.precision, old.precision_block)
+        if agent.sleep is not None:
+            agent.sleep.cancel(old)  # a deferred merge of the replaced field must not linger
+        agent.residue = residue
+    """)
+
+    # --- Hippocampal braid (path memory) ---
+    w(root, "src/ree_impl/hippocampus/path_memory.py", """
+    from __future__ import annotations
+    from dataclasses import dataclass
+    from typing import Iterator, Optional
+    import numpy as np
+
+    from ..lspace.stack import DEPTHS, LState
+
+    @dataclass
+    class PathSegment:
+        \"\"\"A copied run of consecutive recorded steps (an episodic trace fragment).\"\"\"
+        start: int  # global step number of the first row
+        z: np.ndarray  # (m, dim) latent rows, laid out as PathMemory.layout
+        action: np.ndarray
+        reality_cost: np.ndarray
+        ethical_cost: np.ndarray
+        residue_cost: np.ndarray
+        episode: np.ndarray
+        t: np.ndarray
+        layout: dict
+
+        def depth(self, name: str) -> np.ndarray:
+            return self.z[:, self.layout[name]]
+
+    class PathMemory:
+        \"\"\"Bounded store of experienced trajectories (see docs/architecture/hippocampal_braid.md).
+
+        Steps go into preallocated ring buffers of `capacity` rows, so memory is fixed and
+        recording is a handful of row copies. The ring is cut into segments of
+        `segment_len` steps; each completed segment gets an index key (its mean latent
+        row) used for nearest-trajectory lookup. Segments never span episodes:
+        `new_episode` closes a partial segment early, and the rest of its slots stay unused. Replay streams copied segments, oldest
+        retained first by default. The store only records paths: it never computes
+        value or touches the residue field.
+        \"\"\"
+
+        def __init__(self, dims: dict, capacity: int = 1 << 16, segment_len: int = 32, depths=DEPTHS):
+            self.segment_len = int(segment_len)
+            n_segments = max(1, -(-int(capacity) // self.segment_len))
+            self.capacity = n_segments * self.segment_len
+            self.layout: dict = {}
+            offset = 0
+            for depth in depths:
+                self.layout[depth] = slice(offset, offset + int(dims[depth]))
+                offset += int(dims[depth])
+            self._slices = list(self.layout.items())
+            self._z = np.zeros((self.capacity, offset), dtype=np.float32)
+            self._action = np.zeros(self.capacity, dtype=np.int32)
+            self._costs = np.zeros((self.capacity, 3), dtype=np.float64)
+            self._episode = np.zeros(self.capacity, dtype=np.int64)
+            self._t = np.zeros(self.capacity, dtype=np.int64)
+            self._keys = np.zeros((n_segments, offset), dtype=np.float64)
+            self._lens = np.zeros(n_segments, dtype=np.int64)  # rows per segment (< segment_len if closed early)
+            self.total = 0  # ring slots ever used: recorded steps plus slots skipped at episode ends
+            self._held = np.zeros(self.capacity, dtype=bool)  # slot holds a recorded step
+            self._stored = 0
+            self.episode = 0
+            self._t_ep = 0
+
+        def __len__(self) -> int:
+            return self._stored
+
+        def new_episode(self) -> None:
+            if self._t_ep:
+                self.episode += 1
+                partial = self.total % self.segment_len
+                if partial:
+                    self._close_segment(partial)
+                    # older steps left in the skipped slots belong to no stored segment any more
+                    lo = self.total % self.capacity
+                    skipped = self._held[lo:lo + self.segment_len - partial]
+                    self._stored -= int(skipped.sum())
+                    skipped[:] = False
+                    self.total += self.segment_len - partial
+            self._t_ep = 0
+
+        def _close_segment(self, rows: int) -> None:
+            \"\"\"Index the segment holding the last `rows` recorded steps.\"\"\"
+            g = (self.total - 1) // self.segment_len
+            lo = (g * self.segment_len) % self.capacity
+            self._keys[g % self._keys.shape[0]] = self._z[lo:lo + rows].mean(axis=0)
+            self._lens[g % self._lens.shape[0]] = rows
+
+        def encode(self, state: LState) -> np.ndarray:
+            \"\"\"An LState as one latent row in this store's layout.\"\"\"
+            row = np.empty(self._z.shape[1], dtype=np.float32)
+            for depth, sl in self._slices:
+                row[sl] = getattr(state, depth)
+            return row
+
+        def record(self, state: LState, action: int, reality_cost: float, ethical_cost: float, residue_cost: float) -> None:
+            i = self.total % self.capacity
+            if not self._held[i]:
+                self._held[i] = True
+                self._stored += 1
+            row = self._z[i]
+            for depth, sl in self._slices:
+                row[sl] = getattr(state, depth)
+            self._action[i] = action
+            self._costs[i] = (reality_cost, ethical_cost, residue_cost)
+            self._episode[i] = self.episode
+            self._t[i] = self._t_ep
+            self._t_ep += 1
+            self.total += 1
+            if self.total % self.segment_len == 0:
+                self._close_segment(self.segment_len)
+
+        # --- segments ---
+        def _segment_range(self) -> range:
+            \"\"\"Global numbers of the completed segments still fully held in the ring.\"\"\"
+            first = -(-max(0, self.total - self.capacity) // self.segment_len)
+            return range(first, self.total // self.segment_len)
+
+        def segment(self, g: int) -> PathSegment:
+            if g not in self._segment_range():
+                raise IndexError(f"segment {g} is not (or no longer) stored")
+            lo = (g * self.segment_len) % self.capacity
+            sl = slice(lo, lo + int(self._lens[g % self._lens.shape[0]]))
+            return PathSegment(
+                start=g * self.segment_len,
+                z=self._z[sl].copy(),
+                action=self._action[sl].copy(),
+                reality_cost=self._costs[sl, 0].copy(),
+                ethical_cost=self._costs[sl, 1].copy(),
+                residue_cost=self._costs[sl, 2].copy(),
+                episode=self._episode[sl].copy(),
+                t=self._t[sl].copy(),
+                layout=self.layout,
+            )
+
+        def nearest(self, query, k: int = 1) -> list[tuple[int, float]]:
+            \"\"\"The k stored segments whose mean latent row is closest to `query`.
+
+            `query` is an LState, one latent row, or an (m, dim) path (compared by its mean).
+            Returns [(segment number, distance)] nearest first; pass the number to `segment`.
+            \"\"\"
+            segs = self._segment_range()
+            if len(segs) == 0:
+                return []
+            q = self.encode(query) if isinstance(query, LState) else np.asarray(query, dtype=np.float64)
+            if q.ndim == 2:
+                q = q.mean(axis=0)
+            g = np.arange(segs.start, segs.stop)
+            keys = self._keys[g % self._keys.shape[0]]
+            d2 = np.sum((keys - q) ** 2, axis=1)
+            k = min(int(k), g.shape[0])
+            top = np.argpartition(d2, k - 1)[:k]
+            top = top[np.argsort(d2[top], kind="stable")]
+            return [(int(g[j]), float(np.sqrt(d2[j]))) for j in top]
+
+        def replay(
+            self,
+            order: str = "chronological",
+            limit: Optional[int] = None,
+            rng: Optional[np.random.Generator] = None,
+        ) -> Iterator[PathSegment]:
+            \"\"\"Stream stored segments ("chronological", "recent" = newest first, or "random").\"\"\"
+            g = np.arange(self._segment_range().start, self._segment_range().stop)
+            if order == "recent":
+                g = g[::-1]
+            elif order == "random":
+                g = (rng if rng is not None else np.random.default_rng()).permutation(g)
+            elif order != "chronological":
+                raise ValueError(f"unknown replay order: {order!r}")
+            n = 0
+            for seg in g:
+                if limit is not None and n >= limit:
+                    return
+                if int(seg) not in self._segment_range():
+                    continue  # overwritten while the consumer was iterating
+                n += 1
+                yield self.segment(int(seg))
+    """)
+
+    # --- Planner (MPC) ---
+    w(root, "src/ree_impl/planning/mpc.py", """
+    from __future__ import annotations
+    from dataclasses import dataclass, field
+    import math
+    import time
+    import numpy as np
+
+    from ..lspace.stack import DEPTHS, LState
+    from ..residue.field import ResidueField, potential_many
+    from ..social.coupling import CouplingModel
+
+    @dataclass
+    class _Node:
+        env: object  # env copy (clone protocol) or env snapshot (snapshot/restore protocol)
+        lstate: object
+        residue_cost: float  # residue at the latent this node acts from
+        total: float = 0.0
+        reality: float = 0.0
+        ethical: float = 0.0
+        residue: float = 0.0
+        plan: tuple = ()
+        done: bool = False
+        x: np.ndarray | None = field(default=None, repr=False)  # encoded observation
+
+    @dataclass
+    class _Budget:
+        \"\"\"Per-decision limits for anytime search, checked before every rollout.\"\"\"
+        stop_at: float  # perf_counter time
+        max_rollouts: float  # planner.rollouts value to stop at
+        first: int  # rollouts value after the first rollout, which is always allowed
+        cut: bool = False  # a rollout was skipped: the search is incomplete
+
+        def spent(self, rollouts: int) -> bool:
+            if not self.cut and rollouts >= self.first:
+                self.cut = rollouts >= self.max_rollouts or time.perf_counter() >= self.stop_at
+            return self.cut
+
+    @dataclass
+    class MPCPlanner:
+        \"\"\"Receding-horizon planner over env rollouts.
+
+        Each simulated step costs reality + lambda_ethics * ethical + rho_residue * residue,
+        where residue is the field potential at the latent the step is taken from.
+        The current latent's residue is action-invariant and is computed once per decision;
+        deeper latents are predicted with `lspace` when one is passed to `choose_action`
+        (otherwise the current latent is reused).
+
+        Envs exposing snapshot()/restore() are rolled out on a single scratch clone per
+        decision, with search nodes holding snapshots; others are cloned per rollout.
+
+        horizon > 1 searches action sequences:
+        - beam_width=None: depth-first branch-and-bound (exact; prunes partial plans whose
+          running total already reaches the best complete plan, valid since step costs >= 0)
+        - beam_width=k: breadth-first beam keeping the k cheapest partial plans per depth,
+          with the same bound pruning
+
+        Anytime mode (`deadline` seconds and/or `max_rollouts` per decision) runs the
+        per-rollout branch-and-bound best-first and stops when the budget is spent. Root
+        actions are ordered by a warm start (the previous decision's plan continued, then
+        action order); children by their running total. The returned parts add
+        "complete" (False if the budget cut the search) and "overrun" (seconds past the
+        deadline). The best complete plan found wins; failing that, the cheapest first
+        step. At least one rollout is always simulated.
+        \"\"\"
+        horizon: int = 1
+        lambda_ethics: float = 1.5
+        rho_residue: float = 2.0
+        beam_width: int | None = None
+        # simulate whole search levels with env.step_batch when the env provides it
+        use_batch: bool = True
+        # anytime mode: per-decision wall-clock / rollout budget (None = unbounded)
+        deadline: float | None = None
+        max_rollouts: int | None = None
+        # running count of simulated env transitions, for instrumentation
+        rollouts: int = field(default=0, init=False, compare=False, repr=False)
+        # decisions whose search ran past `deadline`
+        overruns: int = field(default=0, init=False, compare=False, repr=False)
+        _last_plan: tuple = field(default=(), init=False, compare=False, repr=False)
+
+        @property
+        def anytime(self) -> bool:
+            return self.deadline is not None or self.max_rollouts is not None
+
+        def choose_action(self, env, lstate, residue: ResidueField, coupling: CouplingModel, lspace=None):
+            # action-invariant: residue at the current latent, scored once per decision
+            root_residue = float(residue.potential(lstate.beta))
+            if self.anytime:
+                return self._anytime(env, lstate, root_residue, residue, coupling, lspace)
+            if self.use_batch and hasattr(env, "step_batch"):
+                return self._batched(env, lstate, root_residue, residue, coupling, lspace)
+
+            root, sim = self._root(env, lstate, root_residue)
+            if self.beam_width is None:
+                best = self._branch_and_bound(root, residue, coupling, lspace, sim)
+            else:
+                best = self._beam(root, residue, coupling, lspace, sim)
+
+            best_parts = {
+                "total": best.total,
+                "reality": best.reality,
+                "ethical": best.ethical,
+                "residue": best.residue,
+                "plan": list(best.plan),
+            }
+            return int(best.plan[0]), best_parts
+
+        def _root(self, env, lstate, root_residue: float) -> tuple[_Node, object]:
+            \"\"\"Search root and scratch sim (None unless the env supports snapshot/restore).\"\"\"
+            if hasattr(env, "snapshot") and hasattr(env, "restore"):
+                return _Node(env=env.snapshot(), lstate=lstate, residue_cost=root_residue), env.clone()
+            return _Node(env=env, lstate=lstate, residue_cost=root_residue), None
+
+        def _anytime(self, env, lstate, root_residue: float, residue: ResidueField, coupling: CouplingModel, lspace):
+            t0 = time.perf_counter()
+            budget = _Budget(
+                stop_at=t0 + self.deadline if self.deadline is not None else math.inf,
+                max_rollouts=self.rollouts + self.max_rollouts if self.max_rollouts is not None else math.inf,
+                first=self.rollouts + 1,
+            )
+            root, sim = self._root(env, lstate, root_residue)
+            order = list(env.action_space())
+            # warm start: the previous plan, one step on (or the previous action at horizon 1)
+            if self._last_plan:
+                pv = self._last_plan[1] if len(self._last_plan) > 1 else self._last_plan[0]
+                if pv in order:
+                    order.remove(pv)
+                    order.insert(0, pv)
+
+            best: list[_Node] = []
+            first: list[_Node] = []
+
+            def visit(node: _Node, depth: int) -> None:
+                bound = best[0].total if best else math.inf
+                children = self._expand(node, depth, bound, residue, coupling, lspace, sim, budget=budget, order=order if depth == 0 else None)
+                children.sort(key=lambda c: c.total)
+                if depth == 0 and children:
+                    first.append(children[0])
+                for child in children:
+                    if best and child.total >= best[0].total:
+                        break
+                    if self._is_leaf(child, depth + 1):
+                        best[:] = [child]
+                    elif not budget.cut:
+                        visit(child, depth + 1)
+
+            visit(root, 0)
+            node = best[0] if best else first[0]
+            overrun = max(0.0, time.perf_counter() - t0 - self.deadline) if self.deadline is not None else 0.0
+            if overrun > 0.0:
+                self.overruns += 1
+            self._last_plan = node.plan
+            parts = {
+                "total": node.total,
+                "reality": node.reality,
+                "ethical": node.ethical,
+                "residue": node.residue,
+                "plan": list(node.plan),
+                "complete": not budget.cut,
+                "overrun": overrun,
+            }
+            return int(node.plan[0]), parts
+
+        def choose_actions(self, envs: list, lstates: LState, residues: list[ResidueField], coupling: CouplingModel, lspace=None):
+            \"\"\"Select actions for N agents at once; `lstates` holds (N, dim) arrays.
+
+            For horizon 1 over batch-capable envs sharing one static world, all N x |A|
+            rollouts are a single step_batch call and the N residue terms one
+            `potential_many` pass. Each agent's "other" move is the next draw of its own
+            env's rollout stream, shared by all of its candidate actions, so choices match
+            per-agent clone rollouts. Other cases fall back to calling `choose_action` per agent.
+            \"\"\"
+            env0 = envs[0]
+            vectorised = (
+                self.horizon <= 1
+                and not self.anytime
+                and self.use_batch
+                and hasattr(env0, "step_batch")
+                and hasattr(env0, "same_world")
+                and all(env0.same_world(e) for e in envs[1:])
+            )
+            if not vectorised:
+                rows = [LState(**{k: getattr(lstates, k)[i] for k in DEPTHS}) for i in range(len(envs))]
+                picks = [self.choose_action(e, s, r, coupling, lspace=lspace) for e, s, r in zip(envs, rows, residues)]
+                return np.array([a for a, _ in picks], dtype=np.int64), [p for _, p in picks]
+
+            n = len(envs)
+            actions = np.asarray(env0.action_space(), dtype=np.int64)
+            n_act = actions.shape[0]
+            # action-invariant: residue at each agent's current latent
+            root_residue = potential_many(residues, lstates.beta)
+
+            parent = np.repeat(np.arange(n), n_act)
+            acts = np.tile(actions, n)
+            states = type(env0.batch_state(1)).concat([e.batch_state(1) for e in envs]).take(parent)
+            # one "other" move per agent, shared by its n_act candidate rows (as a cloned rollout sees)
+            other = np.repeat(np.concatenate([e.draw_other_actions(e.rollout_rng(reuse=True), 1) for e in envs]), n_act, axis=0)
+            _, rc, parts, _done = env0.step_batch(states, acts, other_actions=other)
+            self.rollouts += acts.shape[0]
+
+            eth = parts["self"] + coupling.kappa_other * parts["other"]
+            total = (rc + self.lambda_ethics * eth + self.rho_residue * root_residue[parent]).reshape(n, n_act)
+            pick = np.argmin(total, axis=1)
+            flat = np.arange(n) * n_act + pick
+            chosen = actions[pick]
+            best_parts = [
+                {
+                    "total": float(total[i, pick[i]]),
+                    "reality": float(rc[flat[i]]),
+                    "ethical": float(eth[flat[i]]),
+                    "residue": float(root_residue[i]),
+                    "plan": [int(chosen[i])],
+                }
+                for i in range(n)
+            ]
+            return chosen, best_parts
+
+        def _expand(self, node: _Node, depth: int, bound: float, residue: ResidueField, coupling: CouplingModel, lspace, sim=None, budget=None, order=None) -> list[_Node]:
+            \"\"\"Simulate every action from `node` (in `order` if given, stopping when `budget`
+            is spent); drop children whose running total reaches `bound`.\"\"\"
+            children = []
+            predict = lspace is not None and depth + 1 < self.horizon
+            for a in (sim or node.env).action_space() if order is None else order:
+                if budget is not None and budget.spent(self.rollouts):
+                    break
+                # rollout in a copy (pure transition)
+                if sim is not None:
+                    sim.restore(node.env)
+                    roll = sim
+                else:
+                    roll = node.env.clone()
+                obs2, reality_cost, ethical_parts, done = roll.step(a)
+                self.rollouts += 1
+
+                ethical_cost, total = self._score(node, reality_cost, ethical_parts, coupling)
+                if total >= bound:
+                    continue
+                children.append(self._child(
+                    node, a, roll.snapshot() if sim is not None else roll, reality_cost, ethical_cost, total, done,
+                    x=roll.encode(obs2) if predict and not done else None,
+                ))
+
+            if predict:
+                self._predict(children, residue, lspace)
+            return children
+
+        def _score(self, node: _Node, reality_cost, ethical_parts: dict, coupling: CouplingModel) -> tuple[float, float]:
+            \"\"\"(ethical cost, running total) of one simulated step taken from `node`.\"\"\"
+            ethical_cost = float(ethical_parts["self"] + coupling.kappa_other * ethical_parts["other"])
+            step_total = float(reality_cost + self.lambda_ethics * ethical_cost + self.rho_residue * node.residue_cost)
+            return ethical_cost, node.total + step_total
+
+        def _child(self, node: _Node, a, env, reality_cost, ethical_cost: float, total: float, done, x=None) -> _Node:
+            return _Node(
+                env=env,
+                lstate=node.lstate,
+                residue_cost=node.residue_cost,
+                total=total,
+                reality=node.reality + float(reality_cost),
+                ethical=node.ethical + ethical_cost,
+                residue=node.residue + node.residue_cost,
+                plan=node.plan + (a,),
+                done=bool(done),
+                x=x,
+            )
+
+        def _predict(self, children: list[_Node], residue: ResidueField, lspace) -> None:
+            \"\"\"Predicted latents for the next depth (from each child's parent latent), scored in one batch.\"\"\"
+            live = [c for c in children if not c.done]
+            if not live:
+                return
+            for c in live:
+                c.lstate = lspace.update_fast(c.x, c.lstate)
+                c.x = None
+            costs = residue.potential_batch(np.stack([c.lstate.beta for c in live]))
+            for c, rc in zip(live, costs):
+                c.residue_cost = float(rc)
+
+        def _is_leaf(self, node: _Node, depth: int) -> bool:
+            return node.done or depth >= self.horizon
+
+        def _branch_and_bound(self, root: _Node, residue: ResidueField, coupling: CouplingModel, lspace, sim=None) -> _Node:
+            best: list[_Node] = []
+
+            def visit(node: _Node, depth: int) -> None:
+                bound = best[0].total if best else math.inf
+                for child in self._expand(node, depth, bound, residue, coupling, lspace, sim):
+                    if best and child.total >= best[0].total:
+                        continue
+                    if self._is_leaf(child, depth + 1):
+                        best[:] = [child]
+                    else:
+                        visit(child, depth + 1)
+
+            visit(root, 0)
+            return best[0]
+
+        def _beam(self, root: _Node, residue: ResidueField, coupling: CouplingModel, lspace, sim=None) -> _Node:
+            best = None
+            frontier = [root]
+            for depth in range(max(self.horizon, 1)):
+                children = []
+                for node in frontier:
+                    bound = best.total if best is not None else math.inf
+                    for child in self._expand(node, depth, bound, residue, coupling, lspace, sim):
+                        if self._is_leaf(child, depth + 1):
+                            if best is None or child.total < best.total:
+                                best = child
+                        else:
+                            children.append(child)
+                if best is not None:
+                    children = [c for c in children if c.total < best.total]
+                children.sort(key=lambda c: c.total)
+                frontier = children[: max(int(self.beam_width), 1)]
+                if not frontier:
+                    break
+            return best
+
+        def _batched(self, env, lstate, root_residue: float, residue: ResidueField, coupling: CouplingModel, lspace):
+            \"\"\"Level-synchronous search: every (frontier node, action) pair of a depth in one step_batch call.
+
+            Exact mode first dives with a width-1 beam to obtain an incumbent bound, then
+            expands all plans breadth-first, pruning by running total against that bound.
+            If no plan of the full pass beats the bound, the dive's plan is returned.
+            \"\"\"
+            bound = math.inf
+            dive = None
+            if self.beam_width is None and self.horizon > 1:
+                bound, dive = self._batched_level_search(env, lstate, root_residue, residue, coupling, lspace, 1, math.inf)
+                bound += 1e-12
+            width = self.beam_width
+            _, parts = self._batched_level_search(env, lstate, root_residue, residue, coupling, lspace, width, bound)
+            if parts is None:
+                parts = dive
+            return int(parts["plan"][0]), parts
+
+        def _batched_level_search(self, env, lstate, root_residue, residue, coupling, lspace, width, bound):
+            actions = np.asarray(env.action_space(), dtype=np.int64)
+            n_act = actions.shape[0]
+            rng = env.rollout_rng(reuse=True) if hasattr(env, "rollout_rng") else None
+            states = env.batch_state(1)
+            total = np.zeros(1)
+            reality = np.zeros(1)
+            ethical = np.zeros(1)
+            res_sum = np.zeros(1)
+            res_cost = np.array([root_residue])
+            plans = np.zeros((1, 0), dtype=np.int64)
+            lstates = [lstate]
+            best = None
+
+            for depth in range(max(self.horizon, 1)):
+                parent = np.repeat(np.arange(len(states)), n_act)
+                acts = np.tile(actions, len(states))
+                if rng is not None and hasattr(env, "draw_other_actions"):
+                    # one "other" move per depth, shared by every row: the move a cloned
+                    # rollout at this depth would draw, whatever the frontier layout
+                    other = np.repeat(env.draw_other_actions(rng, 1), acts.shape[0], axis=0)
+                    states, rc, parts, done = env.step_batch(states.take(parent), acts, other_actions=other)
+                else:
+                    states, rc, parts, done = env.step_batch(states.take(parent), acts, rng=rng)
+                self.rollouts += acts.shape[0]
+                eth = parts["self"] + coupling.kappa_other * parts["other"]
+                total = total[parent] + rc + self.lambda_ethics * eth + self.rho_residue * res_cost[parent]
+                reality = reality[parent] + rc
+                ethical = ethical[parent] + eth
+                res_sum = res_sum[parent] + res_cost[parent]
+                res_cost = res_cost[parent]
+                plans = np.concatenate([plans[parent], acts[:, None]], axis=1)
+
+                leaf = done | (depth + 1 >= self.horizon)
+                cand = np.flatnonzero(leaf & (total < bound))
+                if cand.shape[0]:
+                    i = int(cand[np.argmin(total[cand])])
+                    bound = float(total[i])
+                    best = {
+                        "total": bound,
+                        "reality": float(reality[i]),
+                        "ethical": float(ethical[i]),
+                        "residue": float(res_sum[i]),
+                        "plan": [int(a) for a in plans[i]],
+                    }
+
+                keep = np.flatnonzero(~leaf & (total < bound))
+                if width is not None:
+                    keep = keep[np.argsort(total[keep], kind="stable")[: max(int(width), 1)]]
+                if not keep.shape[0]:
+                    break
+                states = states.take(keep)
+                total, reality, ethical, res_sum, res_cost = total[keep], reality[keep], ethical[keep], res_sum[keep], res_cost[keep]
+                plans = plans[keep]
+
+                # predicted latents for the next depth, scored in one batch
+                if lspace is not None:
+                    xs = env.encode_batch(states)
+                    lstates = [lspace.update_fast(x, lstates[parent[k]]) for x, k in zip(xs, keep)]
+                    res_cost = residue.potential_batch(np.stack([ls.beta for ls in lstates]))
+                else:
+                    lstates = [lstates[parent[k]] for k in keep]
+            return bound, best
+    """)
+
+    w(root, "src/ree_impl/planning/async_mpc.py", """
+    from __future__ import annotations
+    import asyncio
+    from dataclasses import dataclass, field
+    from typing import Optional
+
+    from ..residue.field import ResidueField
+    from ..social.coupling import CouplingModel
+    from .mpc import MPCPlanner, _Node
+
+    @dataclass
+    class AsyncMPCPlanner(MPCPlanner):
+        \"\"\"MPCPlanner for slow simulators behind the AsyncEnv protocol (see envs/async_env.py).
+
+        Search is level-synchronous: every (frontier node, action) rollout of a depth is
+        issued at once, with at most `max_concurrency` in flight and each bounded by
+        `rollout_timeout` seconds. A rollout that times out is dropped from the search and
+        counted in `timeouts`. Scoring is MPCPlanner's. beam_width=None keeps every partial
+        plan (exact, pruned against the best complete plan so far); beam_width=k keeps the
+        k cheapest per depth. If no plan reaches a leaf, the cheapest partial plan is used;
+        if no rollout finishes at all, TimeoutError is raised.
+
+        Envs with snapshot()/restore() are rolled out on a pool of `max_concurrency`
+        scratch clones restored per rollout; others are cloned per rollout.
+        \"\"\"
+        max_concurrency: int = 8
+        rollout_timeout: Optional[float] = None  # seconds per rollout; None waits forever
+        use_snapshots: bool = True
+        timeouts: int = field(default=0, init=False, compare=False, repr=False)
+
+        async def achoose_action(self, env, lstate, residue: ResidueField, coupling: CouplingModel, lspace=None):
+            # action-invariant: residue at the current latent, scored once per decision
+            root_residue = float(residue.potential(lstate.beta))
+            n_sims = max(int(self.max_concurrency), 1)
+            pool = None
+            if self.use_snapshots and hasattr(env, "snapshot") and hasattr(env, "restore"):
+                root = _Node(env=await env.snapshot(), lstate=lstate, residue_cost=root_residue)
+                pool = asyncio.Queue()
+                for sim in await asyncio.gather(*(env.clone() for _ in range(n_sims))):
+                    pool.put_nowait(sim)
+            else:
+                root = _Node(env=env, lstate=lstate, residue_cost=root_residue)
+            limit = asyncio.Semaphore(n_sims)
+            actions = list(env.action_space())
+
+            best = None
+            fallback = None
+            frontier = [root]
+            for depth in range(max(self.horizon, 1)):
+                predict = lspace is not None and depth + 1 < self.horizon
+                jobs = [(node, a) for node in frontier for a in actions]
+                results = await asyncio.gather(*(self._rollout(node, a, pool, limit, predict) for node, a in jobs))
+
+                children = []
+                for (node, a), res in zip(jobs, results):
+                    if res is None:
+                        continue
+                    roll, x, reality_cost, ethical_parts, done = res
+                    ethical_cost, total = self._score(node, reality_cost, ethical_parts, coupling)
+                    if best is not None and total >= best.total:
+                        continue
+                    child = self._child(node, a, roll, reality_cost, ethical_cost, total, done, x=x)
+                    if self._is_leaf(child, depth + 1):
+                        best = child
+                    else:
+                        children.append(child)
+                if best is not None:
+                    children = [c for c in children if c.total < best.total]
+                if self.beam_width is not None:
+                    children.sort(key=lambda c: c.total)
+                    children = children[: max(int(self.beam_width), 1)]
+                if not children:
+                    break
+                fallback = min(children, key=lambda c: c.total)
+                if predict:
+                    self._predict(children, residue, lspace)
+                frontier = children
+
+            best = best if best is not None else fallback
+            if best is None:
+                raise TimeoutError(f"no rollout finished within {self.rollout_timeout}s")
+            best_parts = {
+                "total": best.total,
+                "reality": best.reality,
+                "ethical": best.ethical,
+                "residue": best.residue,
+                "plan": list(best.plan),
+            }
+            return int(best.plan[0]), best_parts
+
+        async def _rollout(self, node: _Node, a, pool: Optional[asyncio.Queue], limit: asyncio.Semaphore, encode: bool):
+            \"\"\"One simulated step from `node`: (env or snapshot, x, reality, ethical parts, done), or None on timeout.
+
+            The timeout covers the simulator calls only, not the wait for a free slot.
+            \"\"\"
+            async def on_clone():
+                roll = await node.env.clone()
+                obs2, reality_cost, ethical_parts, done = await roll.step(a)
+                x = roll.encode(obs2) if encode and not done else None
+                return roll, x, reality_cost, ethical_parts, done
+
+            async def on_scratch(sim):
+                await sim.restore(node.env)
+                obs2, reality_cost, ethical_parts, done = await sim.step(a)
+                x = sim.encode(obs2) if encode and not done else None
+                return await sim.snapshot(), x, reality_cost, ethical_parts, done
+
+            try:
+                if pool is None:
+                    async with limit:
+                        out = await asyncio.wait_for(on_clone(), self.rollout_timeout)
+                else:
+                    # scratch sims are restored before every use, so one abandoned mid-step is safe to reuse
+                    sim = await pool.get()
+                    try:
+                        out = await asyncio.wait_for(on_scratch(sim), self.rollout_timeout)
+                    finally:
+                        pool.put_nowait(sim)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            self.rollouts += 1
+            return out
+    """)
+
+    # --- Toy environment with clone + pure state ---
+    w(root, "src/ree_impl/envs/toy_gridworld.py", """
+    from __future__ import annotations
+    from dataclasses import dataclass
+    import numpy as np
+
+    @dataclass
+    class State:
+        agent: np.ndarray
+        other: np.ndarray
+        battery: float
+        t: int
+
+    @dataclass
+    class BatchState:
+        \"\"\"Struct-of-arrays view of B independent world states (same static world).\"\"\"
+        agent: np.ndarray    # (B, 2)
+        other: np.ndarray    # (B, 2)
+        battery: np.ndarray  # (B,)
+        t: np.ndarray        # (B,)
+
+        def __len__(self) -> int:
+            return int(self.t.shape[0])
+
+        def take(self, idx: np.ndarray) -> "BatchState":
+            return BatchState(agent=self.agent[idx], other=self.other[idx], battery=self.battery[idx], t=self.t[idx])
+
+        @staticmethod
+        def concat(parts: list["BatchState"]) -> "BatchState":
+            return BatchState(
+                agent=np.concatenate([p.agent for p in parts]),
+                other=np.concatenate([p.other for p in parts]),
+                battery=np.concatenate([p.battery for p in parts]),
+                t=np.concatenate([p.t for p in parts]),
+            )
+
+    @dataclass(frozen=True)
+    class Snapshot:
+        \"\"\"Mutable part of a ToyGridWorld: the State plus the random stream position.\"\"\"
+        state: State
+        rng_state: dict
+
+    def _copy_state(s: State) -> State:
+        return State(agent=s.agent.copy(), other=s.other.copy(), battery=float(s.battery), t=int(s.t))
+
+    # up, down, left, right, stay
+    MOVES = np.array([[0, 1], [0, -1], [-1, 0], [1, 0], [0, 0]])
+    N_ACTIONS = MOVES.shape[0]
+
+    DEFAULT_HAZARDS = ((2, 2), (2, 3), (3, 2))
+
+    class ToyGridWorld:
+        def __init__(
+            self,
+            size: int = 10,
+            max_steps: int = 80,
+            seed: int = 0,
+            hazards=None,
+            n_others: int = 1,
+            other_prefetch: int = 64,
+        ):
+            self.size = size
+            self.max_steps = max_steps
+            # >1 others: State.other is (n_others, 2) and "other" harm counts others on hazards
+            self.n_others = int(n_others)
+            # random "other" moves are drawn this many steps at a time
+            self.other_prefetch = max(1, int(other_prefetch))
+            self.rng = np.random.default_rng(seed)
+            self.hazards = [np.array(h) for h in (DEFAULT_HAZARDS if hazards is None else hazards)]
+            self.food = np.array([size-1, size-1])
+            self.state = self._initial_state()
+
+        @classmethod
+        def large(cls, size: int = 256, hazard_density: float = 0.02, n_others: int = 16, seed: int = 0, **kwargs):
+            \"\"\"A big world with randomly placed hazards (layout drawn from its own seed stream,
+            so the env's "other" stream is the same as for a default world with this seed).\"\"\"
+            layout = np.random.default_rng([seed, 1])
+            n = int(hazard_density * size * size)
+            cells = layout.choice(size * size, size=n, replace=False)
+            hazards = np.stack([cells // size, cells % size], axis=1)
+            return cls(size=size, seed=seed, hazards=hazards, n_others=n_others, **kwargs)
+
+        @property
+        def hazards(self) -> list:
+            return self._hazards
+
+        @hazards.setter
+        def hazards(self, hazards) -> None:
+            self._hazards = list(hazards)
+            # occupancy grid: number of hazards per cell (duplicates stack, as in the list form);
+            # off-grid hazards can never be stepped on, so they are left out rather than wrapped
+            grid = np.zeros((self.size, self.size), dtype=np.int64)
+            for h in self._hazards:
+                x, y = int(h[0]), int(h[1])
+                if 0 <= x < self.size and 0 <= y < self.size:
+                    grid[x, y] += 1
+            self._hazard_grid = grid
+
+        @property
+        def rng(self) -> np.random.Generator:
+            return self._rng
+
+        @rng.setter
+        def rng(self, rng) -> None:
+            self._rng = rng
+            self._other_buf = np.zeros((0,), dtype=np.int64)
+            self._other_pos = 0
+            self._buf_rng_state = None
+            self._scratch_rng = None  # reusable rollout_rng(reuse=True) generator, same bit generator type
+
+        def _initial_state(self) -> State:
+            centre = np.array([self.size//2, self.size//2])
+            other = centre if self.n_others == 1 else np.repeat(centre[None, :], self.n_others, axis=0)
+            return State(agent=np.array([0,0]), other=other, battery=1.0, t=0)
+
+        def _next_other_actions(self) -> np.ndarray:
+            k = self.n_others
+            if self._other_pos + k > self._other_buf.shape[0]:
+                self._buf_rng_state = self._rng.bit_generator.state
+                self._other_buf = np.asarray(self._rng.integers(0, N_ACTIONS, size=k * self.other_prefetch), dtype=np.int64)
+                self._other_pos = 0
+            acts = self._other_buf[self._other_pos:self._other_pos + k]
+            self._other_pos += k
+            return acts
+
+        def draw_other_actions(self, rng: np.random.Generator, n: int) -> np.ndarray:
+            \"\"\"Random "other" actions for n batched states: (n,) or (n, n_others).\"\"\"
+            return rng.integers(0, N_ACTIONS, size=n if self.n_others == 1 else (n, self.n_others))
+
+        def clone(self):
+            \"\"\"Rollout copy: static world (size, hazards, food) is shared, only State is copied.
+
+            The clone gets its own generator positioned at this env's current stream state,
+            so it draws the same "other" moves the real env would next, without advancing it.
+            \"\"\"
+            c = object.__new__(ToyGridWorld)
+            c.size = self.size
+            c.max_steps = self.max_steps
+            c.n_others = self.n_others
+            c.other_prefetch = self.other_prefetch
+            c._hazards = self._hazards
+            c._hazard_grid = self._hazard_grid
+            c.food = self.food
+            c.rng = self.rollout_rng()
+            c.state = _copy_state(self.state)
+            return c
+
+        def rollout_rng(self, reuse: bool = False) -> np.random.Generator:
+            \"\"\"Independent generator starting from this env's current random stream state.
+
+            Prefetched-but-unused "other" moves count as not yet drawn: the generator is
+            rewound to the start of the prefetch and advanced past the consumed part.
+            With `reuse=True` the env's one scratch generator is re-seated and returned
+            instead of constructing a bit generator; it is only valid until the next such call.
+            \"\"\"
+            if reuse and self._scratch_rng is None:
+                self._scratch_rng = np.random.Generator(type(self._rng.bit_generator)(0))
+            g = self._scratch_rng if reuse else np.random.Generator(type(self._rng.bit_generator)(0))
+            if self._buf_rng_state is None or self._other_pos >= self._other_buf.shape[0]:
+                g.bit_generator.state = self._rng.bit_generator.state
+                return g
+            g.bit_generator.state = self._buf_rng_state
+            g.integers(0, N_ACTIONS, size=self._other_pos)
+            return g
+
+        def snapshot(self) -> Snapshot:
+            return Snapshot(state=_copy_state(self.state), rng_state=self.rollout_rng(reuse=True).bit_generator.state)
+
+        def restore(self, snap: Snapshot) -> None:
+            self.state = _copy_state(snap.state)
+            self._rng.bit_generator.state = snap.rng_state
+            self.rng = self._rng  # drop the prefetch: it belongs to the old stream position
+
+        def reset(self):
+            self.state = self._initial_state()
+            return self.observe()
+
+        def action_space(self):
+            return [0,1,2,3,4]  # up, down, left, right, stay
+
+        def _move(self, pos, action):
+            return np.clip(pos + MOVES[action], 0, self.size-1)
+
+        def observe(self):
+            # vision: agent, other(s), food (coords normalised)
+            vision = np.concatenate([self.state.agent, self.state.other.reshape(-1), self.food]).astype(np.float32) / float(self.size)
+            body = np.array([self.state.battery], dtype=np.float32)
+            return {"vision": vision, "body": body}
+
+        def encode(self, obs):
+            # simple: concatenate
+            return np.concatenate([obs["vision"], obs["body"]]).astype(np.float32)
+
+        def step(self, action: int):
+            s = self.state
+            s.t += 1
+            s.battery -= 0.01
+
+            s.agent = self._move(s.agent, action)
+            other_a = self._next_other_actions()
+            if self.n_others == 1:
+                s.other = self._move(s.other, other_a[0])
+            else:
+                s.other = self._move(s.other, other_a)
+
+            grid = self._hazard_grid
+            hits = int(grid[s.agent[0], s.agent[1]])
+            self_pain = 1.0 if hits else 0.0
+            s.battery -= 0.2 * hits
+            others = s.other.reshape(-1, 2)
+            other_pain = float(np.count_nonzero(grid[others[:, 0], others[:, 1]]))
+
+            # reality cost: small step penalty + battery pressure
+            reality_cost = float(0.05 + (1.0 - max(s.battery, 0.0)) * 0.05)
+
+            ethical_parts = {"self": float(self_pain), "other": float(other_pain)}
+
+            done = bool(s.t >= self.max_steps or s.battery <= 0.0)
+            return self.observe(), reality_cost, ethical_parts, done
+
+        # --- batched rollouts (pure: never touches self.state) ---
+        def batch_state(self, n: int = 1) -> BatchState:
+            s = self.state
+            return BatchState(
+                agent=np.repeat(np.asarray(s.agent)[None, :], n, axis=0),
+                other=np.repeat(np.asarray(s.other)[None, ...], n, axis=0),
+                battery=np.full(n, float(s.battery)),
+                t=np.full(n, int(s.t), dtype=np.int64),
+            )
+
+        def encode_batch(self, states: BatchState) -> np.ndarray:
+            \"\"\"Row-wise equivalent of encode(observe()) for every state in the batch.\"\"\"
+            food = np.broadcast_to(self.food, states.agent.shape)
+            others = states.other.reshape(states.other.shape[0], -1)
+            vision = np.concatenate([states.agent, others, food], axis=1).astype(np.float32) / float(self.size)
+            return np.concatenate([vision, states.battery[:, None].astype(np.float32)], axis=1)
+
+        def same_world(self, other) -> bool:
+            \"\"\"True if `other` has the same static world, so their states can share a step_batch.\"\"\"
+            if not isinstance(other, ToyGridWorld):
+                return False
+            same_shape = other.size == self.size and other.max_steps == self.max_steps and other.n_others == self.n_others
+            if other is self or (other._hazard_grid is self._hazard_grid and other.food is self.food):
+                return same_shape
+            return same_shape and np.array_equal(other.food, self.food) and np.array_equal(other._hazard_grid, self._hazard_grid)
+
+        def step_batch(self, states: BatchState, actions: np.ndarray, rng: np.random.Generator | None = None, other_actions: np.ndarray | None = None):
+            \"\"\"Vectorised `step` for B states at once.
+
+            Returns (next_states, reality_cost (B,), ethical_parts {"self", "other"} of (B,), done (B,)).
+            "other" moves are `other_actions` if given, else drawn from `rng`, one
+            independent draw per row (by default from `rollout_rng(reuse=True)`). Planners
+            pass `other_actions` so rows match the clone / snapshot rollouts.
+            \"\"\"
+            actions = np.asarray(actions, dtype=np.int64)
+            n = actions.shape[0]
+            t = states.t + 1
+            battery = states.battery - 0.01
+
+            agent = np.clip(states.agent + MOVES[actions], 0, self.size - 1)
+            if other_actions is None:
+                rng = self.rollout_rng(reuse=True) if rng is None else rng
+                other_a = self.draw_other_actions(rng, n)
+            else:
+                other_a = np.asarray(other_actions, dtype=np.int64)
+            other = np.clip(states.other + MOVES[other_a], 0, self.size - 1)
+
+            grid = self._hazard_grid
+            self_hits = grid[agent[:, 0], agent[:, 1]]
+            others = other.reshape(n, -1, 2)
+            other_hits = np.count_nonzero(grid[others[..., 0], others[..., 1]], axis=1)
+            battery = battery - 0.2 * self_hits
+
+            reality_cost = 0.05 + (1.0 - np.maximum(battery, 0.0)) * 0.05
+            ethical_parts = {"self": (self_hits > 0).astype(np.float64), "other": other_hits.astype(np.float64)}
+            done = (t >= self.max_steps) | (battery <= 0.0)
+            return BatchState(agent=agent, other=other, battery=battery, t=t), reality_cost, ethical_parts, done
+    """)
+
+    # --- Async simulator protocol ---
+    w(root, "src/ree_impl/envs/async_env.py", """
+    from __future__ import annotations
+    import asyncio
+    from typing import Any, Callable, Dict, Protocol, Tuple, Union
+
+    import numpy as np
+
+    Latency = Union[float, Callable[..., float]]
+
+    class AsyncEnv(Protocol):
+        \"\"\"What AsyncMPCPlanner / AsyncREEAgent need from a (possibly remote) simulator.
+
+        Simulator calls are coroutines; `action_space` and `encode` are local and
+        synchronous. Optional: `async snapshot()` / `async restore(snap)`, which let the
+        planner reuse a pool of scratch clones instead of cloning per rollout.
+        \"\"\"
+
+        def action_space(self) -> list: ...
+
+        def encode(self, obs: Dict[str, np.ndarray]) -> np.ndarray: ...
+
+        async def reset(self) -> Dict[str, np.ndarray]: ...
+
+        async def observe(self) -> Dict[str, np.ndarray]: ...
+
+        async def step(self, action: int) -> Tuple[Dict[str, np.ndarray], float, Dict[str, float], bool]: ...
+
+        async def clone(self) -> "AsyncEnv": ...
+
+    class LatencyEnv:
+        \"\"\"In-process stand-in for a remote simulator: a sync env behind awaited delays.
+
+        Latencies are seconds, or callables returning seconds (`step_latency` is called
+        with the action, so tests can make particular rollouts stall). Clones share
+        `stats`, which tracks calls and the peak number of simulator calls in flight.
+        \"\"\"
+
+        def __init__(self, env, step_latency: Latency = 0.0, clone_latency: Latency = 0.0, snapshot_latency: Latency = 0.0, stats=None):
+            self.env = env
+            self.step_latency = step_latency
+            self.clone_latency = clone_latency
+            self.snapshot_latency = snapshot_latency
+            self.stats: Dict[str, int] = stats if stats is not None else {"calls": 0, "in_flight": 0, "max_in_flight": 0}
+
+        async def _wait(self, latency: Latency, *args: Any) -> None:
+            delay = latency(*args) if callable(latency) else latency
+            st = self.stats
+            st["calls"] += 1
+            st["in_flight"] += 1
+            st["max_in_flight"] = max(st["max_in_flight"], st["in_flight"])
+            try:
+                if delay:
+                    await asyncio.sleep(delay)
+            finally:
+                st["in_flight"] -= 1
+
+        def action_space(self) -> list:
+            return self.env.action_space()
+
+        def encode(self, obs):
+            return self.env.encode(obs)
+
+        async def reset(self):
+            await self._wait(self.step_latency, None)
+            return self.env.reset()
+
+        async def observe(self):
+            return self.env.observe()
+
+        async def step(self, action: int):
+            await self._wait(self.step_latency, action)
+            return self.env.step(action)
+
+        async def clone(self) -> "LatencyEnv":
+            await self._wait(self.clone_latency)
+            return LatencyEnv(self.env.clone(), self.step_latency, self.clone_latency, self.snapshot_latency, self.stats)
+
+        async def snapshot(self):
+            await self._wait(self.snapshot_latency)
+            return self.env.snapshot()
+
+        async def restore(self, snap) -> None:
+            await self._wait(self.snapshot_latency)
+            self.env.restore(snap)
+    """)
+
+    # --- Experiment runner (process pool) ---
+    w(root, "src/ree_impl/experiments/runner.py", """
+    from __future__ import annotations
+    import itertools
+    import multiprocessing as mp
+    import os
+    import queue
+    import time
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from dataclasses import asdict, dataclass, field, replace
+    from typing import Callable, Iterable, Optional
+
+    import numpy as np
+
+    from ..core.agent import REEAgent
+    from ..envs.toy_gridworld import ToyGridWorld
+    from ..lspace.stack import LSpace
+    from ..planning.mpc import MPCPlanner
+    from ..residue.field import ResidueField
+    from ..sleep.sleep import SleepSubsystem
+    from ..social.coupling import CouplingModel
+
+    @dataclass(frozen=True)
+    class EpisodeConfig:
+        \"\"\"Everything needed to rebuild one toy episode in any process.\"\"\"
+        seed: int = 1
+        env_size: int = 10
+        max_steps: int = 60
+        dims: dict = field(default_factory=lambda: {"gamma": 8, "beta": 16, "theta": 32, "delta": 32})
+        alphas: dict = field(default_factory=lambda: {"gamma": 1.0, "beta": 1.5, "theta": 1.0, "delta": 0.8})
+        lspace_seed: int = 0
+        horizon: int = 1
+        lambda_ethics: float = 1.5
+        rho_residue: float = 2.0
+        kappa_other: float = 0.8
+        sleep_every: Optional[int] = 20  # None disables sleep
+        merge_radius: float = 0.8
+        sleep_mode: str = "sync"
+        max_dents: Optional[int] = None  # None: unbounded residue
+        compaction: str = "merge_nearest"
+        plan_deadline: Optional[float] = None  # anytime planning budget (seconds per decision)
+        plan_rollouts: Optional[int] = None  # anytime planning budget (rollouts per decision)
+        residue_precision: str = "float32"  # dent center storage: float32 / float16 / int8
+        weight_dtype: str = "float64"  # LSpace.W storage: float64 / float32 / float16
+
+    @dataclass
+    class EpisodeResult:
+        config: EpisodeConfig
+        steps: int
+        total_reality_cost: float
+        total_ethical_cost: float
+        dents: int
+        wall_time: float
+
+    def episode_seeds(root_seed: int, n: int) -> list[int]:
+        \"\"\"n independent, reproducible episode seeds derived from one root seed.\"\"\"
+        return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(root_seed).spawn(n)]
+
+    def sweep(base: EpisodeConfig, grid: dict, seeds: Iterable[int]) -> list[EpisodeConfig]:
+        \"\"\"Cartesian product of `grid` (field name -> values) x seeds, applied to `base`.\"\"\"
+        names = list(grid)
+        seeds = list(seeds)
+        return [
+            replace(base, seed=seed, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[k] for k in names))
+            for seed in seeds
+        ]
+
+    def build(cfg: EpisodeConfig) -> tuple[REEAgent, ToyGridWorld]:
+        env = ToyGridWorld(size=cfg.env_size, max_steps=cfg.max_steps, seed=cfg.seed)
+        obs = env.reset()
+        lspace = LSpace(
+            sensor_dim=env.encode(obs).shape[0],
+            dims=dict(cfg.dims),
+            alphas=dict(cfg.alphas),
+            seed=cfg.lspace_seed,
+            weight_dtype=cfg.weight_dtype,
+        )
+        residue = ResidueField()
+        residue.set_capacity(cfg.max_dents, policy=cfg.compaction)
+        residue.set_precision(cfg.residue_precision)
+        agent = REEAgent(
+            lspace=lspace,
+            planner=MPCPlanner(
+                horizon=cfg.horizon,
+                lambda_ethics=cfg.lambda_ethics,
+                rho_residue=cfg.rho_residue,
+                deadline=cfg.plan_deadline,
+                max_rollouts=cfg.plan_rollouts,
+            ),
+            residue=residue,
+            coupling=CouplingModel(kappa_other=cfg.kappa_other),
+            sleep=(
+                SleepSubsystem(every_n_steps=cfg.sleep_every, merge_radius=cfg.merge_radius, mode=cfg.sleep_mode)
+                if cfg.sleep_every else None
+            ),
+        )
+        agent.reset()
+        return agent, env
+
+    def run_episode(cfg: EpisodeConfig, on_step: Optional[Callable[[dict], None]] = None) -> EpisodeResult:
+        \"\"\"Run one episode to completion; `on_step` receives a metrics dict per step.\"\"\"
+        agent, env = build(cfg)
+        t0 = time.perf_counter()
+        t = 0
+        total_real = 0.0
+        total_eth = 0.0
+        while True:
+            _obs, rc, ec, done, info = agent.step(env)
+            t += 1
+            total_real += rc
+            total_eth += ec
+            if on_step is not None:
+                on_step({"t": t, **asdict(info), "env_reality_cost": rc, "env_ethical_cost": ec, "dents": agent.residue.count()})
+            if done:
+                break
+        if agent.sleep is not None:
+            agent.sleep.close()
+        return EpisodeResult(cfg, t, total_real, total_eth, agent.residue.count(), time.perf_counter() - t0)
+
+    # --- worker side ---
+    _QUEUE = None
+
+    def _init_worker(q) -> None:
+        global _QUEUE
+        _QUEUE = q
+
+    def _run_streamed(index: int, cfg: EpisodeConfig, stream_every: int) -> EpisodeResult:
+        buf: list[dict] = []
+
+        def on_step(rec: dict) -> None:
+            if _QUEUE is None:
+                return
+            rec["episode"] = index
+            buf.append(rec)
+            if len(buf) >= stream_every:
+                _QUEUE.put(("steps", index, list(buf)))
+                buf.clear()
+
+        result = run_episode(cfg, on_step)
+        if _QUEUE is not None:
+            if buf:
+                _QUEUE.put(("steps", index, buf))
+            _QUEUE.put(("done", index, None))
+        return result
+
+    def run_pool(
+        configs: list[EpisodeConfig],
+        workers: Optional[int] = None,
+        on_step: Optional[Callable[[dict], None]] = None,
+        on_result: Optional[Callable[[int, EpisodeResult], None]] = None,
+        stream_every: int = 50,
+    ) -> list[EpisodeResult]:
+        \"\"\"Run episodes across a process pool; results come back in `configs` order.
+
+        Each episode is fully determined by its config (seeds included), so results do not
+        depend on worker count or scheduling. With `on_step`, per-step metrics are streamed
+        back from workers in batches of `stream_every` records (each tagged with `episode`).
+        \"\"\"
+        workers = workers or os.cpu_count() or 1
+        ctx = mp.get_context()
+        q = ctx.Queue() if on_step is not None else None
+        results: list[Optional[EpisodeResult]] = [None] * len(configs)
+        finished_streams = 0
+
+        def drain(timeout: float) -> None:
+            nonlocal finished_streams
+            while True:
+                try:
+                    kind, _index, payload = q.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if kind == "steps":
+                    for rec in payload:
+                        on_step(rec)
+                else:
+                    finished_streams += 1
+                timeout = 0.0
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(q,)) as pool:
+            pending = {pool.submit(_run_streamed, i, cfg, stream_every): i for i, cfg in enumerate(configs)}
+            while pending:
+                done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = pending.pop(fut)
+                    results[i] = fut.result()
+                    if on_result is not None:
+                        on_result(i, results[i])
+                if q is not None:
+                    drain(0.0)
+            while q is not None and finished_streams < len(configs):
+                drain(0.1)
+        return results
+
+    def aggregate(results: list[EpisodeResult], by: tuple[str, ...] = ()) -> dict:
+        \"\"\"Group results by config fields `by` and report episode counts and cost/dent statistics.\"\"\"
+        groups: dict = {}
+        for r in results:
+            key = tuple(getattr(r.config, k) for k in by)
+            groups.setdefault(key, []).append(r)
+        out = {}
+        for key, rs in groups.items():
+            real = np.array([r.total_reality_cost for r in rs])
+            eth = np.array([r.total_ethical_cost for r in rs])
+            dents = np.array([r.dents for r in rs])
+            out[key] = {
+                "episodes": len(rs),
+                "steps": int(sum(r.steps for r in rs)),
+                "reality_cost_mean": float(real.mean()),
+                "reality_cost_std": float(real.std()),
+                "ethical_cost_mean": float(eth.mean()),
+                "ethical_cost_std": float(eth.std()),
+                "dents_mean": float(dents.mean()),
+            }
+        return out
+    """)
+
+    w(root, "src/ree_impl/experiments/telemetry.py", """
+    from __future__ import annotations
+    import json
+    import os
+    import struct
+    from typing import Any, Dict, Iterator, Optional, Sequence
+
+    import numpy as np
+
+    MAGIC = b"REETLM1\\n"
+    _COUNT = struct.Struct("<I")
+
+    # one row per agent step
+    STEP_SCHEMA = (
+        ("episode", "i8"),
+        ("t", "i8"),
+        ("action", "i8"),
+        ("score", "f8"),
+        ("reality_cost", "f8"),
+        ("ethical_cost", "f8"),
+        ("residue_cost", "f8"),
+        ("complete", "i8"),
+        ("overrun", "f8"),
+        ("env_reality_cost", "f8"),
+        ("env_ethical_cost", "f8"),
+        ("dents", "i8"),
+        ("battery", "f8"),
+        ("alpha_gamma", "f8"),
+        ("alpha_beta", "f8"),
+        ("alpha_theta", "f8"),
+        ("alpha_delta", "f8"),
+    )
+
+    def step_record(agent, info, obs, env_reality_cost: float, env_ethical_cost: float, episode: int = 0) -> dict:
+        \"\"\"The STEP_SCHEMA row for one REEAgent.step result.\"\"\"
+        alphas = agent.lspace.alphas
+        return {
+            "episode": episode,
+            "t": agent.t,
+            "action": info.action,
+            "score": info.score,
+            "reality_cost": info.reality_cost,
+            "ethical_cost": info.ethical_cost,
+            "residue_cost": info.residue_cost,
+            "complete": int(info.complete),
+            "overrun": info.overrun,
+            "env_reality_cost": env_reality_cost,
+            "env_ethical_cost": env_ethical_cost,
+            "dents": agent.residue.count(),
+            "battery": float(obs["body"][0]),
+            "alpha_gamma": alphas.get("gamma", 1.0),
+            "alpha_beta": alphas.get("beta", 1.0),
+            "alpha_theta": alphas.get("theta", 1.0),
+            "alpha_delta": alphas.get("delta", 1.0),
+        }
+
+    class TelemetryWriter:
+        \"\"\"Append-only columnar log: rows are buffered per column and flushed in chunks.
+
+        File layout: MAGIC, a length-prefixed JSON header with the schema, then chunks of
+        [uint32 rows][column 0 bytes]...[column k bytes]. Memory is bounded by
+        `chunk_rows`; a crash loses at most the unflushed buffer, and a truncated last
+        chunk is ignored by the reader. Opening an existing file with the same schema
+        appends to it.
+        \"\"\"
+
+        def __init__(self, path: str | os.PathLike, schema: Sequence[tuple[str, str]] = STEP_SCHEMA, chunk_rows: int = 4096):
+            self.path = os.fspath(path)
+            self.schema = [(name, np.dtype(dt)) for name, dt in schema]
+            self.chunk_rows = int(chunk_rows)
+            self._cols = {name: np.zeros(self.chunk_rows, dtype=dt) for name, dt in self.schema}
+            self._n = 0
+            self.rows_written = 0
+            header = json.dumps({"schema": [[n, dt.str] for n, dt in self.schema]}).encode("utf-8")
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                existing = TelemetryReader(self.path)
+                if existing.schema != [(n, dt.str) for n, dt in self.schema]:
+                    raise ValueError(f"{self.path} has a different schema")
+                self._f = open(self.path, "r+b")
+                # drop a torn trailing chunk before appending
+                self._f.truncate(existing.valid_end())
+                self._f.seek(0, os.SEEK_END)
+            else:
+                self._f = open(self.path, "wb")
+                self._f.write(MAGIC + _COUNT.pack(len(header)) + header)
+
+        def append(self, record: Dict[str, Any]) -> None:
+            i = self._n
+            for name, col in self._cols.items():
+                col[i] = record.get(name, 0)
+            self._n = i + 1
+            if self._n == self.chunk_rows:
+                self.flush()
+
+        def flush(self) -> None:
+            if self._n == 0:
+                return
+            parts = [_COUNT.pack(self._n)] + [self._cols[name][: self._n].tobytes() for name, _ in self.schema]
+            self._f.write(b"".join(parts))
+            self._f.flush()
+            self.rows_written += self._n
+            self._n = 0
+
+        def close(self) -> None:
+            if not self._f.closed:
+                self.flush()
+                self._f.close()
+
+        def __enter__(self) -> "TelemetryWriter":
+            return self
+
+        def __exit__(self, *exc) -> None:
+            self.close()
+
+    class TelemetryReader:
+        \"\"\"Lazy reader for TelemetryWriter files: one chunk in memory at a time.\"\"\"
+
+        def __init__(self, path: str | os.PathLike):
+            self.path = os.fspath(path)
+            with open(self.path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{self.path} is not a telemetry log")
+                (size,) = _COUNT.unpack(f.read(_COUNT.size))
+                header = json.loads(f.read(size).decode("utf-8"))
+                self._data_start = f.tell()
+            self.schema = [(name, dt) for name, dt in header["schema"]]
+            self._dtypes = [(name, np.dtype(dt)) for name, dt in self.schema]
+            self._row_bytes = sum(dt.itemsize for _, dt in self._dtypes)
+
+        @property
+        def columns(self) -> list[str]:
+            return [name for name, _ in self.schema]
+
+        def _scan(self, f) -> Iterator[tuple[int, int]]:
+            \"\"\"(offset, rows) of every complete chunk.\"\"\"
+            end = os.fstat(f.fileno()).st_size
+            pos = self._data_start
+            while pos + _COUNT.size <= end:
+                f.seek(pos)
+                (rows,) = _COUNT.unpack(f.read(_COUNT.size))
+                nxt = pos + _COUNT.size + rows * self._row_bytes
+                if nxt > end:
+                    return
+                yield pos + _COUNT.size, rows
+                pos = nxt
+
+        def valid_end(self) -> int:
+            with open(self.path, "rb") as f:
+                end = self._data_start
+                for off, rows in self._scan(f):
+                    end = off + rows * self._row_bytes
+                return end
+
+        def chunks(self, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+            \"\"\"Yield {column: array} per chunk, reading only the requested columns.\"\"\"
+            wanted = set(self.columns if columns is None else columns)
+            with open(self.path, "rb") as f:
+                for off, rows in self._scan(f):
+                    out = {}
+                    pos = off
+                    for name, dt in self._dtypes:
+                        if name in wanted:
+                            f.seek(pos)
+                            out[name] = np.frombuffer(f.read(rows * dt.itemsize), dtype=dt)
+                        pos += rows * dt.itemsize
+                    yield out
+
+        def rows(self) -> Iterator[dict]:
+            for chunk in self.chunks():
+                names = list(chunk)
+                for i in range(len(chunk[names[0]])):
+                    yield {name: chunk[name][i].item() for name in names}
+
+        def __len__(self) -> int:
+            with open(self.path, "rb") as f:
+                return sum(rows for _, rows in self._scan(f))
+
+        def column(self, name: str) -> np.ndarray:
+            \"\"\"Materialise one column (the only method that loads a whole column).\"\"\"
+            parts = [c[name] for c in self.chunks([name])]
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dict(self._dtypes)[name])
+
+        def aggregate(self, columns: Sequence[str], by: Optional[str] = None) -> dict:
+            \"\"\"Streaming count / sum / mean / min / max per column, optionally grouped by an
+            integer column (e.g. "episode"). Memory is one chunk plus one entry per group.\"\"\"
+            acc: dict = {}
+            wanted = list(columns) + ([by] if by is not None else [])
+            for chunk in self.chunks(wanted):
+                keys = chunk[by] if by is not None else np.zeros(len(chunk[wanted[0]]), dtype=np.int64)
+                groups, inverse = np.unique(keys, return_inverse=True)
+                for gi, g in enumerate(groups.tolist()):
+                    sel = inverse == gi
+                    entry = acc.setdefault(g, {c: {"count": 0, "sum": 0.0, "min": np.inf, "max": -np.inf} for c in columns})
+                    for c in columns:
+                        v = chunk[c][sel].astype(np.float64)
+                        e = entry[c]
+                        e["count"] += int(v.shape[0])
+                        e["sum"] += float(v.sum())
+                        e["min"] = min(e["min"], float(v.min()))
+                        e["max"] = max(e["max"], float(v.max()))
+            for entry in acc.values():
+                for e in entry.values():
+                    e["mean"] = e["sum"] / e["count"] if e["count"] else float("nan")
+            return acc if by is not None else acc.get(0, {})
+    """)
+
+    w(root, "examples/run_sweep.py", """
+    import argparse
+    import time
+
+    from ree_impl.experiments.runner import EpisodeConfig, aggregate, episode_seeds, run_pool, sweep
+
+    def main():
+        ap = argparse.ArgumentParser(description="Ablation sweep over toy episodes on a process pool.")
+        ap.add_argument("--episodes", type=int, default=8, help="episodes (seeds) per grid point")
+        ap.add_argument("--workers", type=int, default=None)
+        ap.add_argument("--root-seed", type=int, default=0)
+        args = ap.parse_args()
+
+        grid = {"lambda_ethics": [0.0, 1.5], "kappa_other": [0.0, 0.8], "sleep_every": [None, 20]}
+        configs = sweep(EpisodeConfig(), grid, episode_seeds(args.root_seed, args.episodes))
+
+        t0 = time.perf_counter()
+        results = run_pool(configs, workers=args.workers)
+        dt = time.perf_counter() - t0
+
+        for key, stats in aggregate(results, by=tuple(grid)).items():
+            label = " ".join(f"{k}={v}" for k, v in zip(grid, key))
+            print(f"{label:<50} reality={stats['reality_cost_mean']:.3f} ethical={stats['ethical_cost_mean']:.3f} dents={stats['dents_mean']:.1f}")
+        print(f"{len(configs)} episodes in {dt:.2f}s")
+
+    if __name__ == "__main__":
+        main()
+    """)
+
+    # --- Example runner ---
+    w(root, "examples/run_toy.py", """
+    import numpy as np
+
+    import argparse
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.core.instrument import Instrumentation
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.experiments.telemetry import TelemetryReader, TelemetryWriter, step_record
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+    from ree_impl.social.coupling import CouplingModel
+
+    def main(telemetry: str | None = None):
+        env = ToyGridWorld(size=10, max_steps=60, seed=1)
+        obs = env.reset()
+
+        sensor_dim = env.encode(obs).shape[0]
+        dims = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
+        lspace = LSpace(sensor_dim=sensor_dim, dims=dims, alphas={"gamma":1.0,"beta":1.5,"theta":1.0,"delta":0.8}, seed=0)
+
+        planner = MPCPlanner(horizon=1, lambda_ethics=1.5, rho_residue=2.0)
+        residue = ResidueField()
+        coupling = CouplingModel(kappa_other=0.8)
+        sleep = SleepSubsystem(every_n_steps=20, merge_radius=0.8)
+
+        # REE_PROFILE=profile.json (or .trace.json) writes per-phase timings at exit
+        agent = REEAgent(lspace=lspace, planner=planner, residue=residue, coupling=coupling, sleep=sleep,
+                         instrument=Instrumentation.from_env())
+        agent.reset()
+
+        t = 0
+        total_eth = 0.0
+        total_real = 0.0
+        sink = TelemetryWriter(telemetry) if telemetry else None
+
+        while True:
+            obs, rc, ec, done, info = agent.step(env)
+            if sink is not None:
+                sink.append(step_record(agent, info, obs, rc, ec))
+            t += 1
+            total_real += rc
+            total_eth += ec
+            if t % 10 == 0:
+                print(f\"t={t:03d} action={info.action} score={info.score:.3f} dents={residue.count()} batt={obs['body'][0]:.2f}\")
+            if done:
+                break
+
+        print(\"Episode done.\")
+        print(f\"steps={t} total_reality_cost={total_real:.3f} total_ethical_cost={total_eth:.3f} dents={residue.count()}\") 
+
+        if sink is not None:
+            sink.close()
+            stats = TelemetryReader(telemetry).aggregate([\"env_reality_cost\", \"env_ethical_cost\", \"battery\"])
+            print(f\"telemetry: {telemetry} rows={stats['battery']['count']} min_battery={stats['battery']['min']:.2f}\")
+
+    if __name__ == \"__main__\":
+        parser = argparse.ArgumentParser()
+        parser.add_argument(\"--telemetry\", help=\"stream per-step records to this columnar log\")
+        main(parser.parse_args().telemetry)
+    """)
+
+    # --- Tests (ablations) ---
+    w(root, "tests/test_residue_changes_choice.py", """
+    import numpy as np
+
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.social.coupling import CouplingModel
+
+    def test_residue_influences_score_nonzero():
+        env = ToyGridWorld(seed=2)
+        obs = env.reset()
+        sensor_dim = env.encode(obs).shape[0]
+        lspace = LSpace(sensor_dim, {"gamma":8,"beta":16,"theta":32,"delta":32}, seed=0)
+        state = lspace.initial_state()
+        state = lspace.update(env.encode(obs), state)
+
+        residue = ResidueField()
+        coupling = CouplingModel(kappa_other=0.8)
+        planner = MPCPlanner()
+
+        a0, parts0 = planner.choose_action(env, state, residue, coupling)
+        # Add a dent at current beta: should increase residue term
+        residue.add_dent(center=state.beta.copy(), magnitude=1.0, sigma=1.0)
+        a1, parts1 = planner.choose_action(env, state, residue, coupling)
+
+        assert parts1[\"residue\"] >= parts0[\"residue\"]
+        assert parts1[\"total\"] >= parts0[\"total\"]
+    """)
+
+    w(root, "tests/test_residue_field.py", """
+    import numpy as np
+    import pytest
+
+    from ree_impl.residue.field import Dent, ResidueField
+
+    def _reference_potential(dents, z):
+        acc = 0.0
+        for d in dents:
+            dist2 = float(np.sum((z - d.center) ** 2))
+            acc += d.magnitude * float(np.exp(-dist2 / (2.0 * (d.sigma ** 2))))
+        return acc
+
+    def test_batch_potential_matches_per_dent_sum():
+        rng = np.random.default_rng(0)
+        residue = ResidueField(capacity=2)
+        for _ in range(50):
+            residue.add_dent(rng.standard_normal(16).astype(np.float32), float(rng.uniform(0.1, 2.0)), float(rng.uniform(0.5, 2.0)))
+        assert residue.count() == 50
+
+        Z = rng.standard_normal((7, 16)).astype(np.float32)
+        batch = residue.potential_batch(Z)
+        for i in range(Z.shape[0]):
+            ref = _reference_potential(residue.dents, Z[i])
+            assert np.isclose(batch[i], ref, rtol=1e-5, atol=1e-8)
+            assert np.isclose(residue.potential(Z[i]), ref, rtol=1e-5, atol=1e-8)
+
+    def test_dents_roundtrip_and_empty_field():
+        residue = ResidueField()
+        assert residue.potential(np.zeros(4, dtype=np.float32)) == 0.0
+        dents = [Dent(center=np.ones(4, dtype=np.float32), magnitude=1.5, sigma=0.5)]
+        residue.dents = dents
+        assert residue.count() == 1
+        assert residue.dents[0].magnitude == 1.5
+        assert np.allclose(residue.dents[0].center, 1.0)
+
+    def test_indexed_potential_within_reported_bound():
+        rng = np.random.default_rng(1)
+        exact = ResidueField()
+        indexed = ResidueField()
+        indexed.enable_index(cutoff_sigmas=3.0, leaf_size=16, min_dents=32)
+        # clustered dents, as produced by a slowly moving latent trajectory
+        for k in range(20):
+            base = rng.standard_normal(8) * 10.0
+            for _ in range(25):
+                c = (base + 0.3 * rng.standard_normal(8)).astype(np.float32)
+                exact.add_dent(c, 1.0, 0.5)
+                indexed.add_dent(c, 1.0, 0.5)
+
+        for z in rng.standard_normal((10, 8)) * 10.0:
+            ref = exact.potential(z)
+            approx, bound = indexed.potential_with_bound(z)
+            assert abs(ref - approx) <= bound + 1e-9
+            assert np.isclose(indexed.potential(z), approx)
+
+        _, _, scanned = indexed._ensure_index().query(exact.centers[0].astype(np.float64), 3.0)
+        assert scanned < exact.count()
+
+    @pytest.mark.parametrize("policy", ["merge_nearest", "grid"])
+    def test_capacity_limit_preserves_mass(policy):
+        rng = np.random.default_rng(2)
+        capped = ResidueField()
+        capped.set_capacity(64, policy=policy, compact_to=0.5)
+        total = 0.0
+        for _ in range(500):
+            m = float(rng.uniform(0.1, 1.0))
+            capped.add_dent(rng.standard_normal(3).astype(np.float32), m, 1.0)
+            total += m
+            assert capped.count() <= 64
+
+        stats = capped.compaction_stats
+        assert np.isclose(capped.magnitudes.sum(), total)
+        assert stats["runs"] > 0
+        assert stats["dents_removed"] == 500 - capped.count()
+        assert 0.0 < stats["mass_moved"] and stats["max_shift"] > 0.0
+
+    def test_merge_nearest_merges_closest_pair_first():
+        field = ResidueField()
+        for x in (0.0, 0.1, 5.0, 10.0):
+            field.add_dent(np.array([x, 0.0], dtype=np.float32), 1.0, 1.0)
+        field.set_capacity(3)
+        assert field.count() == 2  # compacted to int(3 * 0.75)
+        field.set_capacity(None)
+        field.add_dent(np.array([20.0, 0.0], dtype=np.float32), 1.0, 1.0)
+        assert field.count() == 3
+        assert np.isclose(field.magnitudes.sum(), 5.0)
+        assert np.allclose(field.centers[0], [0.05, 0.0])
+
+    def test_gradient_matches_finite_differences():
+        rng = np.random.default_rng(4)
+        field = ResidueField()
+        for _ in range(30):
+            field.add_dent(rng.standard_normal(3).astype(np.float32), float(rng.uniform(0.1, 1.0)), float(rng.uniform(0.5, 1.5)))
+        z = rng.standard_normal(3)
+        value, grad = field.potential_and_gradient(z)
+        assert np.isclose(value, field.potential(z))
+        eps = 1e-6
+        fd = [(field.potential(z + eps * e) - field.potential(z - eps * e)) / (2 * eps) for e in np.eye(3)]
+        assert np.allclose(grad, fd, atol=1e-6)
+
+    def test_cache_hits_and_invalidates_on_mutation():
+        field = ResidueField()
+        field.add_dent(np.zeros(2, dtype=np.float32), 1.0, 1.0)
+        field.enable_cache(maxsize=8)
+        z = np.array([0.5, 0.0])
+        first = field.potential(z)
+        assert field.potential(z) == first and field.cache_hits == 1
+        assert np.allclose(field.potential_batch(np.stack([z, z + 1.0])), [first, field.potential(z + 1.0)])
+        assert field.cache_hits == 3
+
+        field.add_dent(np.array([0.5, 0.0], dtype=np.float32), 1.0, 1.0)
+        assert np.isclose(field.potential(z), first + 1.0)
+
+        approx = ResidueField(field.dents)
+        approx.enable_cache(quantum=0.1)
+        base = approx.potential(z)
+        assert approx.potential(z + 0.01) == base  # same cell: served from the quantized cache
+        assert approx.cache_hits == 1
+    """)
+
+    w(root, "tests/test_sleep_merge.py", """
+    import numpy as np
+    import pytest
+
+    from ree_impl.residue.field import Dent, ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+
+    def _legacy_merge(dents, radius):
+        kept = []
+        used = [False] * len(dents)
+        for i, di in enumerate(dents):
+            if used[i]:
+                continue
+            group = [di]
+            used[i] = True
+            for j, dj in enumerate(dents):
+                if used[j]:
+                    continue
+                if float(np.linalg.norm(di.center - dj.center)) <= radius:
+                    group.append(dj)
+                    used[j] = True
+            mags = np.array([g.magnitude for g in group], dtype=np.float64)
+            centers = np.stack([g.center for g in group], axis=0)
+            c = (centers * mags[:, None]).sum(axis=0) / max(float(mags.sum()), 1e-6)
+            kept.append(Dent(center=c, magnitude=float(mags.sum()), sigma=float(np.mean([g.sigma for g in group]))))
+        return kept
+
+    def _random_residue(n, seed):
+        rng = np.random.default_rng(seed)
+        residue = ResidueField()
+        for _ in range(n):
+            residue.add_dent(rng.uniform(-3, 3, size=4).astype(np.float32), float(rng.uniform(0.1, 1.0)), float(rng.uniform(0.5, 1.5)))
+        return residue
+
+    class _Alphas:
+        def __init__(self, alphas):
+            self.alphas = alphas
+
+    @pytest.mark.parametrize("dense_merge_max", [10_000, 0])
+    def test_greedy_merge_reproduces_legacy(dense_merge_max):
+        residue = _random_residue(300, seed=3)
+        expected = _legacy_merge(residue.dents, radius=0.8)
+
+        SleepSubsystem(merge_radius=0.8, dense_merge_max=dense_merge_max)._merge_dents(residue)
+
+        assert residue.count() == len(expected)
+        for got, ref in zip(residue.dents, expected):
+            assert np.allclose(got.center, ref.center, atol=1e-5)
+            assert np.isclose(got.magnitude, ref.magnitude)
+            assert np.isclose(got.sigma, ref.sigma)
+
+    def test_component_merge_chains_and_preserves_mass():
+        residue = ResidueField()
+        for x in (0.0, 0.7, 1.4, 10.0):
+            residue.add_dent(np.array([x, 0.0], dtype=np.float32), 1.0, 1.0)
+
+        greedy = ResidueField(residue.dents)
+        SleepSubsystem(merge_radius=0.8)._merge_dents(greedy)
+        assert greedy.count() == 3
+
+        SleepSubsystem(merge_radius=0.8, merge_strategy="components")._merge_dents(residue)
+        assert residue.count() == 2
+        assert np.isclose(residue.magnitudes.sum(), 4.0)
+        assert np.allclose(residue.centers[0], [0.7, 0.0])
+
+    @pytest.mark.parametrize("mode", ["incremental", "background"])
+    def test_deferred_sleep_matches_sync_and_keeps_new_dents(mode):
+        sync_residue = _random_residue(300, seed=5)
+        sync_alphas = {"beta": 1.0}
+        SleepSubsystem(every_n_steps=1, merge_radius=0.8).tick(1, sync_residue, _Alphas(sync_alphas))
+
+        residue = _random_residue(300, seed=5)
+        alphas = {"beta": 1.0}
+        sleep = SleepSubsystem(every_n_steps=1000, merge_radius=0.8, mode=mode, work_per_step=16)
+        sleep.tick(1000, residue, _Alphas(alphas))
+        assert residue.count() == 300 and sleep.pending == 1
+
+        late = np.full(4, 9.0, dtype=np.float32)
+        residue.add_dent(late, 0.5, 1.0)
+        t = 1000
+        while sleep.pending:
+            t += 1
+            if mode == "background":
+                sleep._jobs[residue].work.result()
+            applied = sleep.tick(t, residue, _Alphas(alphas))
+            if mode == "incremental":
+                # bounded work per tick: 300 seeds at 16 per tick need many ticks
+                assert applied == (not sleep.pending)
+        sleep.close()
+
+        assert residue.count() == sync_residue.count() + 1
+        assert np.array_equal(residue.centers[:-1], sync_residue.centers)
+        assert np.allclose(residue.magnitudes[:-1], sync_residue.magnitudes)
+        assert np.array_equal(residue.centers[-1], late)
+        assert alphas == sync_alphas
+
+    def test_jobs_of_dropped_or_cancelled_fields_are_released():
+        sleep = SleepSubsystem(every_n_steps=1, merge_radius=0.8, mode="incremental", work_per_step=1)
+        residue = _random_residue(50, seed=1)
+        sleep.tick(1, residue, _Alphas({"beta": 1.0}))
+        assert sleep.pending == 1
+        del residue
+        assert sleep.pending == 0
+
+        residue = _random_residue(50, seed=1)
+        sleep.tick(1, residue, _Alphas({"beta": 1.0}))
+        sleep.cancel(residue)
+        assert sleep.pending == 0 and residue.count() == 50
+    """)
+
+    w(root, "tests/test_planner_horizon.py", """
+    import itertools
+    import time
+
+    import numpy as np
+    import pytest
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.social.coupling import CouplingModel
+
+    class LineWorld:
+        \"\"\"Deterministic 1-d world: hazards at fixed cells, cost grows away from the goal.\"\"\"
+
+        def __init__(self, pos=3, size=9):
+            self.pos = pos
+            self.size = size
+            self.hazards = {1, 5}
+
+        def clone(self):
+            return LineWorld(self.pos, self.size)
+
+        def action_space(self):
+            return [0, 1, 2]  # left, stay, right
+
+        def encode(self, obs):
+            return np.array([obs["pos"] / self.size], dtype=np.float32)
+
+        def step(self, action):
+            self.pos = int(np.clip(self.pos + action - 1, 0, self.size - 1))
+            reality = 0.05 + 0.02 * abs(self.size - 1 - self.pos)
+            ethical = {"self": float(self.pos in self.hazards), "other": float(self.pos == 7)}
+            return {"pos": self.pos}, reality, ethical, False
+
+    def _exhaustive(planner, env, coupling, residue_cost):
+        best = None
+        for plan in itertools.product(env.action_space(), repeat=planner.horizon):
+            sim = env.clone()
+            total = 0.0
+            for a in plan:
+                _, rc, parts, _ = sim.step(a)
+                eth = parts["self"] + coupling.kappa_other * parts["other"]
+                total += rc + planner.lambda_ethics * eth + planner.rho_residue * residue_cost
+            if best is None or total < best[0]:
+                best = (total, plan)
+        return best
+
+    @pytest.mark.parametrize("horizon", [1, 2, 4])
+    def test_branch_and_bound_matches_exhaustive_search(horizon):
+        env = LineWorld()
+        lspace = LSpace(1, {"gamma": 4, "beta": 4, "theta": 4, "delta": 4}, seed=0)
+        state = lspace.update(env.encode({"pos": env.pos}), lspace.initial_state())
+        residue = ResidueField()
+        residue.add_dent(state.beta.copy(), magnitude=0.5)
+        coupling = CouplingModel(kappa_other=0.8)
+        planner = MPCPlanner(horizon=horizon)
+
+        action, parts = planner.choose_action(env, state, residue, coupling)
+        total, plan = _exhaustive(planner, env, coupling, residue.potential(state.beta))
+
+        assert np.isclose(parts["total"], total)
+        assert tuple(parts["plan"]) == plan
+        assert action == plan[0]
+
+    def test_wide_beam_equals_exact_and_latent_rollouts_run():
+        env = LineWorld()
+        lspace = LSpace(1, {"gamma": 4, "beta": 4, "theta": 4, "delta": 4}, seed=0)
+        state = lspace.update(env.encode({"pos": env.pos}), lspace.initial_state())
+        residue = ResidueField()
+        residue.add_dent(state.beta.copy(), magnitude=1.0)
+        coupling = CouplingModel()
+
+        exact = MPCPlanner(horizon=3).choose_action(env, state, residue, coupling, lspace=lspace)
+        beam = MPCPlanner(horizon=3, beam_width=27).choose_action(env, state, residue, coupling, lspace=lspace)
+        narrow = MPCPlanner(horizon=3, beam_width=1).choose_action(env, state, residue, coupling, lspace=lspace)
+
+        assert exact[1]["plan"] == beam[1]["plan"]
+        assert np.isclose(exact[1]["total"], beam[1]["total"])
+        assert narrow[1]["total"] >= exact[1]["total"] - 1e-12
+
+    class SlowLineWorld(LineWorld):
+        def clone(self):
+            return SlowLineWorld(self.pos, self.size)
+
+        def observe(self):
+            return {"pos": self.pos}
+
+        def step(self, action):
+            time.sleep(0.005)
+            return super().step(action)
+
+    def _line_setup():
+        env = LineWorld()
+        lspace = LSpace(1, {"gamma": 4, "beta": 4, "theta": 4, "delta": 4}, seed=0)
+        state = lspace.update(env.encode({"pos": env.pos}), lspace.initial_state())
+        residue = ResidueField()
+        residue.add_dent(state.beta.copy(), magnitude=0.5)
+        return env, state, residue, CouplingModel(kappa_other=0.8)
+
+    def test_anytime_with_ample_budget_is_exact():
+        env, state, residue, coupling = _line_setup()
+        exact = MPCPlanner(horizon=3).choose_action(env, state, residue, coupling)
+        planner = MPCPlanner(horizon=3, max_rollouts=10_000, deadline=60.0)
+        action, parts = planner.choose_action(env, state, residue, coupling)
+        assert parts["complete"] and parts["overrun"] == 0.0
+        assert action == exact[0] and np.isclose(parts["total"], exact[1]["total"])
+        assert planner.rollouts < 3 + 9 + 27  # best-first ordering still prunes
+
+    def test_rollout_budget_cuts_search_and_warm_starts():
+        env, state, residue, coupling = _line_setup()
+        planner = MPCPlanner(horizon=1, max_rollouts=2)
+        action, parts = planner.choose_action(env, state, residue, coupling)
+        assert not parts["complete"]
+        assert planner.rollouts == 2 and action in (0, 1)
+
+        # a one-rollout budget still answers, with the warm-start (previous) action
+        planner.max_rollouts = 1
+        again, parts = planner.choose_action(env, state, residue, coupling)
+        assert again == action and planner.rollouts == 3 and not parts["complete"]
+
+    def test_deadline_overrun_is_recorded_in_step_info():
+        env, _, residue, coupling = _line_setup()
+        env = SlowLineWorld(env.pos, env.size)
+        lspace = LSpace(1, {"gamma": 4, "beta": 4, "theta": 4, "delta": 4}, seed=0)
+        planner = MPCPlanner(horizon=2, deadline=0.001)
+        agent = REEAgent(lspace=lspace, planner=planner, residue=residue, coupling=coupling)
+        agent.reset()
+        *_, info = agent.step(env)
+        assert not info.complete
+        assert info.overrun > 0.0 and planner.overruns == 1
+        assert planner.rollouts < 3  # stopped soon after the deadline, not after all 12
+    """)
+
+    w(root, "tests/test_batched_rollouts.py", """
+    import numpy as np
+    import pytest
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.social.coupling import CouplingModel
+
+    def test_step_batch_matches_sequential_step():
+        env = ToyGridWorld(seed=0)
+        env.reset()
+        env.state.agent = np.array([2, 1])  # next to the hazards
+        actions = np.array(env.action_space())
+
+        states, rc, parts, done = env.step_batch(env.batch_state(len(actions)), actions, rng=np.random.default_rng(7))
+        xs = env.encode_batch(states)
+
+        for i, a in enumerate(actions):
+            sim = env.clone()
+            # the i-th batched "other" move is the i-th draw of the same stream
+            sim.rng = np.random.default_rng(7)
+            sim.rng.integers(0, 5, size=i)
+            obs, rc_i, parts_i, done_i = sim.step(int(a))
+            assert np.array_equal(states.agent[i], sim.state.agent)
+            assert np.array_equal(states.other[i], sim.state.other)
+            assert np.isclose(rc[i], rc_i)
+            assert parts["self"][i] == parts_i["self"] and parts["other"][i] == parts_i["other"]
+            assert bool(done[i]) == done_i
+            assert np.allclose(xs[i], sim.encode(obs))
+
+    @pytest.mark.parametrize("seed", [0, 1, 2, 3])
+    @pytest.mark.parametrize("horizon,beam_width", [(1, None), (2, None), (3, None), (3, 2)])
+    def test_batched_planner_matches_clone_planner(horizon, beam_width, seed):
+        env = ToyGridWorld(seed=seed)
+        obs = env.reset()
+        env.state.agent = np.array([1, 2])
+        env.state.other = np.array([2, 1])  # one move from a hazard, so its draws matter
+        lspace = LSpace(env.encode(obs).shape[0], {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}, seed=0)
+        state = lspace.update(env.encode(env.observe()), lspace.initial_state())
+        residue = ResidueField()
+        residue.add_dent(state.beta.copy(), magnitude=1.0)
+        coupling = CouplingModel()
+
+        batched = MPCPlanner(horizon=horizon, beam_width=beam_width)
+        cloned = MPCPlanner(horizon=horizon, beam_width=beam_width, use_batch=False)
+        a0, p0 = batched.choose_action(env, state, residue, coupling, lspace=lspace)
+        a1, p1 = cloned.choose_action(env, state, residue, coupling, lspace=lspace)
+
+        assert a0 == a1
+        assert p0["plan"] == p1["plan"]
+        for k in ("total", "reality", "ethical", "residue"):
+            assert np.isclose(p0[k], p1[k], rtol=1e-5)
+
+    @pytest.mark.parametrize("seed", [6, 8, 19, 57])
+    def test_batched_exact_planner_survives_real_rng_episode(seed):
+        env = ToyGridWorld(seed=seed)
+        obs = env.reset()
+        lspace = LSpace(env.encode(obs).shape[0], {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}, seed=0)
+        residue = ResidueField()
+        residue.add_dent(lspace.update(env.encode(obs), lspace.initial_state()).beta.copy(), magnitude=0.5)
+        agent = REEAgent(lspace=lspace, planner=MPCPlanner(horizon=3), residue=residue, coupling=CouplingModel())
+        agent.reset()
+        for _ in range(40):
+            _obs, _rc, _ec, done, info = agent.step(env)
+            assert info.action in env.action_space() and np.isfinite(info.score)
+            if done:
+                break
+    """)
+
+    w(root, "tests/test_toy_gridworld.py", """
+    import numpy as np
+
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.social.coupling import CouplingModel
+
+    def test_clone_shares_static_world_and_not_rng():
+        env = ToyGridWorld(seed=3)
+        env.reset()
+        sim = env.clone()
+        assert sim.hazards is env.hazards and sim.food is env.food
+        assert sim.rng is not env.rng
+
+        # the clone predicts the real env's next step without advancing its stream
+        sim.step(4)
+        env.step(4)
+        assert np.array_equal(sim.state.other, env.state.other)
+
+    def test_snapshot_restore_roundtrip():
+        env = ToyGridWorld(seed=3)
+        env.reset()
+        snap = env.snapshot()
+        first = [env.step(a)[1:] for a in (0, 3, 3)]
+        env.restore(snap)
+        second = [env.step(a)[1:] for a in (0, 3, 3)]
+        assert first == second
+        assert snap.state.t == 0
+
+    def test_planning_does_not_perturb_env_stream():
+        def run(horizon, use_batch):
+            env = ToyGridWorld(seed=5)
+            obs = env.reset()
+            lspace = LSpace(env.encode(obs).shape[0], {"gamma": 4, "beta": 4, "theta": 4, "delta": 4}, seed=0)
+            planner = MPCPlanner(horizon=horizon, use_batch=use_batch)
+            state = lspace.update(env.encode(obs), lspace.initial_state())
+            planner.choose_action(env, state, ResidueField(), CouplingModel(), lspace=lspace)
+            return [int(env.rng.integers(0, 1000)) for _ in range(5)]
+
+        ref = [int(x) for x in np.random.default_rng(5).integers(0, 1000, size=5)]
+        assert run(1, False) == run(3, False) == run(3, True) == ref
+
+    def test_prefetched_other_moves_keep_the_stream():
+        def trajectory(prefetch):
+            env = ToyGridWorld(seed=11, other_prefetch=prefetch)
+            env.reset()
+            out = []
+            for a in [0, 3, 3, 1, 4] * 6:
+                # a clone taken mid-prefetch predicts the real env's next step
+                predicted = env.clone().step(a)[0]["vision"].tolist()
+                out.append(env.step(a)[0]["vision"].tolist())
+                assert out[-1] == predicted
+            return out, int(env.rollout_rng().integers(0, 1000))
+
+        assert trajectory(1) == trajectory(4) == trajectory(64)
+
+    def test_reused_rollout_rng_is_reseated_not_shared():
+        env = ToyGridWorld(seed=11, other_prefetch=4)
+        env.reset()
+        env.step(0)  # mid-prefetch
+        scratch = env.rollout_rng(reuse=True)
+        first = scratch.integers(0, 1000, size=5).tolist()
+        assert env.rollout_rng(reuse=True) is scratch
+        assert scratch.integers(0, 1000, size=5).tolist() == first
+        assert env.rollout_rng().integers(0, 1000, size=5).tolist() == first
+        assert env.rollout_rng() is not scratch and env.clone().rng is not scratch
+
+    def test_hazard_grid_and_many_others_match_batched_step():
+        env = ToyGridWorld.large(size=32, hazard_density=0.2, n_others=5, seed=1)
+        env.reset()
+        assert env.state.other.shape == (5, 2)
+        assert env._hazard_grid.sum() == len(env.hazards)
+
+        actions = np.array([0, 3, 3, 1])
+        states, rc, parts, done = env.step_batch(env.batch_state(4), actions, rng=np.random.default_rng(3))
+        for i, a in enumerate(actions):
+            sim = env.clone()
+            sim.rng = np.random.default_rng(3)
+            sim.rng.integers(0, 5, size=5 * i)
+            obs, rc_i, parts_i, done_i = sim.step(int(a))
+            assert np.array_equal(states.other[i], sim.state.other) and done[i] == done_i
+            assert parts["other"][i] == parts_i["other"] and np.isclose(rc[i], rc_i)
+            assert np.allclose(env.encode_batch(states)[i], sim.encode(obs))
+
+        env.hazards = [np.array([0, 1])]
+        assert env.step(0)[2]["self"] == 1.0
+
+    def test_off_grid_hazards_are_ignored():
+        env = ToyGridWorld(seed=0, hazards=[(-1, 0), (0, -1), (10, 3), (3, 10)])
+        env.reset()
+        assert env._hazard_grid.sum() == 0 and len(env.hazards) == 4
+        for a in [3] * 9 + [0] * 9:  # along y = 0 to (9, 0), where (-1, 0) would wrap to
+            assert env.step(a)[2]["self"] == 0.0
+    """)
+
+    w(root, "tests/test_lspace_fast.py", """
+    import numpy as np
+    import pytest
+
+    from ree_impl.lspace.stack import DEPTHS, LSpace
+
+    DIMS = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
+
+    @pytest.mark.parametrize("dtype,atol", [(np.float64, 1e-6), (np.float32, 1e-5)])
+    def test_update_fast_matches_reference(dtype, atol):
+        rng = np.random.default_rng(0)
+        lspace = LSpace(7, DIMS, alphas={"gamma": 1.0, "beta": 1.5, "theta": 1.0, "delta": 0.8}, dtype=dtype)
+        ref = lspace.initial_state()
+        fast = lspace.initial_state()
+        inplace = lspace.initial_state()
+        for _ in range(30):
+            x = rng.uniform(0, 1, size=7).astype(np.float32)
+            ref = lspace.update(x, ref)
+            fast = lspace.update_fast(x, fast)
+            lspace.update_fast(x, inplace, out=inplace)
+            for k in DEPTHS:
+                assert getattr(fast, k).dtype == np.dtype(dtype)
+                assert np.allclose(getattr(fast, k), getattr(ref, k), atol=atol)
+                assert np.array_equal(getattr(fast, k), getattr(inplace, k))
+
+    def test_update_fast_tracks_replaced_weights():
+        lspace = LSpace(3, DIMS)
+        x = np.ones(3, dtype=np.float32)
+        s = lspace.initial_state()
+        lspace.update_fast(x, s)
+        lspace.W["gamma"] = lspace.W["gamma"] * 2.0
+        assert np.allclose(lspace.update_fast(x, s).gamma, lspace.update(x, s).gamma, atol=1e-5)
+    """)
+
+    w(root, "tests/test_instrument.py", """
+    import json
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.core.instrument import PHASES, Instrumentation
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
     from ree_impl.planning.mpc import MPCPlanner
     from ree_impl.residue.field import ResidueField
     from ree_impl.sleep.sleep import SleepSubsystem
     from ree_impl.social.coupling import CouplingModel
 
-    def main():
-        env = ToyGridWorld(size=10, max_steps=60, seed=1)
-        obs = env.reset()
+    def _agent(instrument=None):
+        env = ToyGridWorld(max_steps=30, seed=4)
+        env.reset()
+        sensor_dim = env.encode(env.observe()).shape[0]
+        agent = REEAgent(
+            lspace=LSpace(sensor_dim, {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}, seed=0),
+            planner=MPCPlanner(),
+            residue=ResidueField(),
+            coupling=CouplingModel(),
+            sleep=SleepSubsystem(every_n_steps=5),
+            instrument=instrument,
+        )
+        agent.reset()
+        return env, agent
 
-        sensor_dim = env.encode(obs).shape[0]
+    def _run(env, agent):
+        actions = []
+        done = False
+        while not done:
+            _, _, _, done, info = agent.step(env)
+            actions.append(info.action)
+        return actions
+
+    def test_instrumented_step_records_phases_and_counters(tmp_path):
+        inst = Instrumentation()
+        records = []
+        inst.add_hook(records.append)
+        env, agent = _agent(inst)
+        actions = _run(env, agent)
+
+        assert len(records) == len(actions) == inst.steps
+        assert all(p + "_s" in r for r in records for p in PHASES)
+        assert inst.counts["rollouts"] == 5 * len(actions)
+        assert inst.counts["dents_added"] - inst.counts["dents_merged"] == agent.residue.count()
+
+        # instrumentation must not change behaviour
+        env2, agent2 = _agent()
+        assert _run(env2, agent2) == actions
+
+        inst.export_json(str(tmp_path / "p.json"))
+        inst.export_chrome_trace(str(tmp_path / "p.trace.json"))
+        summary = json.loads((tmp_path / "p.json").read_text())
+        assert summary["steps"] == len(actions)
+        trace = json.loads((tmp_path / "p.trace.json").read_text())
+        assert len(trace["traceEvents"]) == len(PHASES) * len(actions)
+    """)
+
+    w(root, "tests/test_checkpoint.py", """
+    import json
+
+    import numpy as np
+    import pytest
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.experiments.runner import EpisodeConfig, build
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.persist.checkpoint import ResidueStore, load_agent, load_residue, save_agent
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+    from ree_impl.social.coupling import CouplingModel
+
+    def _residue(n, seed=0):
+        rng = np.random.default_rng(seed)
+        residue = ResidueField()
+        for _ in range(n):
+            residue.add_dent(rng.standard_normal(3).astype(np.float32), float(rng.uniform(0.1, 1.0)), float(rng.uniform(0.5, 1.5)))
+        return residue
+
+    def test_residue_round_trip_incremental_and_mmap(tmp_path):
+        store = ResidueStore(tmp_path)
+        residue = _residue(10)
+        assert store.save(residue) == 10
+        for _ in range(5):
+            residue.add_dent(np.ones(3, dtype=np.float32), 0.5, 1.0)
+        assert store.save(residue) == 5  # appended only
+        residue.set_arrays(residue.centers[:4], residue.magnitudes[:4], residue.sigmas[:4])
+        residue.add_dent(np.zeros(3, dtype=np.float32), 2.0, 0.7)
+        assert store.save(residue) == 5  # rewrite after an in-place change
+
+        for mmap in (True, False):
+            loaded = load_residue(tmp_path, mmap=mmap)
+            assert np.array_equal(loaded.centers, residue.centers)
+            assert np.array_equal(loaded.magnitudes, residue.magnitudes)
+            assert np.array_equal(loaded.sigmas, residue.sigmas)
+            assert np.isclose(loaded.potential(np.zeros(3)), residue.potential(np.zeros(3)))
+
+        shared = load_residue(tmp_path)
+        assert not shared.centers.flags.writeable
+        shared.add_dent(np.ones(3, dtype=np.float32), 1.0, 1.0)  # copies out of the map
+        assert shared.count() == 6 and load_residue(tmp_path).count() == 5
+
+    def test_header_is_checked(tmp_path):
+        ResidueStore(tmp_path).save(_residue(3))
+        head = json.loads((tmp_path / "residue.json").read_text())
+        head["version"] = 999
+        (tmp_path / "residue.json").write_text(json.dumps(head))
+        with pytest.raises(ValueError):
+            load_residue(tmp_path)
+
+    def _agent(max_dents=None, seed=3, hazards=None):
+        env = ToyGridWorld(max_steps=40, seed=seed, hazards=hazards)
+        env.reset()
+        residue = ResidueField()
+        residue.set_capacity(max_dents)
+        agent = REEAgent(
+            lspace=LSpace(env.encode(env.observe()).shape[0], {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}, seed=0),
+            planner=MPCPlanner(),
+            residue=residue,
+            coupling=CouplingModel(),
+            sleep=SleepSubsystem(every_n_steps=10, merge_radius=0.8),
+        )
+        agent.reset()
+        return agent, env
+
+    # checkerboard hazards near the start, so the episode keeps adding dents past the cap
+    HAZARDS = [(x, y) for x in range(1, 5) for y in range(1, 5) if (x + y) % 2]
+
+    def test_agent_resume_matches_uninterrupted_run(tmp_path):
+        agent, env = _agent(max_dents=1, seed=1, hazards=HAZARDS)
+        for _ in range(15):
+            agent.step(env)
+        save_agent(agent, tmp_path)
+        snap = env.snapshot()
+        expected = [agent.step(env)[4].action for _ in range(15)]
+
+        resumed, _ = _agent(max_dents=1, seed=1, hazards=HAZARDS)
+        resumed.lspace.W = {k: np.zeros_like(v) for k, v in resumed.lspace.W.items()}
+        load_agent(resumed, tmp_path)
+        env.restore(snap)
+        assert resumed.t == 15
+        assert resumed.residue.max_dents == 1
+        assert [resumed.step(env)[4].action for _ in range(15)] == expected
+        assert resumed.residue.count() == agent.residue.count() == 1
+        assert resumed.residue.compaction_stats["runs"] > 0
+        assert resumed.lspace.alphas == agent.lspace.alphas
+
+    def test_load_agent_cancels_sleep_job_of_replaced_residue(tmp_path):
+        agent, _ = _agent()
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            agent.residue.add_dent(rng.standard_normal(16).astype(np.float32), 1.0)
+        save_agent(agent, tmp_path)
+        agent.sleep.mode, agent.sleep.work_per_step = "incremental", 1
+        old = agent.residue
+        agent.sleep.tick(10, old, agent.lspace)
+        assert agent.sleep.pending == 1
+
+        load_agent(agent, tmp_path)
+        assert agent.residue is not old and agent.sleep.pending == 0
+        assert old.count() == 20  # the abandoned merge was never applied
+
+    def test_load_agent_keeps_residue_storage_precision(tmp_path):
+        cfg = EpisodeConfig(max_dents=4, residue_precision="int8", max_steps=20)
+        agent, _ = build(cfg)
+        rng = np.random.default_rng(0)
+        for _ in range(3):
+            agent.residue.add_dent(rng.standard_normal(16).astype(np.float32), 1.0)
+        save_agent(agent, tmp_path)
+
+        resumed, _ = build(cfg)
+        load_agent(resumed, tmp_path)
+        field = resumed.residue
+        assert (field.precision, field.precision_block, field.max_dents) == ("int8", agent.residue.precision_block, 4)
+        assert field.nbytes <= agent.residue.nbytes
+        assert np.array_equal(field.centers, agent.residue.centers)
+
+    @pytest.mark.parametrize("saved, loaded", [("float64", "float16"), ("float16", "float64")])
+    def test_load_agent_keeps_weight_dtype(tmp_path, saved, loaded):
+        agent, _ = build(EpisodeConfig(weight_dtype=saved))
+        save_agent(agent, tmp_path)
+
+        resumed, _ = build(EpisodeConfig(weight_dtype=loaded, lspace_seed=1))
+        load_agent(resumed, tmp_path)
+        assert resumed.lspace.weight_dtype == np.dtype(loaded)
+        for depth, W in resumed.lspace.W.items():
+            assert W.dtype == np.dtype(loaded)
+            assert np.array_equal(W, agent.lspace.W[depth].astype(loaded))
+        x = np.full(resumed.lspace.sensor_dim, 0.5, dtype=np.float32)
+        bounds = resumed.lspace.update_error_bound(x, resumed.state)
+        assert (min(bounds.values()) > 0.0) == (loaded == "float16")
+    """)
+
+    w(root, "tests/test_path_memory.py", """
+    import numpy as np
+    import pytest
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.hippocampus.path_memory import PathMemory
+    from ree_impl.lspace.stack import LSpace, LState
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+    from ree_impl.social.coupling import CouplingModel
+
+    DIMS = {"gamma": 2, "beta": 3, "theta": 2, "delta": 1}
+
+    def _state(v):
+        return LState(**{k: np.full(d, v, dtype=np.float32) for k, d in DIMS.items()})
+
+    def test_ring_is_bounded_and_segments_are_indexed():
+        memory = PathMemory(DIMS, capacity=40, segment_len=8)
+        for step in range(100):
+            memory.record(_state(step), step % 5, 0.1, 0.0, 0.0)
+        assert memory.capacity == 40 and len(memory) == 40
+        stored = list(memory.replay())
+        # steps 60..99 are held; segment 7 (steps 56..63) was partly overwritten
+        assert [seg.start for seg in stored] == [64, 72, 80, 88]
+        assert np.array_equal(stored[0].depth("beta")[:, 0], np.arange(64, 72))
+        assert [seg.start for seg in memory.replay(order="recent", limit=2)] == [88, 80]
+
+        (g, dist), = memory.nearest(_state(75.5))  # mean of steps 72..79
+        assert memory.segment(g).start == 72 and dist < 1e-6
+        with pytest.raises(IndexError):
+            memory.segment(0)
+
+    def test_segments_do_not_span_episodes():
+        memory = PathMemory(DIMS, capacity=40, segment_len=8)
+        for step in range(5):
+            memory.record(_state(step), 0, 0.1, 0.0, 0.0)
+        memory.new_episode()
+        for step in range(100, 110):
+            memory.record(_state(step), 1, 0.1, 0.0, 0.0)
+        memory.new_episode()
+
+        stored = list(memory.replay())
+        assert [len(seg.t) for seg in stored] == [5, 8, 2]
+        for seg in stored:
+            assert len(set(seg.episode.tolist())) == 1
+            assert np.array_equal(seg.t, np.arange(seg.t[0], seg.t[0] + len(seg.t)))
+        assert np.array_equal(stored[0].depth("beta")[:, 0], np.arange(5))
+        assert np.array_equal(stored[2].depth("beta")[:, 0], [108, 109])
+
+        (g, dist), = memory.nearest(_state(2.0))  # mean of the short first episode only
+        assert memory.segment(g).start == 0 and dist < 1e-6
+        assert len(memory) == 15 and memory.total == 24  # skipped slots are not stored steps
+
+        for step in range(20):  # wraps: the first new segment overwrites the 5-step one
+            memory.record(_state(200 + step), 2, 0.1, 0.0, 0.0)
+        assert len(memory) == 8 + 2 + 8 + 8 + 5
+        memory.new_episode()  # the old episode's 5th step sits in a skipped slot
+        assert len(memory) == 8 + 2 + 8 + 8 + 4
+
+    def test_agent_records_path_and_sleep_replays_it():
+        env = ToyGridWorld(max_steps=40, seed=1)
+        env.reset()
         dims = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
-        lspace = LSpace(sensor_dim=sensor_dim, dims=dims, alphas={"gamma":1.0,"beta":1.5,"theta":1.0,"delta":0.8}, seed=0)
+        memory = PathMemory(dims, capacity=64, segment_len=4)
+        sleep = SleepSubsystem(every_n_steps=10, path_memory=memory, replay_segments=3)
+        agent = REEAgent(
+            lspace=LSpace(env.encode(env.observe()).shape[0], dims, seed=0),
+            planner=MPCPlanner(),
+            residue=ResidueField(),
+            coupling=CouplingModel(),
+            sleep=sleep,
+            path_memory=memory,
+        )
+        agent.reset()
+        actions = []
+        done = False
+        while not done:
+            _, _, _, done, info = agent.step(env)
+            actions.append(info.action)
+        assert memory.total == len(actions)
+        assert list(memory._action[: len(actions)]) == actions
+        assert np.allclose(memory.segment(memory.total // 4 - 1).depth("beta")[-1], agent.state.beta)
+        assert agent.residue.count() > 0
+        assert sleep.replay_stats["segments"] > 0
+    """)
 
-        planner = MPCPlanner(horizon=1, lambda_ethics=1.5, rho_residue=2.0)
+    w(root, "tests/test_telemetry.py", """
+    import numpy as np
+
+    from ree_impl.experiments.telemetry import TelemetryReader, TelemetryWriter
+
+    SCHEMA = (("episode", "i8"), ("t", "i8"), ("cost", "f8"))
+
+    def test_round_trip_chunks_append_and_aggregate(tmp_path):
+        path = tmp_path / "run.rtl"
+        with TelemetryWriter(path, schema=SCHEMA, chunk_rows=7) as sink:
+            for i in range(20):
+                sink.append({"episode": i // 10, "t": i % 10, "cost": float(i)})
+        with TelemetryWriter(path, schema=SCHEMA, chunk_rows=7) as sink:
+            sink.append({"episode": 2, "t": 0, "cost": 100.0})
+
+        reader = TelemetryReader(path)
+        assert len(reader) == 21
+        assert [len(c["t"]) for c in reader.chunks(["t"])] == [7, 7, 6, 1]
+        assert np.array_equal(reader.column("cost"), np.r_[np.arange(20.0), 100.0])
+        assert next(reader.rows()) == {"episode": 0, "t": 0, "cost": 0.0}
+
+        by_episode = reader.aggregate(["cost"], by="episode")
+        assert by_episode[0]["cost"]["sum"] == sum(range(10))
+        assert by_episode[1]["cost"]["max"] == 19.0
+        assert reader.aggregate(["cost"])["cost"]["count"] == 21
+
+    def test_torn_trailing_chunk_is_ignored(tmp_path):
+        path = tmp_path / "run.rtl"
+        with TelemetryWriter(path, schema=SCHEMA, chunk_rows=4) as sink:
+            for i in range(8):
+                sink.append({"t": i, "cost": 1.0})
+        with open(path, "ab") as f:
+            f.write(b"\\x04\\x00\\x00\\x00partial")
+        assert len(TelemetryReader(path)) == 8
+        with TelemetryWriter(path, schema=SCHEMA) as sink:
+            sink.append({"t": 8, "cost": 1.0})
+        assert TelemetryReader(path).column("t").tolist() == list(range(9))
+    """)
+
+    w(root, "tests/test_backend.py", """
+    import sys
+    import types
+
+    import numpy as np
+    import pytest
+
+    from ree_impl import backend
+    from ree_impl.residue import kernels
+
+    @pytest.fixture
+    def restore_backend():
+        yield
+        backend.set_backend("numpy")
+
+    def test_unknown_backend_and_partial_fallback(restore_backend, monkeypatch):
+        with pytest.raises(ValueError):
+            backend.set_backend("nope")
+        monkeypatch.setitem(backend.BACKENDS, "partial", "tests_partial_backend")
+        mod = types.ModuleType("tests_partial_backend")
+        mod.KERNELS = {"tanh_matvec": lambda W, x: np.zeros(W.shape[0])}
+        monkeypatch.setitem(sys.modules, "tests_partial_backend", mod)
+        assert backend.set_backend("partial") == "partial"
+        assert backend.kernel("rbf_sum") is kernels.rbf_sum
+        assert not backend.kernel("tanh_matvec")(np.ones((2, 2)), np.ones(2)).any()
+
+    def test_numba_kernels_match_reference(restore_backend):
+        pytest.importorskip("numba")
+        from ree_impl.residue import kernels_numba as nb
+
+        rng = np.random.default_rng(0)
+        Z = rng.standard_normal((5, 4))
+        C = rng.standard_normal((40, 4)).astype(np.float32)
+        mags, sigmas = rng.uniform(0.1, 1.0, 40), rng.uniform(0.5, 1.5, 40)
+        assert np.allclose(nb.rbf_sum(Z, C, mags, sigmas), kernels.rbf_sum(Z, C, mags, sigmas), rtol=1e-12)
+        for got, ref in zip(nb.rbf_sum_grad(Z, C, mags, sigmas), kernels.rbf_sum_grad(Z, C, mags, sigmas)):
+            assert np.allclose(got, ref, rtol=1e-12, atol=1e-14)
+        assert np.allclose(nb.pairwise_sq_dists(Z, C), kernels.pairwise_sq_dists(Z, C), atol=1e-12)
+        W = rng.standard_normal((6, 4)).astype(np.float32)
+        x = rng.standard_normal(4).astype(np.float32)
+        assert np.allclose(nb.tanh_matvec(W, x), kernels.tanh_matvec(W, x), atol=1e-6)
+
+        assert backend.set_backend("auto") == "numba"
+        assert backend.kernel("rbf_sum") is nb.rbf_sum
+    """)
+
+    w(root, "tests/test_async_planning.py", """
+    import asyncio
+    import time
+
+    import numpy as np
+    import pytest
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.core.async_agent import AsyncREEAgent
+    from ree_impl.envs.async_env import LatencyEnv
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.async_mpc import AsyncMPCPlanner
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.social.coupling import CouplingModel
+
+    def _setup(seed=3):
+        env = ToyGridWorld(seed=seed)
+        env.reset()
+        lspace = LSpace(sensor_dim=env.encode(env.observe()).shape[0], dims={"gamma": 4, "beta": 8, "theta": 8, "delta": 8}, seed=0)
+        lstate = lspace.update_fast(env.encode(env.observe()), lspace.initial_state())
         residue = ResidueField()
+        rng = np.random.default_rng(0)
+        for _ in range(6):
+            residue.add_dent(center=rng.normal(size=8).astype(np.float32), magnitude=1.0, sigma=1.0)
+        return env, lspace, lstate, residue
+
+    @pytest.mark.parametrize("horizon", [1, 2])
+    @pytest.mark.parametrize("use_snapshots", [True, False])
+    def test_async_choice_matches_sync(horizon, use_snapshots):
+        env, lspace, lstate, residue = _setup()
         coupling = CouplingModel(kappa_other=0.8)
-        sleep = SleepSubsystem(every_n_steps=20, merge_radius=0.8)
+        a_sync, p_sync = MPCPlanner(horizon=horizon, use_batch=False).choose_action(env, lstate, residue, coupling, lspace=lspace)
+        planner = AsyncMPCPlanner(horizon=horizon, max_concurrency=4, use_snapshots=use_snapshots)
+        a_async, p_async = asyncio.run(planner.achoose_action(LatencyEnv(env), lstate, residue, coupling, lspace=lspace))
+        assert a_async == a_sync
+        assert p_async["plan"] == p_sync["plan"]
+        assert p_async["total"] == pytest.approx(p_sync["total"])
+        assert planner.rollouts == sum(5 ** d for d in range(1, horizon + 1)) and planner.timeouts == 0
 
-        agent = REEAgent(lspace=lspace, planner=planner, residue=residue, coupling=coupling, sleep=sleep)
-        agent.reset()
+    def test_rollouts_overlap_within_concurrency_limit():
+        env, lspace, lstate, residue = _setup()
+        latency = 0.05
+        slow = LatencyEnv(env, step_latency=latency)
+        planner = AsyncMPCPlanner(horizon=1, max_concurrency=5)
+        t0 = time.perf_counter()
+        asyncio.run(planner.achoose_action(slow, lstate, residue, CouplingModel(), lspace=lspace))
+        elapsed = time.perf_counter() - t0
+        # five 50 ms rollouts issued together: well under the 250 ms a serial loop needs
+        assert elapsed < 0.6 * 5 * latency
+        assert slow.stats["max_in_flight"] == 5
 
-        t = 0
-        total_eth = 0.0
-        total_real = 0.0
+        limited = LatencyEnv(env, step_latency=0.01)
+        asyncio.run(AsyncMPCPlanner(horizon=1, max_concurrency=2).achoose_action(limited, lstate, residue, CouplingModel()))
+        assert limited.stats["max_in_flight"] <= 2
 
-        while True:
-            obs, rc, ec, done, info = agent.step(env)
-            t += 1
-            total_real += rc
-            total_eth += ec
-            if t % 10 == 0:
-                print(f\"t={t:03d} action={info.action} score={info.score:.3f} dents={residue.count()} batt={obs['body'][0]:.2f}\")
-            if done:
-                break
+    def test_timed_out_rollouts_are_dropped():
+        env, _, lstate, residue = _setup()
+        coupling = CouplingModel()
+        _, parts = MPCPlanner(use_batch=False).choose_action(env, lstate, residue, coupling)
+        stall = parts["plan"][0]  # the action the planner would otherwise pick
+        slow = LatencyEnv(env, step_latency=lambda a: 5.0 if a == stall else 0.0)
+        planner = AsyncMPCPlanner(horizon=1, rollout_timeout=0.05)
+        action, _ = asyncio.run(planner.achoose_action(slow, lstate, residue, coupling))
+        assert action != stall
+        assert planner.timeouts == 1 and planner.rollouts == 4
 
-        print(\"Episode done.\")
-        print(f\"steps={t} total_reality_cost={total_real:.3f} total_ethical_cost={total_eth:.3f} dents={residue.count()}\") 
+        stuck = LatencyEnv(env, step_latency=5.0)
+        with pytest.raises(TimeoutError):
+            asyncio.run(AsyncMPCPlanner(rollout_timeout=0.02).achoose_action(stuck, lstate, residue, coupling))
 
-    if __name__ == \"__main__\":
-        main()
+    def test_async_agent_follows_sync_agent():
+        def make(agent_cls, planner):
+            env, lspace, _, _ = _setup(seed=5)
+            agent = agent_cls(lspace=lspace, planner=planner, residue=ResidueField(), coupling=CouplingModel(kappa_other=0.8))
+            agent.reset()
+            return agent, env
+
+        sync_agent, sync_env = make(REEAgent, MPCPlanner(horizon=2))
+        sync_actions = [sync_agent.step(sync_env)[4].action for _ in range(15)]
+
+        async_agent, env = make(AsyncREEAgent, AsyncMPCPlanner(horizon=2, max_concurrency=8))
+        infos = asyncio.run(async_agent.arun_episode(LatencyEnv(env, step_latency=0.0005), max_steps=15))
+        assert [i.action for i in infos] == sync_actions
+        assert async_agent.residue.count() == sync_agent.residue.count()
     """)
 
-    # --- Tests (ablations) ---
-    w(root, "tests/test_residue_changes_choice.py", """
+    w(root, "tests/test_precision.py", """
     import numpy as np
+    import pytest
 
     from ree_impl.envs.toy_gridworld import ToyGridWorld
     from ree_impl.lspace.stack import LSpace
     from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.precision import dequantize_int8, quantize_int8, row_error_bound
     from ree_impl.residue.field import ResidueField
     from ree_impl.social.coupling import CouplingModel
 
-    def test_residue_influences_score_nonzero():
+    DIMS = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
+
+    def test_int8_roundtrip_within_row_bound():
+        X = np.random.default_rng(0).normal(size=(50, 20)).astype(np.float32)
+        q, scales = quantize_int8(X, block=8)
+        assert q.dtype == np.int8 and scales.shape == (50, 3)
+        Y = dequantize_int8(q, scales, block=8)
+        err = np.linalg.norm(X.astype(np.float64) - Y, axis=1)
+        assert np.all(err <= row_error_bound(Y, "int8", scales, 8))
+
+    @pytest.mark.parametrize("precision", ["float16", "int8"])
+    def test_reduced_field_potential_within_bound(precision):
+        rng = np.random.default_rng(1)
+        C = (rng.normal(size=(400, 16)) * 0.5).astype(np.float32)
+        mags, sigmas = rng.uniform(0.1, 2.0, 400), rng.uniform(0.5, 1.5, 400)
+        ref = ResidueField()
+        ref.set_arrays(C, mags, sigmas)
+        field = ResidueField()
+        field.add_dent(C[0], magnitude=mags[0], sigma=sigmas[0])
+        field.set_precision(precision, block=8)  # re-encodes the existing dent
+        field.set_arrays(C, mags, sigmas)
+        field.block_elems = 16 * 64  # decode in several slabs
+
+        Z = rng.normal(size=(64, 16)) * 0.5
+        bound = field.precision_error_bound()
+        assert 0.0 < bound
+        assert np.max(np.abs(field.potential_batch(Z) - ref.potential_batch(Z))) <= bound
+        value, grad = field.potential_and_gradient(Z[0])
+        assert abs(value - ref.potential(Z[0])) <= bound
+        assert np.allclose(grad, ref.gradient(Z[0]), atol=bound)
+        assert field.nbytes < ref.nbytes
+
+    def test_float16_weights_latent_drift_within_bound():
+        ref = LSpace(17, DIMS, seed=0)
+        half = LSpace(17, DIMS, seed=0, weight_dtype="float16")
+        assert half.W["beta"].dtype == np.float16
+        x = np.random.default_rng(2).uniform(0.0, 1.0, 17).astype(np.float32)
+        s = ref.initial_state()
+        for _ in range(5):
+            bounds = half.update_error_bound(x, s)
+            a, b = ref.update_fast(x, s), half.update_fast(x, s)
+            for depth, bound in bounds.items():
+                assert np.max(np.abs(getattr(a, depth) - getattr(b, depth))) <= bound + 1e-6
+            s = a
+
+    def test_reduced_precision_action_choices_match_reference():
         env = ToyGridWorld(seed=2)
-        obs = env.reset()
-        sensor_dim = env.encode(obs).shape[0]
-        lspace = LSpace(sensor_dim, {"gamma":8,"beta":16,"theta":32,"delta":32}, seed=0)
-        state = lspace.initial_state()
-        state = lspace.update(env.encode(obs), state)
+        env.reset()
+        sensor_dim = env.encode(env.observe()).shape[0]
+        lspaces = {wd: LSpace(sensor_dim, DIMS, seed=0, weight_dtype=wd) for wd in ("float64", "float16")}
+        rng = np.random.default_rng(0)
+        decisions = []
+        s = lspaces["float64"].initial_state()
+        for _ in range(40):
+            s = lspaces["float64"].update_fast(env.encode(env.observe()), s)
+            decisions.append((env.clone(), s))
+            env.step(int(rng.integers(5)))
+
+        # a dense field around the visited latents, so residue steers horizon-2 plans
+        betas = np.stack([st.beta for _, st in decisions])
+        C = (betas[rng.integers(len(betas), size=200)] + rng.normal(size=(200, 16)) * 0.05).astype(np.float32)
+        mags = rng.uniform(0.2, 1.0, 200)
+        fields = {}
+        for precision in ("float32", "float16", "int8"):
+            fields[precision] = ResidueField()
+            fields[precision].set_precision(precision)
+            fields[precision].set_arrays(C, mags, np.full(200, 0.3))
+
+        planner = MPCPlanner(horizon=2, rho_residue=4.0)
+        coupling = CouplingModel()
+
+        def choices(field, lspace):
+            return [planner.choose_action(e, st, field, coupling, lspace=lspace)[0] for e, st in decisions]
+
+        reference = choices(fields["float32"], lspaces["float64"])
+        assert reference != choices(ResidueField(), lspaces["float64"])  # the residue does matter
+        for precision in ("float16", "int8"):
+            for wd in ("float64", "float16"):
+                assert choices(fields[precision], lspaces[wd]) == reference
+    """)
+
+    w(root, "tests/test_vector_agent.py", """
+    import numpy as np
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.core.vector_agent import VectorREEAgent
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField, potential_many
+    from ree_impl.sleep.sleep import SleepSubsystem
+    from ree_impl.social.coupling import CouplingModel
+
+    DIMS = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
+    ALPHAS = {"gamma": 1.0, "beta": 1.5, "theta": 1.0, "delta": 0.8}
+
+    def test_potential_many_matches_per_field():
+        rng = np.random.default_rng(0)
+        fields = [ResidueField() for _ in range(4)]
+        for i, f in enumerate(fields[1:], start=1):
+            for _ in range(i * 5):
+                f.add_dent(rng.standard_normal(3).astype(np.float32), 1.0, 0.7)
+        Z = rng.standard_normal((4, 3))
+        expected = [f.potential(z) for f, z in zip(fields, Z)]
+        assert np.allclose(potential_many(fields, Z), expected)
+
+    def test_vector_agent_matches_independent_agents():
+        seeds = [1, 2, 3]
+        sensor_dim = ToyGridWorld().encode(ToyGridWorld().observe()).shape[0]
+
+        singles, single_envs = [], []
+        for seed in seeds:
+            env = ToyGridWorld(max_steps=40, seed=seed)
+            env.reset()
+            agent = REEAgent(
+                lspace=LSpace(sensor_dim, DIMS, alphas=dict(ALPHAS), seed=0),
+                # reference: per-rollout clone semantics, not the batched path
+                planner=MPCPlanner(use_batch=False),
+                residue=ResidueField(),
+                coupling=CouplingModel(),
+                sleep=SleepSubsystem(every_n_steps=10, merge_radius=0.8),
+            )
+            agent.reset()
+            singles.append(agent)
+            single_envs.append(env)
+
+        envs = [ToyGridWorld(max_steps=40, seed=seed) for seed in seeds]
+        for env in envs:
+            env.reset()
+        vec = VectorREEAgent(
+            lspace=LSpace(sensor_dim, DIMS, alphas=dict(ALPHAS), seed=0),
+            planner=MPCPlanner(),
+            coupling=CouplingModel(),
+            n_agents=len(seeds),
+            sleep=SleepSubsystem(every_n_steps=10, merge_radius=0.8),
+        )
+        vec.reset()
+
+        for _ in range(40):
+            _, rcs, ecs, _, infos = vec.step(envs)
+            for i, (agent, env) in enumerate(zip(singles, single_envs)):
+                _, rc, ec, _, info = agent.step(env)
+                assert info.action == infos[i].action
+                assert np.isclose(rc, rcs[i]) and np.isclose(ec, ecs[i])
+                assert np.isclose(info.score, infos[i].score, rtol=1e-4)
+
+        for i, agent in enumerate(singles):
+            assert agent.residue.count() == vec.residues[i].count()
+            assert agent.lspace.alphas == vec.alphas[i]
+            assert np.allclose(agent.state.beta, vec.state.beta[i], atol=1e-4)
+
+    def test_vector_agent_reports_truncated_search():
+        envs = [ToyGridWorld(max_steps=40, seed=seed) for seed in (1, 2)]
+        for env in envs:
+            env.reset()
+        vec = VectorREEAgent(
+            lspace=LSpace(envs[0].encode(envs[0].observe()).shape[0], DIMS, seed=0),
+            planner=MPCPlanner(horizon=2, max_rollouts=2),
+            coupling=CouplingModel(),
+            n_agents=len(envs),
+        )
+        vec.reset()
+        *_, infos = vec.step(envs)
+        assert [info.complete for info in infos] == [False, False]
+        assert all(info.overrun == 0.0 for info in infos)
+
+        vec.planner.max_rollouts = None
+        *_, infos = vec.step(envs)
+        assert all(info.complete for info in infos)
+    """)
+
+    w(root, "tests/test_experiment_runner.py", """
+    from ree_impl.experiments.runner import EpisodeConfig, aggregate, episode_seeds, run_episode, run_pool, sweep
+
+    def test_pool_results_match_serial_and_stream_every_step():
+        configs = sweep(EpisodeConfig(max_steps=15), {"kappa_other": [0.0, 0.8]}, episode_seeds(0, 3))
+        assert len(configs) == 6
 
+        streamed = []
+        pooled = run_pool(configs, workers=2, on_step=streamed.append, stream_every=4)
+        serial = [run_episode(cfg) for cfg in configs]
+
+        for p, s in zip(pooled, serial):
+            assert p.config == s.config
+            assert (p.steps, p.dents) == (s.steps, s.dents)
+            assert p.total_reality_cost == s.total_reality_cost
+            assert p.total_ethical_cost == s.total_ethical_cost
+        assert len(streamed) == sum(r.steps for r in serial)
+        assert {rec["episode"] for rec in streamed} == set(range(len(configs)))
+
+        stats = aggregate(pooled, by=("kappa_other",))
+        assert set(stats) == {(0.0,), (0.8,)}
+        assert all(v["episodes"] == 3 for v in stats.values())
+
+    def test_episode_seeds_are_reproducible():
+        assert episode_seeds(7, 4) == episode_seeds(7, 4)
+        assert len(set(episode_seeds(7, 4))) == 4
+    """)
+
+    # --- Benchmarks ---
+    w(root, "benchmarks/bench_sleep_merge.py", """
+    \"\"\"Sleep merge cost vs. dent count.
+
+    Usage: python benchmarks/bench_sleep_merge.py [--max-dents N]
+    \"\"\"
+    import argparse
+    import time
+
+    import numpy as np
+
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+
+    def make_residue(n: int, dim: int = 16, seed: int = 0) -> ResidueField:
+        # dents along a slowly drifting latent trajectory, like an agent's beta slice
+        rng = np.random.default_rng(seed)
+        centers = np.cumsum(rng.standard_normal((n, dim)) * 0.1, axis=0).astype(np.float32)
         residue = ResidueField()
-        coupling = CouplingModel(kappa_other=0.8)
-        planner = MPCPlanner()
+        residue.set_arrays(centers, rng.uniform(0.1, 1.0, size=n), np.ones(n))
+        return residue
 
-        a0, parts0 = planner.choose_action(env, state, residue, coupling)
-        # Add a dent at current beta: should increase residue term
-        residue.add_dent(center=state.beta.copy(), magnitude=1.0, sigma=1.0)
-        a1, parts1 = planner.choose_action(env, state, residue, coupling)
+    def time_merge(n: int, strategy: str, dense_merge_max: int) -> tuple[float, int]:
+        residue = make_residue(n)
+        sleep = SleepSubsystem(merge_radius=0.8, merge_strategy=strategy, dense_merge_max=dense_merge_max)
+        t0 = time.perf_counter()
+        sleep._merge_dents(residue)
+        return time.perf_counter() - t0, residue.count()
 
-        assert parts1[\"residue\"] >= parts0[\"residue\"]
-        assert parts1[\"total\"] >= parts0[\"total\"]
+    def main():
+        ap = argparse.ArgumentParser()
+        ap.add_argument("--max-dents", type=int, default=20_000)
+        args = ap.parse_args()
+
+        print(f"{'dents':>8} {'strategy':>10} {'path':>6} {'seconds':>9} {'kept':>7}")
+        n = 100
+        while n <= args.max_dents:
+            for strategy in ("greedy", "components"):
+                for path, dense_max in (("dense", 1 << 62), ("tree", 0)):
+                    if path == "dense" and n > 4096:
+                        continue
+                    dt, kept = time_merge(n, strategy, dense_max)
+                    print(f"{n:>8} {strategy:>10} {path:>6} {dt:>9.4f} {kept:>7}")
+            n *= 4
+
+    if __name__ == "__main__":
+        main()
+    """)
+
+    w(root, "benchmarks/suite.py", """
+    \"\"\"Timing suite for the REE online-loop hot paths.
+
+    Usage:
+      python benchmarks/suite.py                          # print table
+      python benchmarks/suite.py --json out.json          # machine-readable results
+      python benchmarks/suite.py --save-baseline base.json
+      python benchmarks/suite.py --baseline base.json --max-slowdown 1.5   # exit 1 on regression
+
+    Baselines are machine-specific: record one on the machine that runs the comparison.
+    \"\"\"
+    import argparse
+    import json
+    import platform
+    import sys
+    import time
+
+    import numpy as np
+
+    from ree_impl.core.agent import REEAgent
+    from ree_impl.envs.toy_gridworld import ToyGridWorld
+    from ree_impl.lspace.stack import LSpace
+    from ree_impl.planning.mpc import MPCPlanner
+    from ree_impl.residue.field import ResidueField
+    from ree_impl.sleep.sleep import SleepSubsystem
+    from ree_impl.social.coupling import CouplingModel
+
+    DIMS = {"gamma": 8, "beta": 16, "theta": 32, "delta": 32}
+
+    def timeit(fn, setup=None, repeat=5, min_time=0.05) -> dict:
+        \"\"\"Per-call seconds over `repeat` rounds; each round loops until `min_time` elapses.
+
+        With `setup`, every call gets fresh state from setup() (excluded from timing).
+        \"\"\"
+        per_call = []
+        calls = 0
+        for _ in range(repeat):
+            n = 0
+            spent = 0.0
+            while spent < min_time or n == 0:
+                arg = setup() if setup is not None else None
+                t0 = time.perf_counter()
+                fn(arg) if setup is not None else fn()
+                spent += time.perf_counter() - t0
+                n += 1
+            per_call.append(spent / n)
+            calls += n
+        per_call.sort()
+        return {"median_s": per_call[len(per_call) // 2], "min_s": per_call[0], "calls": calls}
+
+    def make_residue(n: int, dim: int = 16, seed: int = 0) -> ResidueField:
+        rng = np.random.default_rng(seed)
+        residue = ResidueField()
+        centers = np.cumsum(rng.standard_normal((n, dim)) * 0.1, axis=0).astype(np.float32)
+        residue.set_arrays(centers, rng.uniform(0.1, 1.0, size=n), np.ones(n))
+        return residue
+
+    def toy_setup(seed: int = 2):
+        env = ToyGridWorld(seed=seed)
+        obs = env.reset()
+        lspace = LSpace(env.encode(obs).shape[0], DIMS, seed=0)
+        state = lspace.update_fast(env.encode(obs), lspace.initial_state())
+        return env, lspace, state
+
+    def run_suite(quick: bool = False) -> dict:
+        results = {}
+        repeat = 3 if quick else 5
+
+        env, lspace, state = toy_setup()
+        x = env.encode(env.observe())
+        results["lspace.update"] = timeit(lambda: lspace.update(x, state), repeat=repeat)
+        results["lspace.update_fast"] = timeit(lambda: lspace.update_fast(x, state), repeat=repeat)
+
+        z = state.beta
+        for n in (10, 1_000, 10_000 if quick else 100_000):
+            residue = make_residue(n)
+            results[f"residue.potential[{n}]"] = timeit(lambda f=residue: f.potential(z), repeat=repeat)
+        residue.enable_index(cutoff_sigmas=4.0)
+        residue.potential(z)  # build the index outside the timed region
+        results[f"residue.potential_indexed[{residue.count()}]"] = timeit(lambda: residue.potential(z), repeat=repeat)
+
+        sleep = SleepSubsystem(merge_radius=0.8)
+        for n in (100, 1_000) if quick else (100, 1_000, 10_000):
+            results[f"sleep.run_offline[{n}]"] = timeit(
+                lambda arg: sleep.run_offline(*arg), setup=lambda n=n: (make_residue(n), LSpace(7, DIMS)), repeat=repeat
+            )
+
+        residue = make_residue(1_000)
+        coupling = CouplingModel()
+        for horizon in (1, 2, 3):
+            for use_batch in (True, False):
+                planner = MPCPlanner(horizon=horizon, use_batch=use_batch)
+                name = f"planner.choose_action[h={horizon},{'batch' if use_batch else 'clone'}]"
+                results[name] = timeit(lambda p=planner: p.choose_action(env, state, residue, coupling, lspace=lspace), repeat=repeat)
+
+        agent_env = ToyGridWorld(max_steps=10**9, seed=1)
+        agent = REEAgent(
+            lspace=LSpace(agent_env.encode(agent_env.reset()).shape[0], DIMS, seed=0),
+            planner=MPCPlanner(),
+            residue=ResidueField(),
+            coupling=CouplingModel(),
+            sleep=SleepSubsystem(every_n_steps=20, merge_radius=0.8),
+        )
+        agent.reset()
+        results["agent.step"] = timeit(lambda: agent.step(agent_env), repeat=repeat)
+        results["agent.step"]["steps_per_s"] = 1.0 / results["agent.step"]["median_s"]
+        return results
+
+    def compare(current: dict, baseline: dict, max_slowdown: float) -> list[str]:
+        \"\"\"Names whose median exceeds baseline median * max_slowdown.\"\"\"
+        bad = []
+        for name, base in baseline.items():
+            cur = current.get(name)
+            if cur is not None and cur["median_s"] > base["median_s"] * max_slowdown:
+                bad.append(f"{name}: {cur['median_s'] * 1e6:.1f}us vs baseline {base['median_s'] * 1e6:.1f}us")
+        return bad
+
+    def main() -> int:
+        ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        ap.add_argument("--quick", action="store_true", help="smaller sizes / fewer rounds")
+        ap.add_argument("--json", help="write results to this file")
+        ap.add_argument("--save-baseline", help="write results as a baseline file")
+        ap.add_argument("--baseline", help="compare against this baseline file")
+        ap.add_argument("--max-slowdown", type=float, default=1.5)
+        args = ap.parse_args()
+
+        results = run_suite(quick=args.quick)
+        doc = {
+            "meta": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "quick": args.quick,
+            },
+            "results": results,
+        }
+        for name, r in results.items():
+            print(f"{name:<45} {r['median_s'] * 1e6:>12.1f} us  (min {r['min_s'] * 1e6:.1f}, n={r['calls']})")
+        for path in (args.json, args.save_baseline):
+            if path:
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(doc, f, indent=2)
+
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)["results"]
+            bad = compare(results, baseline, args.max_slowdown)
+            for line in bad:
+                print(f"REGRESSION {line}", file=sys.stderr)
+            return 1 if bad else 0
+        return 0
+
+    if __name__ == "__main__":
+        sys.exit(main())
     """)
 
     # --- Minimal CI ---
@@ -566,11 +5301,31 @@ def main(out_dir: str) -> None:
             run: pytest -q
     """)
 
+    if not check:
+        root.mkdir(parents=True, exist_ok=True)
+    report = sync(root, _RENDERED, check=check, prune=prune)
+    if check:
+        drift = report["written"] + report["pruned"]
+        for rel in report["written"]:
+            print(f"out of date: {rel}")
+        for rel in report["pruned"]:
+            print(f"stale: {rel}")
+        print(f"{len(drift)} file(s) differ from the generator" if drift else "up to date")
+        return 1 if drift else 0
     print(f"Generated REE Cathedral at: {root}")
+    print(
+        f"  written={len(report['written'])} unchanged={len(report['unchanged'])} "
+        f"pruned={len(report['pruned'])}"
+    )
+    for rel in report["kept"]:
+        print(f"  kept (edited since generation): {rel}")
+    return 0
 
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 2:
-        raise SystemExit("Usage: python build_ree_cathedral.py /path/to/output/REE-Cathedral")
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Generate the REE Cathedral repository.")
+    parser.add_argument("out_dir", help="/path/to/output/REE-Cathedral")
+    parser.add_argument("--check", action="store_true", help="write nothing; exit 1 if the tree has drifted")
+    parser.add_argument("--no-prune", dest="prune", action="store_false", help="keep files no longer generated")
+    args = parser.parse_args()
+    raise SystemExit(main(args.out_dir, check=args.check, prune=args.prune))